@@ -0,0 +1,303 @@
+"""Cumulative traffic accounting and monthly quotas
+
+WireGuard's rx/tx counters live only as long as the peer entry: taking the
+interface down, or removing and re-adding a peer, starts them from zero
+again. The accounting engine follows the counters from snapshot to snapshot
+and adds up their increases into per-peer totals that never go backwards:
+
+- a counter lower than in the previous snapshot was reset and counts in full
+- a peer that was missing from the previous snapshot was (re)added and its
+  counters count in full
+- after `wg-quick down` every peer starts from zero (a snapshot of a stopped
+  interface proves nothing: failed samples look the same)
+
+Totals are kept in memory and written back with one unordered bulk_write of
+every account that changed since the last write, however many peers there
+are. Accounts store the last counters they saw, so a restart of the backend
+picks up where it left off.
+
+Clients over their monthly quota (rx + tx) are disabled like a manual
+disable, but marked with the month, and enabled again when the next month
+starts or their quota is raised. Enabling such a client by hand exempts it
+for the rest of the month.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+
+from traffic import counter_delta
+from wg_status import WGStatusSnapshot
+
+
+logger = logging.getLogger(__name__)
+
+# Client fields the quota checks need
+QUOTA_CLIENT_PROJECTION = {
+    "_id": 0, "id": 1, "public_key": 1, "ip_address": 1, "enabled": 1, "quota_bytes": 1, "quota_exceeded": 1
+}
+
+
+def month_of(ts: float) -> str:
+    """Accounting month (UTC) of an epoch timestamp, e.g. "2026-10\""""
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m")
+
+
+class Account:
+    """Cumulative and current-month byte counts of one peer"""
+
+    __slots__ = ("rx_total", "tx_total", "month", "month_rx", "month_tx", "last_rx", "last_tx")
+
+    def __init__(self, month: str, rx_total: int = 0, tx_total: int = 0, month_rx: int = 0, month_tx: int = 0,
+                 last_rx: int = 0, last_tx: int = 0):
+        self.rx_total = rx_total
+        self.tx_total = tx_total
+        self.month = month
+        self.month_rx = month_rx
+        self.month_tx = month_tx
+        self.last_rx = last_rx
+        self.last_tx = last_tx
+
+    @property
+    def month_bytes(self) -> int:
+        return self.month_rx + self.month_tx
+
+    def add(self, month: str, rx: int, tx: int):
+        if month != self.month:
+            self.month = month
+            self.month_rx = self.month_tx = 0
+        self.rx_total += rx
+        self.tx_total += tx
+        self.month_rx += rx
+        self.month_tx += tx
+
+    def to_dict(self) -> dict:
+        return {
+            "rx_total": self.rx_total,
+            "tx_total": self.tx_total,
+            "month": self.month,
+            "month_rx": self.month_rx,
+            "month_tx": self.month_tx,
+            "last_rx": self.last_rx,
+            "last_tx": self.last_tx,
+        }
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "Account":
+        return cls(
+            doc.get("month", ""),
+            doc.get("rx_total", 0),
+            doc.get("tx_total", 0),
+            doc.get("month_rx", 0),
+            doc.get("month_tx", 0),
+            doc.get("last_rx", 0),
+            doc.get("last_tx", 0),
+        )
+
+
+def quota_changes(
+    clients: List[dict], accounts: Dict[str, Account], month: str, default_quota: int
+) -> Tuple[List[dict], List[dict]]:
+    """(clients to disable, clients to enable again) for the current usage
+
+    A client's own `quota_bytes` overrides the default; 0 means unlimited.
+    """
+    disable, enable = [], []
+    for client in clients:
+        quota = client.get("quota_bytes")
+        if quota is None:
+            quota = default_quota
+        account = accounts.get(client["public_key"])
+        used = account.month_bytes if account is not None and account.month == month else 0
+        over = quota > 0 and used >= quota
+        exceeded = client.get("quota_exceeded")
+        if client.get("enabled", True):
+            # Enabled by hand after the quota hit: exempt until the month ends
+            if over and exceeded != month:
+                disable.append(client)
+        elif exceeded and (exceeded != month or not over):
+            enable.append(client)
+    return disable, enable
+
+
+class TrafficAccounting:
+    """Counter-reset-aware traffic totals and quota enforcement of one interface"""
+
+    def __init__(self, iface, default_quota: int = 0):
+        self.iface = iface
+        self.db = iface.db
+        self.default_quota = default_quota
+        self.accounts: Dict[str, Account] = {}
+        # Peers in the previous snapshot; None until the first one after load
+        self._present: Optional[Set[str]] = None
+        self._dirty: Set[str] = set()
+        self._month: Optional[str] = None
+        self._clients: List[dict] = []
+        self._clients_version: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self.writes = 0
+        self.quota_disabled = 0
+
+    async def setup(self):
+        try:
+            await self.db.traffic_accounting.create_index("peer", unique=True)
+        except Exception as e:
+            logger.error(f"Failed to create traffic_accounting index: {e}")
+
+    async def load(self):
+        """Read the persisted accounts of this interface"""
+        cursor = self.db.traffic_accounting.find({"interface": self.iface.name}, {"_id": 0})
+        self.accounts = {doc["peer"]: Account.from_doc(doc) async for doc in cursor}
+
+    def counters_reset(self):
+        """The interface went down: every counter starts from zero when it comes back"""
+        self._present = set()
+
+    def observe(self, snapshot: WGStatusSnapshot):
+        """Add the counter increases since the previous snapshot"""
+        if not snapshot.running:
+            return
+        month = month_of(snapshot.taken_at)
+        present = self._present
+        accounts = self.accounts
+        dirty = self._dirty
+        for peer in snapshot.peers:
+            key = peer.public_key
+            account = accounts.get(key)
+            if account is None:
+                # Never seen: whatever the counters hold is traffic not counted yet
+                account = accounts[key] = Account(month)
+            if present is not None and key not in present:
+                rx, tx = peer.rx_bytes, peer.tx_bytes
+            else:
+                rx = counter_delta(account.last_rx, peer.rx_bytes)
+                tx = counter_delta(account.last_tx, peer.tx_bytes)
+            if rx or tx or account.last_rx != peer.rx_bytes or account.last_tx != peer.tx_bytes or account.month != month:
+                account.add(month, rx, tx)
+                account.last_rx = peer.rx_bytes
+                account.last_tx = peer.tx_bytes
+                dirty.add(key)
+        self._present = set(snapshot.peers_by_key)
+        # Quotas are checked again after traffic, a new month or a client change
+        if dirty or month != self._month or self.iface.client_index.version != self._clients_version:
+            self._month = month
+            self._schedule()
+
+    def _schedule(self):
+        # One write in flight at a time; what changes meanwhile goes into the next
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._flush_and_enforce())
+
+    async def _flush_and_enforce(self):
+        try:
+            await self.flush()
+            await self.enforce_quotas()
+        except Exception as e:
+            logger.error(f"Traffic accounting for {self.iface.name} failed: {e}")
+
+    async def flush(self):
+        """Write every changed account in a single bulk_write"""
+        dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+        now = datetime.now(timezone.utc)
+        name = self.iface.name
+        operations = [
+            UpdateOne(
+                {"peer": key},
+                {"$set": {"interface": name, **self.accounts[key].to_dict(), "updated_at": now}},
+                upsert=True,
+            )
+            for key in dirty if key in self.accounts
+        ]
+        try:
+            await self.db.traffic_accounting.bulk_write(operations, ordered=False)
+            self.writes += 1
+        except Exception as e:
+            logger.error(f"Failed to write traffic accounting for {name}: {e}")
+            # Documents hold absolute values, so retrying them later is safe
+            self._dirty |= dirty
+
+    async def _quota_clients(self) -> List[dict]:
+        """Quota-relevant client fields, re-read only when a client changed"""
+        index = self.iface.client_index
+        if index.version != self._clients_version:
+            version = index.version
+            self._clients = await self.db.clients.find(self.iface.clients_filter, QUOTA_CLIENT_PROJECTION).to_list(None)
+            self._clients_version = version
+        return self._clients
+
+    async def enforce_quotas(self):
+        """Disable clients over their monthly quota, enable those whose quota was lifted"""
+        month = self._month
+        if month is None:
+            return
+        disable, enable = quota_changes(await self._quota_clients(), self.accounts, month, self.default_quota)
+        if not disable and not enable:
+            return
+
+        iface = self.iface
+        if disable:
+            await self.db.clients.update_many(
+                {"id": {"$in": [c["id"] for c in disable]}},
+                {"$set": {"enabled": False, "quota_exceeded": month}}
+            )
+            for c in disable:
+                iface.client_index.touch(c["id"])
+            await iface.remove_peers([c["public_key"] for c in disable])
+            self.quota_disabled += len(disable)
+            logger.info(f"Disabled {len(disable)} clients of {iface.name} over their {month} traffic quota")
+        if enable:
+            await self.db.clients.update_many(
+                {"id": {"$in": [c["id"] for c in enable]}},
+                {"$set": {"enabled": True}, "$unset": {"quota_exceeded": ""}}
+            )
+            for c in enable:
+                iface.client_index.touch(c["id"])
+            await iface.add_peers([(c["public_key"], c["ip_address"]) for c in enable])
+            logger.info(f"Enabled {len(enable)} clients of {iface.name} again after their traffic quota")
+
+    def usage(self, client: dict) -> dict:
+        """Totals, month usage and quota of one client"""
+        account = self.accounts.get(client["public_key"])
+        month = self._month
+        quota = client.get("quota_bytes")
+        if quota is None:
+            quota = self.default_quota
+        month_bytes = account.month_bytes if account is not None and account.month == month else 0
+        return {
+            "rx_total": account.rx_total if account else 0,
+            "tx_total": account.tx_total if account else 0,
+            "month": month,
+            "month_bytes": month_bytes,
+            "quota_bytes": quota or None,
+            "quota_remaining": max(quota - month_bytes, 0) if quota else None,
+            "quota_exceeded": client.get("quota_exceeded"),
+        }
+
+    async def forget(self, public_key: str):
+        """Drop the account of a deleted client"""
+        self.accounts.pop(public_key, None)
+        self._dirty.discard(public_key)
+        await self.db.traffic_accounting.delete_one({"peer": public_key})
+
+    def stats(self) -> dict:
+        return {
+            "accounts": len(self.accounts),
+            "pending": len(self._dirty),
+            "writes": self.writes,
+            "quota_disabled": self.quota_disabled,
+            "default_quota": self.default_quota,
+        }
+
+    async def stop(self):
+        """Wait for a write in flight and write what is left"""
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,109 @@
+"""Bulk client creation with streamed progress
+
+The clients are inserted in chunks, and each chunk is reported as NDJSON
+lines as soon as it is written. All created clients are then added to the
+interface with a single `wg set`. The work runs in a task of its own: a
+caller that disconnects mid-stream only stops getting progress, it never
+leaves clients in the database without their peers.
+"""
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from pymongo.errors import BulkWriteError
+
+
+logger = logging.getLogger(__name__)
+
+# Running creations, referenced until done so they are not garbage collected
+_running: Set[asyncio.Task] = set()
+
+
+class BulkCreate:
+    """Inserts prepared client documents and applies their peers
+
+    `docs` already carry their keys and reserved IPs; IPs of clients that
+    were not written are released again, except for duplicates, which
+    another worker took meanwhile.
+    """
+
+    def __init__(self, iface, collection, docs: List[dict], chunk_size: int = 500):
+        self.iface = iface
+        self.collection = collection
+        self.docs = docs
+        self.chunk_size = chunk_size
+        self.task: Optional[asyncio.Task] = None
+        self._lines: asyncio.Queue = asyncio.Queue()
+
+    def start(self) -> "BulkCreate":
+        self.task = asyncio.ensure_future(self._run())
+        _running.add(self.task)
+        self.task.add_done_callback(_running.discard)
+        return self
+
+    async def lines(self) -> AsyncIterator[str]:
+        """Progress lines until the final `done` line"""
+        while True:
+            line = await self._lines.get()
+            if line is None:
+                return
+            yield line
+
+    def _emit(self, line: dict):
+        self._lines.put_nowait(json.dumps(line) + "\n")
+
+    async def _insert(self, chunk: List[dict]) -> Dict[str, str]:
+        """Write one chunk, returning {client id: error} of the documents that failed"""
+        failed = {}
+        try:
+            await self.collection.insert_many(chunk, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                doc = chunk[error["index"]]
+                failed[doc["id"]] = error.get("errmsg", "Insert failed")
+                if error.get("code") != 11000:
+                    self.iface.ip_pool.release(doc["ip_address"])
+        return failed
+
+    async def _run(self):
+        created = []
+        failed = 0
+        error = None
+        try:
+            for start in range(0, len(self.docs), self.chunk_size):
+                chunk = self.docs[start:start + self.chunk_size]
+                try:
+                    chunk_failed = await self._insert(chunk)
+                except Exception as e:
+                    logger.error(f"Bulk insert into {self.iface.name} failed: {e}")
+                    error = str(e)
+                    # Whether the failed chunk was written is unknown, so its IPs
+                    # stay reserved; the ones never sent are free again
+                    for doc in self.docs[start + self.chunk_size:]:
+                        self.iface.ip_pool.release(doc["ip_address"])
+                    for doc in self.docs[start:]:
+                        self._emit({"status": "failed", "name": doc["name"], "error": error})
+                    failed += len(self.docs) - start
+                    break
+
+                for doc in chunk:
+                    doc.pop("_id", None)
+                    if doc["id"] in chunk_failed:
+                        failed += 1
+                        self._emit({"status": "failed", "name": doc["name"], "error": chunk_failed[doc["id"]]})
+                    else:
+                        self.iface.client_index.touch(doc["id"])
+                        created.append(doc)
+                        self._emit({"status": "created", "client": doc})
+
+            applied = await self.iface.add_peers([(doc["public_key"], doc["ip_address"]) for doc in created])
+            done = {"status": "done", "created": len(created), "failed": failed, "config_applied": applied}
+            if error is not None:
+                done["error"] = error
+            self._emit(done)
+        except Exception as e:
+            logger.error(f"Applying {len(created)} new peers to {self.iface.name} failed: {e}")
+            self._emit({"status": "done", "created": len(created), "failed": failed, "config_applied": False, "error": str(e)})
+        finally:
+            self._lines.put_nowait(None)
@@ -0,0 +1,109 @@
+"""Keyset pagination for the client list
+
+Pages are addressed by an opaque cursor holding the sort value and id of
+the last client on the previous page, and the next page starts right after
+them in the (interface, <sort field>, id) index. Every page is one index
+range scan of `limit` entries, however deep it is, unlike skip/offset
+paging which walks all skipped entries again.
+"""
+import base64
+import json
+import re
+from typing import Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING
+
+
+# Sort orders the list supports; each has an (interface, field, id) index
+SORT_FIELDS = ("created_at", "name")
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+# Fields of a list item: no key material, fetch the config for that
+LIST_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "interface": 1,
+    "name": 1,
+    "ip_address": 1,
+    "created_at": 1,
+    "enabled": 1,
+    "os_info": 1,
+}
+
+
+def encode_cursor(sort: str, value, client_id: str) -> str:
+    raw = json.dumps([sort, value, client_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[object, str]:
+    """(sort value, id) of a cursor; ValueError if it is not one of ours for this sort"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, client_id = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("Cursor belongs to a different sort order")
+    if not isinstance(client_id, str) or not isinstance(value, (str, int, float, type(None))):
+        raise ValueError("Invalid cursor")
+    return value, client_id
+
+
+def client_filter(
+    base: dict,
+    name_prefix: Optional[str] = None,
+    enabled: Optional[bool] = None,
+    os_info: Optional[str] = None,
+    public_keys: Optional[Iterable[str]] = None,
+    exclude_public_keys: bool = False,
+) -> dict:
+    """Mongo filter for the list filters
+
+    `public_keys` restricts the list to (or with `exclude_public_keys`,
+    away from) a set of peers, e.g. the currently connected ones.
+    """
+    query = dict(base)
+    if name_prefix:
+        # Anchored and case-sensitive, so it is answered from the name index
+        query["name"] = {"$regex": f"^{re.escape(name_prefix)}"}
+    if enabled is not None:
+        # Clients from before the flag existed count as enabled
+        query["enabled"] = {"$ne": False} if enabled else False
+    if os_info is not None:
+        query["os_info"] = os_info
+    if public_keys is not None:
+        query["public_key"] = {"$nin" if exclude_public_keys else "$in": list(public_keys)}
+    return query
+
+
+def page_query(query: dict, sort: str, descending: bool, cursor: Optional[str]) -> Tuple[dict, list]:
+    """Filter and sort spec for the page after `cursor`"""
+    if sort not in SORT_FIELDS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_FIELDS)}")
+    direction = DESCENDING if descending else ASCENDING
+    sort_spec = [(sort, direction), ("id", direction)]
+    if cursor is None:
+        return query, sort_spec
+
+    value, client_id = decode_cursor(cursor, sort)
+    after = "$lt" if descending else "$gt"
+    keyset = {"$or": [{sort: {after: value}}, {sort: value, "id": {after: client_id}}]}
+    if not query:
+        return keyset, sort_spec
+    return {"$and": [query, keyset]}, sort_spec
+
+
+def next_cursor(items: List[dict], sort: str, limit: int) -> Optional[str]:
+    """Cursor for the page after `items`, None on the last page
+
+    Callers fetch `limit + 1` items; the extra one only tells whether there
+    is a next page and is dropped from `items` here.
+    """
+    if len(items) <= limit:
+        return None
+    del items[limit:]
+    last = items[-1]
+    return encode_cursor(sort, last.get(sort), last["id"])
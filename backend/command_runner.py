@@ -0,0 +1,93 @@
+"""Non-blocking command execution
+
+Runs child processes with asyncio so a slow `wg-quick` or SSH call never
+stalls the event loop. Every call keeps the (stdout, stderr, returncode)
+contract of the old `subprocess.run` based helper.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from latency import LatencyStats
+from tracing import record as record_span
+
+
+logger = logging.getLogger(__name__)
+
+# stderr of a command killed after its timeout
+TIMED_OUT = "Command timed out"
+
+
+class CommandRunner:
+    """Runs commands as asyncio subprocesses with bounded concurrency"""
+
+    def __init__(self, max_concurrency: int = 8, timeout: float = 10.0):
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Program name -> latency, including the wait for a free slot
+        self.latency: Dict[str, LatencyStats] = {}
+
+    @staticmethod
+    def program(cmd: List[str]) -> str:
+        """Name a command by the program it runs (`sudo wg ...` counts as `wg`)"""
+        args = cmd[1:] if cmd and os.path.basename(cmd[0]) == "sudo" and len(cmd) > 1 else cmd
+        return os.path.basename(args[0]) if args else ""
+
+    def _observe(self, cmd: List[str], seconds: float):
+        program = self.program(cmd)
+        stats = self.latency.get(program)
+        if stats is None:
+            stats = self.latency[program] = LatencyStats()
+        stats.observe(seconds)
+        record_span(f"cmd.{program}", seconds)
+
+    async def run(
+        self,
+        cmd: List[str],
+        input: Optional[bytes] = None,
+        timeout: Optional[float] = None,
+    ) -> tuple[str, str, int]:
+        """Run a command, killing it on timeout or cancellation"""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        try:
+            return await self._run(cmd, input, timeout)
+        finally:
+            self._observe(cmd, time.perf_counter() - start)
+
+    async def _run(self, cmd: List[str], input: Optional[bytes], timeout: float) -> tuple[str, str, int]:
+        async with self._semaphore:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+            except Exception as e:
+                return "", str(e), 1
+
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(input), timeout)
+            except asyncio.TimeoutError:
+                await self._kill(process)
+                logger.warning(f"Command timed out after {timeout}s: {cmd[0]}")
+                return "", TIMED_OUT, 1
+            except asyncio.CancelledError:
+                await self._kill(process)
+                raise
+
+            return stdout.decode(errors="replace"), stderr.decode(errors="replace"), process.returncode
+
+    @staticmethod
+    async def _kill(process: asyncio.subprocess.Process):
+        """Kill the child and reap it so no zombie is left behind"""
+        if process.returncode is not None:
+            return
+        try:
+            process.kill()
+        except ProcessLookupError:
+            return
+        await asyncio.shield(process.wait())
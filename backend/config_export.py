@@ -0,0 +1,80 @@
+"""Streaming ZIP export of client configs
+
+The archive is written into an unseekable buffer that the response drains
+after every entry, so only the entry being written is held in memory, not
+the archive. zipfile notices the missing seek() and writes each entry's CRC
+and sizes into a data descriptor after its data instead of going back to
+patch the local header. The central directory at the end still has one
+small record per entry, which zipfile keeps until the archive is closed.
+"""
+import re
+import zipfile
+from datetime import datetime
+from typing import Optional, Set
+
+# Flush to the client once this much archive data is buffered
+CHUNK_SIZE = 64 * 1024
+
+# Entries are readable by the owner only: configs hold private keys
+ENTRY_MODE = 0o600
+
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+class ChunkBuffer:
+    """Write-only, unseekable file object whose contents are taken with drain()"""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.size = 0
+        return data
+
+
+def entry_basename(name: str, client_id: str, used: Set[str]) -> str:
+    """File name (without extension) for a client, unique within the archive"""
+    base = _UNSAFE_CHARS.sub("_", name).strip("._") or "client"
+    for candidate in (base, f"{base}-{client_id[:8]}", f"{base}-{client_id}"):
+        if candidate not in used:
+            used.add(candidate)
+            return candidate
+    # Only reachable with duplicate client ids
+    raise ValueError(f"Duplicate client id in export: {client_id}")
+
+
+class ZipExport:
+    """Incrementally built ZIP archive; add() and close() return the bytes to send"""
+
+    def __init__(self, created: Optional[datetime] = None):
+        self._buffer = ChunkBuffer()
+        self._zip = zipfile.ZipFile(self._buffer, "w")
+        self._date_time = (created or datetime.now()).timetuple()[:6]
+        self.entries = 0
+
+    def add(self, name: str, data: bytes, compress: bool = True) -> bytes:
+        """Append an entry, returning whatever archive data is ready to send"""
+        info = zipfile.ZipInfo(name, date_time=self._date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        info.external_attr = (0o100000 | ENTRY_MODE) << 16
+        self._zip.writestr(info, data)
+        self.entries += 1
+        if self._buffer.size < CHUNK_SIZE:
+            return b""
+        return self._buffer.drain()
+
+    def close(self) -> bytes:
+        """Finish the archive, returning the remaining data and the central directory"""
+        self._zip.close()
+        return self._buffer.drain()
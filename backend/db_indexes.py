@@ -0,0 +1,125 @@
+"""Mongo index bootstrap and query plan checks
+
+Every lookup the API does by key has a unique index behind it. The indexes
+are created at startup (a no-op when they already exist) and the lookup
+paths are then explained, so a missing or unusable index shows up in the
+log instead of as a slow collection scan at 100k clients.
+"""
+import logging
+from typing import Dict, Iterator, List, Tuple
+
+from pymongo import ASCENDING
+
+
+logger = logging.getLogger(__name__)
+
+# collection -> unique indexes, each a tuple of fields
+UNIQUE_INDEXES: Dict[str, Tuple[Tuple[str, ...], ...]] = {
+    "users": (("username",),),
+    "clients": (("id",), ("public_key",), ("interface", "ip_address")),
+    "interfaces": (("name",),),
+}
+
+# collection -> indexes the list endpoints sort and page on
+SORT_INDEXES: Dict[str, Tuple[Tuple[str, ...], ...]] = {
+    "clients": (("interface", "created_at", "id"), ("interface", "name", "id")),
+}
+
+# Indexes replaced by the ones above: addresses are only unique per interface
+OBSOLETE_INDEXES: Dict[str, Tuple[str, ...]] = {
+    "clients": ("ip_address_1",),
+}
+
+# Lookups that must be answered from an index: (collection, sample filter)
+LOOKUPS: List[Tuple[str, dict]] = [
+    ("users", {"username": "admin"}),
+    ("clients", {"id": "00000000-0000-0000-0000-000000000000"}),
+    ("clients", {"public_key": "AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA="}),
+    ("clients", {"interface": "wg0", "ip_address": "10.8.0.2"}),
+]
+
+# Plan stages that mean the query was answered from an index
+INDEX_STAGES = {"IXSCAN", "IDHACK", "EXPRESS_IXSCAN", "EXPRESS_IDHACK"}
+
+
+async def ensure_indexes(db) -> List[str]:
+    """Create the unique and sort indexes; returns the ones that could not be created"""
+    failed = []
+    for collection, names in OBSOLETE_INDEXES.items():
+        try:
+            existing = await db[collection].index_information()
+            for name in names:
+                if name in existing:
+                    await db[collection].drop_index(name)
+        except Exception as e:
+            logger.error(f"Failed to drop obsolete indexes on {collection}: {e}")
+    for collection, indexes in UNIQUE_INDEXES.items():
+        for fields in indexes:
+            name = f"{collection}.{', '.join(fields)}"
+            try:
+                # Default index names, so indexes created earlier are reused
+                await db[collection].create_index([(field, ASCENDING) for field in fields], unique=True)
+            except Exception as e:
+                # Typically duplicates in existing data; lookups still work, just slower
+                logger.error(f"Failed to create unique index on {name}: {e}")
+                failed.append(name)
+    for collection, indexes in SORT_INDEXES.items():
+        for fields in indexes:
+            try:
+                await db[collection].create_index([(field, ASCENDING) for field in fields])
+            except Exception as e:
+                logger.error(f"Failed to create index on {collection}.{', '.join(fields)}: {e}")
+                failed.append(f"{collection}.{', '.join(fields)}")
+    return failed
+
+
+def plan_stages(plan: dict) -> Iterator[str]:
+    """All stage names of an explain plan tree"""
+    stage = plan.get("stage")
+    if stage:
+        yield stage
+    for key in ("inputStage", "queryPlan"):
+        if isinstance(plan.get(key), dict):
+            yield from plan_stages(plan[key])
+    for child in plan.get("inputStages", ()):
+        yield from plan_stages(child)
+
+
+def winning_plan(explain: dict) -> dict:
+    return explain.get("queryPlanner", {}).get("winningPlan", {})
+
+
+def uses_index(explain: dict) -> bool:
+    stages = set(plan_stages(winning_plan(explain)))
+    return bool(stages & INDEX_STAGES) and "COLLSCAN" not in stages
+
+
+async def explain_find(db, collection: str, filter: dict, verbosity: str = "queryPlanner") -> dict:
+    """Explain a find_one() style query"""
+    return await db.command(
+        "explain",
+        {"find": collection, "filter": filter, "limit": 1, "singleBatch": True},
+        verbosity=verbosity,
+    )
+
+
+async def verify_lookups(db) -> List[str]:
+    """Lookups whose plan does not use an index, as "collection.field" """
+    unindexed = []
+    for collection, filter in LOOKUPS:
+        name = f"{collection}.{', '.join(filter)}"
+        try:
+            explain = await explain_find(db, collection, filter)
+        except Exception as e:
+            logger.warning(f"Could not explain lookup on {name}: {e}")
+            continue
+        if not uses_index(explain):
+            unindexed.append(name)
+    return unindexed
+
+
+async def bootstrap_indexes(db):
+    """Startup hook: create indexes, then check the lookup plans"""
+    await ensure_indexes(db)
+    for name in await verify_lookups(db):
+        logger.warning(f"Lookup on {name} does not use an index")
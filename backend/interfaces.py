@@ -0,0 +1,525 @@
+"""Managed WireGuard interfaces
+
+Everything that used to be tied to the single hard-coded `wg0` lives in a
+WGInterface bundle: its command transport (local or SSH), address pool,
+status sampler, config file model and persister, traffic recorder and
+accounting, and the client and stats versions. The default interface is still configured from
+the environment; further interfaces, possibly on other nodes, are registered
+in the `interfaces` collection.
+
+Each interface samples its own node on its own schedule, and requests that
+span all interfaces poll them concurrently with a per-node timeout, so one
+slow or unreachable gateway delays nothing but its own entry.
+"""
+import asyncio
+import ipaddress
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel, Field, field_validator
+
+from accounting import TrafficAccounting
+from command_runner import TIMED_OUT, CommandRunner
+from ip_pool import IPPool
+from live_stats import StatsBroadcaster
+from reconciler import Reconciler
+from server_config import ServerConfigStore
+from ssh_transport import SSHTransport
+from traffic import TrafficRecorder
+from versioning import VersionedIndex
+from wg_config import ConfigPersister, PeerChanges, WGConfig, stream_config, temp_config_file
+from wg_status import STATS_CLIENT_PROJECTION, StatusSampler, WGStatusSnapshot, join_client_stats, parse_wg_dump
+
+
+logger = logging.getLogger(__name__)
+
+WG_CONFIG_DIR = Path("/etc/wireguard")
+
+# Use full paths for system commands
+CMD_MAP = {
+    "wg": "/usr/bin/wg",
+    "wg-quick": "/usr/bin/wg-quick",
+    "sudo": "/usr/bin/sudo"
+}
+
+
+# A DNS name: dot-separated labels of letters, digits and inner hyphens
+HOSTNAME_LABEL = r"[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?"
+HOSTNAME_PATTERN = re.compile(rf"^(?=.{{1,253}}$){HOSTNAME_LABEL}(?:\.{HOSTNAME_LABEL})*\.?$")
+
+
+class NodeSpec(BaseModel):
+    """SSH target of a remote gateway
+
+    `user` and `host` end up on the ssh command line, so they are limited
+    to what cannot be read as an option.
+    """
+    host: str
+    port: int = Field(22, ge=1, le=65535)
+    user: str = Field("root", pattern=r"^[A-Za-z0-9._][A-Za-z0-9._-]*$")
+    key_path: str = ""
+
+    @field_validator("host")
+    @classmethod
+    def _valid_host(cls, value: str) -> str:
+        try:
+            return str(ipaddress.ip_address(value))
+        except ValueError:
+            pass
+        if not HOSTNAME_PATTERN.match(value):
+            raise ValueError(f"Not a hostname or IP address: {value!r}")
+        return value
+
+
+class InterfaceSpec(BaseModel):
+    """Registry entry of a managed interface"""
+    name: str = Field(..., pattern=r"^[A-Za-z0-9_=+.-]{1,15}$")
+    network: str
+    address: Optional[str] = None
+    listen_port: int = Field(51820, ge=1, le=65535)
+    endpoint_host: str
+    node: Optional[NodeSpec] = None
+
+    @field_validator("network")
+    @classmethod
+    def _valid_network(cls, value: str) -> str:
+        return str(ipaddress.ip_network(value, strict=False))
+
+    @property
+    def node_key(self) -> Optional[Tuple[str, int, str]]:
+        return (self.node.host, self.node.port, self.node.user) if self.node else None
+
+
+class WGInterface:
+    """One managed interface and all of its per-interface state"""
+
+    def __init__(
+        self,
+        spec: InterfaceSpec,
+        db,
+        runner: CommandRunner,
+        transport: Optional[SSHTransport] = None,
+        status_interval: float = 5.0,
+        status_timeout: float = 5.0,
+        config_flush_delay: float = 1.0,
+        set_batch: int = 256,
+        traffic_flush_interval: float = 30.0,
+        traffic_retention_days: int = 7,
+        config_dir: Path = WG_CONFIG_DIR,
+        commands: Optional[Dict[str, str]] = None,
+        reconcile_interval: float = 60.0,
+        monthly_quota: int = 0,
+    ):
+        self.spec = spec
+        self.name = spec.name
+        self.db = db
+        self.runner = runner
+        self.transport = transport
+        self.status_timeout = status_timeout
+        self.set_batch = set_batch
+        self.config_dir = config_dir
+        self.commands = {**CMD_MAP, **(commands or {})}
+
+        self.network = ipaddress.ip_network(spec.network, strict=False)
+        self.address = spec.address or str(next(self.network.hosts()))
+        self.endpoint = f"{spec.endpoint_host}:{spec.listen_port}"
+        self.config_path = f"{config_dir}/{self.name}.conf"
+
+        # Client tunnel addresses; the unique (interface, ip_address) index is
+        # the final arbiter when several workers allocate at once
+        self.ip_pool = IPPool(spec.network, reserved=[self.address])
+        self.server_config = ServerConfigStore(db.server_config, self.name)
+
+        # Change versions for ETag and `?since=` responses
+        self.client_index = VersionedIndex()
+        self.stats_index = VersionedIndex()
+        # (snapshot time, client version, running) the stats index was built from
+        self.stats_source: Optional[tuple] = None
+
+        # Shared status snapshot, refreshed in the background
+        self.status_sampler = StatusSampler(self.get_status, interval=status_interval)
+
+        # Per-peer traffic history, fed by every snapshot
+        self.traffic = TrafficRecorder(db, flush_interval=traffic_flush_interval, retention_days=traffic_retention_days)
+        self.status_sampler.subscribe(self.traffic.observe)
+
+        # Cumulative per-peer totals across counter resets, and monthly quotas
+        self.accounting = TrafficAccounting(self, default_quota=monthly_quota)
+        self.status_sampler.subscribe(self.accounting.observe)
+
+        # Parsed config file, loaded on the first write
+        self.config_model: Optional[WGConfig] = None
+
+        # Live changes go through `wg set`; the config file catches up in the background
+        self.config_persister = ConfigPersister(self.persist_peer_changes, delay=config_flush_delay)
+
+        # One stats build per snapshot, shared by every open dashboard
+        self.stats_broadcaster = StatsBroadcaster(self.live_stats)
+        self.status_sampler.subscribe(self.stats_broadcaster.on_snapshot)
+
+        # Repairs drift between Mongo, the kernel peer table and the config file
+        self.reconciler = Reconciler(self, interval=reconcile_interval)
+
+    @property
+    def prefix(self) -> int:
+        return self.network.prefixlen
+
+    @property
+    def clients_filter(self) -> dict:
+        return {"interface": self.name}
+
+    async def run_command(
+        self, cmd: List[str], input: Optional[bytes] = None, timeout: Optional[float] = None
+    ) -> Tuple[str, str, int]:
+        """Run a command on this interface's node"""
+        # Replace all occurrences in the command, not just the first one
+        cmd = [self.commands.get(str(c), str(c)) for c in cmd]
+
+        if self.transport:
+            return await self.transport.run(cmd, input=input, timeout=timeout)
+        return await self.runner.run(cmd, input=input, timeout=timeout)
+
+    async def get_status(self) -> dict:
+        """Get WireGuard interface status"""
+        stdout, stderr, code = await self.run_command(
+            ["sudo", "wg", "show", self.name, "dump"], timeout=self.status_timeout
+        )
+
+        if code != 0:
+            # Without an answer from the node nothing is known about the interface
+            if stderr == TIMED_OUT:
+                raise RuntimeError(f"wg show timed out after {self.status_timeout}s")
+            if self.transport and code == 255:
+                raise RuntimeError(f"{self.transport.host} unreachable: {stderr.strip()}")
+            return {"running": False, "peers": []}
+
+        return {"running": True, "peers": parse_wg_dump(stdout)}
+
+    async def wg_quick(self, action: str) -> Tuple[str, str, int]:
+        """Run `wg-quick <action>` and publish a snapshot taken after it"""
+        if action == "down":
+            # Count the traffic up to now, the counters go away with the interface
+            await self.status_sampler.fresh()
+        result = await self.run_command(["sudo", "wg-quick", action, self.name])
+        # Not refresh(): it could join a sample started before the command
+        await self.status_sampler.fresh()
+        if action == "down" and result[2] == 0:
+            # No sample from before the down is left to apply, start counting from zero
+            self.accounting.counters_reset()
+        return result
+
+    async def status(self, snapshot: WGStatusSnapshot) -> dict:
+        """Server status as shown on the dashboard"""
+        config = await self.server_config.get()
+
+        if not config:
+            return {"interface": self.name, "initialized": False, "running": False}
+
+        return {
+            "interface": self.name,
+            "initialized": True,
+            "running": snapshot.running,
+            "public_key": config.public_key,
+            "address": config.address,
+            "port": config.port,
+            "sampled_at": datetime.fromtimestamp(snapshot.taken_at, timezone.utc).isoformat(),
+        }
+
+    def client_allowed_ips(self) -> str:
+        """Routes a client sends through the tunnel"""
+        return "0.0.0.0/0" if self.network.version == 4 else "::/0"
+
+    def peer_allowed_ips(self, ip: str) -> str:
+        """AllowedIPs of a client peer on the server side"""
+        return f"{ip}/{self.ip_pool.host_prefix}"
+
+    def render_interface_section(self, private_key: str) -> str:
+        """[Interface] section of the server config"""
+        iptables = "iptables" if self.network.version == 4 else "ip6tables"
+        return f"""[Interface]
+PrivateKey = {private_key}
+Address = {self.address}/{self.prefix}
+ListenPort = {self.spec.listen_port}
+PostUp = {iptables} -A FORWARD -i %i -j ACCEPT; {iptables} -t nat -A POSTROUTING -o eth0 -j MASQUERADE
+PostDown = {iptables} -D FORWARD -i %i -j ACCEPT; {iptables} -t nat -D POSTROUTING -o eth0 -j MASQUERADE
+"""
+
+    async def wg_set_peers(self, add: List[Tuple[str, str]] = (), remove: List[str] = ()) -> bool:
+        """Apply peer changes to the running interface with targeted `wg set` calls"""
+        if not self.status_sampler.snapshot.running:
+            # The config file is loaded when the interface comes up
+            return True
+
+        clauses = [["peer", public_key, "allowed-ips", self.peer_allowed_ips(ip)] for public_key, ip in add]
+        clauses += [["peer", public_key, "remove"] for public_key in remove]
+        return await self.wg_set_clauses(clauses)
+
+    async def wg_set_clauses(self, clauses: List[List[str]]) -> bool:
+        """Run `peer ...` clauses through as few `wg set` invocations as possible"""
+        # One invocation handles many peers; batch to stay within argv limits
+        ok = True
+        for i in range(0, len(clauses), self.set_batch):
+            cmd = ["sudo", "wg", "set", self.name]
+            for clause in clauses[i:i + self.set_batch]:
+                cmd.extend(clause)
+            stdout, stderr, code = await self.run_command(cmd)
+            if code != 0:
+                logger.error(f"Failed to update peers on {self.name} with wg set: {stderr}")
+                ok = False
+        return ok
+
+    async def install_config_file(self, local_path: str):
+        """Atomically replace the interface config with a rendered temp file"""
+        staging = f"{self.config_path}.tmp"
+        try:
+            if self.transport:
+                # Transfer via SSH, the temp path is reused on the remote side
+                stdout, stderr, code = await self.transport.copy_to(local_path, local_path)
+                if code != 0:
+                    raise RuntimeError(f"Failed to copy config: {stderr}")
+
+            # Rename within the same directory so readers never see a partial file
+            for cmd in (
+                ["sudo", "mkdir", "-p", str(self.config_dir)],
+                ["sudo", "install", "-m", "600", local_path, staging],
+                ["sudo", "mv", "-f", staging, self.config_path],
+            ):
+                stdout, stderr, code = await self.run_command(cmd)
+                if code != 0:
+                    raise RuntimeError(f"Failed to install config: {stderr}")
+        finally:
+            os.unlink(local_path)
+            if self.transport:
+                await self.run_command(["rm", "-f", local_path])
+
+    async def write_config(self, config: WGConfig):
+        """Render a config model and install it atomically"""
+        path, out = temp_config_file()
+        with out:
+            config.write(out)
+        await self.install_config_file(path)
+
+    async def load_config(self) -> WGConfig:
+        """Parse the current config file, or rebuild it if it cannot be read"""
+        stdout, stderr, code = await self.run_command(["sudo", "cat", self.config_path])
+        if code == 0 and stdout.strip():
+            return WGConfig.parse(stdout)
+        return await self.rebuild_config()
+
+    async def rebuild_config(self) -> WGConfig:
+        """Rewrite the config file from the clients collection in one streaming pass"""
+        server_config = await self.server_config.get()
+        if not server_config:
+            raise RuntimeError("Server not initialized")
+
+        # Keep a hand-edited [Interface] section if we have one
+        if self.config_model:
+            interface = self.config_model.interface
+        else:
+            interface = self.render_interface_section(server_config.private_key)
+        cursor = self.db.clients.find(
+            {**self.clients_filter, "enabled": {"$ne": False}},
+            {"_id": 0, "public_key": 1, "ip_address": 1}
+        )
+        peers = ((c["public_key"], self.peer_allowed_ips(c["ip_address"])) async for c in cursor)
+
+        path, out = temp_config_file()
+        with out:
+            config = await stream_config(interface, peers, out)
+        await self.install_config_file(path)
+        return config
+
+    async def persist_peer_changes(self, changes: PeerChanges):
+        """Apply coalesced peer changes to the config model and rewrite the file"""
+        if self.config_model is None:
+            self.config_model = await self.load_config()
+        self.config_model.apply(changes)
+        await self.write_config(self.config_model)
+
+    async def add_peers(self, peers: List[Tuple[str, str]]) -> bool:
+        """Add (public_key, ip) peers to the interface and the config file"""
+        for public_key, ip in peers:
+            self.config_persister.add_peer(public_key, self.peer_allowed_ips(ip))
+        return await self.wg_set_peers(add=peers)
+
+    async def remove_peers(self, public_keys: List[str]) -> bool:
+        """Remove peers from the interface and the config file"""
+        for public_key in public_keys:
+            self.config_persister.remove_peer(public_key)
+        return await self.wg_set_peers(remove=public_keys)
+
+    async def refresh_stats_index(self) -> WGStatusSnapshot:
+        """Bring the stats index up to date with the current snapshot"""
+        snapshot = await self.status_sampler.current()
+        source = (snapshot.taken_at, self.client_index.version, snapshot.running)
+        if source != self.stats_source:
+            all_clients = await self.db.clients.find(self.clients_filter, STATS_CLIENT_PROJECTION).to_list(None)
+
+            # Match clients with active peers
+            self.stats_index.update({c["id"]: c for c in join_client_stats(all_clients, snapshot, self.accounting.accounts)})
+            if self.stats_source is not None and self.stats_source[2] != snapshot.running:
+                self.stats_index.bump()
+            self.stats_source = source
+        return snapshot
+
+    async def live_stats(self, snapshot: WGStatusSnapshot) -> Tuple[dict, List[dict]]:
+        """Server status and client stats rows for one snapshot"""
+        server = await self.status(snapshot)
+        all_clients = await self.db.clients.find(self.clients_filter, STATS_CLIENT_PROJECTION).to_list(None)
+        return server, join_client_stats(all_clients, snapshot, self.accounting.accounts)
+
+    async def load(self):
+        """Load the server config, used addresses and client versions"""
+        await self.server_config.load()
+        cursor = self.db.clients.find(self.clients_filter, {"_id": 0, "id": 1, "ip_address": 1})
+        ids = []
+        async for c in cursor:
+            ids.append((c["id"], None))
+            if c.get("ip_address"):
+                self.ip_pool.mark_used(c["ip_address"])
+        # Register all existing clients at the index's base version
+        self.client_index.load(ids)
+        await self.accounting.load()
+
+    async def start(self):
+        await self.traffic.setup()
+        await self.accounting.setup()
+        self.traffic.start()
+        self.status_sampler.start()
+        self.reconciler.start()
+
+    async def stop(self):
+        await self.reconciler.stop()
+        await self.status_sampler.stop()
+        await self.stats_broadcaster.stop()
+        await self.traffic.stop()
+        await self.accounting.stop()
+        await self.config_persister.stop()
+
+
+class InterfaceRegistry:
+    """All managed interfaces, with SSH transports shared per node"""
+
+    def __init__(
+        self,
+        db,
+        runner: CommandRunner,
+        default: InterfaceSpec,
+        ssh_options: Optional[dict] = None,
+        key_dir: Optional[Path] = None,
+        **options,
+    ):
+        self.db = db
+        self.runner = runner
+        self.default = default
+        self.ssh_options = ssh_options or {}
+        # Registered nodes may only use SSH keys from here (none if unset)
+        self.key_dir = key_dir
+        self.options = options
+        self._interfaces: Dict[str, WGInterface] = {}
+        self._transports: Dict[Tuple[str, int, str], SSHTransport] = {}
+
+    def __iter__(self) -> Iterator[WGInterface]:
+        return iter(list(self._interfaces.values()))
+
+    def __len__(self) -> int:
+        return len(self._interfaces)
+
+    @property
+    def default_name(self) -> str:
+        return self.default.name
+
+    def get(self, name: Optional[str] = None) -> Optional[WGInterface]:
+        return self._interfaces.get(name or self.default.name)
+
+    def transports(self) -> List[SSHTransport]:
+        return list(self._transports.values())
+
+    def _transport(self, spec: InterfaceSpec) -> Optional[SSHTransport]:
+        key = spec.node_key
+        if key is None:
+            return None
+        transport = self._transports.get(key)
+        if transport is None:
+            transport = SSHTransport(
+                self.runner,
+                spec.node.host,
+                port=spec.node.port,
+                user=spec.node.user,
+                key_path=spec.node.key_path,
+                **self.ssh_options,
+            )
+            self._transports[key] = transport
+        return transport
+
+    def _check_overlap(self, spec: InterfaceSpec):
+        network = ipaddress.ip_network(spec.network)
+        for other in self._interfaces.values():
+            if other.name == spec.name:
+                raise ValueError(f"Interface {spec.name} already exists")
+            # Tunnel networks on one node must not overlap; different nodes may reuse them
+            if other.spec.node_key == spec.node_key and other.network.overlaps(network):
+                raise ValueError(f"{spec.network} overlaps {other.network} of {other.name} on the same node")
+
+    def _check_key_path(self, spec: InterfaceSpec):
+        """Registered specs must not pick an arbitrary file of this host as their identity"""
+        if spec.node is None or not spec.node.key_path:
+            return
+        key_path = Path(spec.node.key_path).resolve()
+        if self.key_dir is None or not key_path.is_relative_to(Path(self.key_dir).resolve()):
+            raise ValueError(f"SSH keys of registered nodes must be in {self.key_dir or 'the key directory (not configured)'}")
+
+    async def _build(self, spec: InterfaceSpec) -> WGInterface:
+        self._check_overlap(spec)
+        iface = WGInterface(spec, self.db, self.runner, self._transport(spec), **self.options)
+        await iface.load()
+        self._interfaces[spec.name] = iface
+        return iface
+
+    async def load(self):
+        """Build the default interface and every registered one"""
+        # Data from before interfaces existed belongs to the default one
+        for collection in (self.db.clients, self.db.server_config):
+            await collection.update_many({"interface": {"$exists": False}}, {"$set": {"interface": self.default.name}})
+
+        await self._build(self.default)
+        async for doc in self.db.interfaces.find({}, {"_id": 0}):
+            try:
+                spec = InterfaceSpec(**doc)
+                self._check_key_path(spec)
+                await self._build(spec)
+            except Exception as e:
+                logger.error(f"Skipping interface {doc.get('name')}: {e}")
+
+    async def add(self, spec: InterfaceSpec) -> WGInterface:
+        """Register, load and start a new interface"""
+        self._check_overlap(spec)
+        self._check_key_path(spec)
+        started = spec.node_key in self._transports
+        await self.db.interfaces.insert_one(spec.model_dump())
+        iface = await self._build(spec)
+        if iface.transport and not started:
+            await iface.transport.start()
+        await iface.start()
+        return iface
+
+    async def start(self):
+        for transport in self._transports.values():
+            await transport.start()
+        for iface in self._interfaces.values():
+            await iface.start()
+
+    async def stop(self):
+        await asyncio.gather(*(iface.stop() for iface in self._interfaces.values()))
+        for transport in self._transports.values():
+            await transport.stop()
+
+    async def poll(self, timeout: float) -> Dict[str, Optional[WGStatusSnapshot]]:
+        """Sample every interface now, concurrently; None where the node did not answer in time"""
+        interfaces = list(self._interfaces.values())
+        results = await asyncio.gather(*(iface.status_sampler.poll(timeout) for iface in interfaces))
+        return {iface.name: result for iface, result in zip(interfaces, results)}
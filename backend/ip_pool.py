@@ -0,0 +1,118 @@
+"""Tunnel address allocation
+
+Hands out host addresses from SERVER_NETWORK in constant time, for IPv4
+subnets of any size as well as IPv6 ULA ranges. Addresses are tracked as
+integer offsets into the network: a high-water mark for never-used addresses
+plus a min-heap of free (start, end) offset ranges, so the lowest free
+address is always reused first. A gap left by an existing client far up an
+IPv6 range is a single heap entry, not one per skipped address.
+"""
+import heapq
+import ipaddress
+from typing import AsyncIterable, Iterable, List, Optional, Set, Tuple
+
+
+class IPPoolExhausted(Exception):
+    """No free address left in the network"""
+
+
+class IPPool:
+    """Allocates host addresses from a network"""
+
+    def __init__(self, network: str, reserved: Iterable[str] = ()):
+        self.network = ipaddress.ip_network(network, strict=False)
+        self._base = int(self.network.network_address)
+        # Skip the network address, and the broadcast address for IPv4
+        self._first = 1
+        self._last = self.network.num_addresses - (2 if self.network.version == 4 else 1)
+        self._next = self._first
+        # Inclusive offset ranges; they may still contain addresses marked used later
+        self._free: List[Tuple[int, int]] = []
+        self._used: Set[int] = set()
+        for address in reserved:
+            self.mark_used(address)
+
+    @property
+    def host_prefix(self) -> int:
+        """Prefix length of a single host route (/32 or /128)"""
+        return self.network.max_prefixlen
+
+    @property
+    def used(self) -> int:
+        return len(self._used)
+
+    @property
+    def capacity(self) -> int:
+        return max(0, self._last - self._first + 1)
+
+    def _offset(self, address: str) -> Optional[int]:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return None
+        if ip not in self.network:
+            return None
+        offset = int(ip) - self._base
+        if offset < self._first or offset > self._last:
+            return None
+        return offset
+
+    def _address(self, offset: int) -> str:
+        return str(ipaddress.ip_address(self._base + offset))
+
+    def mark_used(self, address: str):
+        """Record an address as taken (e.g. by an existing client)"""
+        offset = self._offset(address)
+        if offset is None or offset in self._used:
+            return
+        self._used.add(offset)
+        if offset >= self._next:
+            # Everything skipped between the old mark and this one is free
+            if offset > self._next:
+                heapq.heappush(self._free, (self._next, offset - 1))
+            self._next = offset + 1
+
+    def allocate(self) -> str:
+        """Reserve the lowest free address"""
+        while self._free:
+            start, end = heapq.heappop(self._free)
+            while start <= end and start in self._used:
+                start += 1
+            if start > end:
+                continue
+            if start < end:
+                heapq.heappush(self._free, (start + 1, end))
+            self._used.add(start)
+            return self._address(start)
+        if self._next > self._last:
+            raise IPPoolExhausted(f"No available IP addresses in {self.network}")
+        offset = self._next
+        self._next += 1
+        self._used.add(offset)
+        return self._address(offset)
+
+    def allocate_many(self, count: int) -> List[str]:
+        """Reserve a block of addresses, all or nothing"""
+        addresses = []
+        try:
+            for _ in range(count):
+                addresses.append(self.allocate())
+        except IPPoolExhausted:
+            for address in addresses:
+                self.release(address)
+            raise
+        return addresses
+
+    def release(self, address: str):
+        """Return an address to the pool"""
+        offset = self._offset(address)
+        if offset is None or offset not in self._used:
+            return
+        self._used.discard(offset)
+        heapq.heappush(self._free, (offset, offset))
+
+    async def load(self, addresses: AsyncIterable[str]):
+        """Mark every address yielded by `addresses` as used"""
+        async for address in addresses:
+            if address:
+                self.mark_used(address)
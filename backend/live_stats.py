@@ -0,0 +1,129 @@
+"""Server-Sent Events fan-out of live stats
+
+Each status snapshot is turned into stats once, diffed against the previous
+state and serialized once; every connected browser then just receives the
+same pre-encoded frame. New subscribers get the full state first and only
+changed clients afterwards, so the work per snapshot does not grow with the
+number of open dashboards.
+"""
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from wg_status import WGStatusSnapshot
+
+
+logger = logging.getLogger(__name__)
+
+# Sentinel queued for subscribers that fell behind; they get a fresh full state
+RESYNC = object()
+
+# (server status, per-client stats rows) for one snapshot
+StatsBuilder = Callable[[WGStatusSnapshot], Awaitable[Tuple[dict, List[dict]]]]
+
+
+def sse_frame(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+def summarize(server: dict, rows: List[dict]) -> dict:
+    return {
+        "active_clients": sum(1 for row in rows if row["connected"]),
+        "total_clients": len(rows),
+        "server_running": server.get("running", False),
+        "sampled_at": server.get("sampled_at"),
+    }
+
+
+class StatsBroadcaster:
+    """Publishes full and delta stats frames to SSE subscribers"""
+
+    def __init__(self, build: StatsBuilder, queue_size: int = 8):
+        self._build = build
+        self.queue_size = queue_size
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._server: dict = {}
+        self._rows: Optional[Dict[str, dict]] = None
+        self._full_frame: Optional[bytes] = None
+        self._lock = asyncio.Lock()
+        # Publishes started by the sampler, referenced until they finish
+        self._publishing: Set[asyncio.Task] = set()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+        if not self._subscribers:
+            # Nobody is watching; rebuild from scratch on the next connect
+            self._rows = None
+            self._full_frame = None
+
+    def on_snapshot(self, snapshot: WGStatusSnapshot):
+        """Sampler subscriber; does nothing while no browser is connected"""
+        if self._subscribers:
+            task = asyncio.ensure_future(self.publish(snapshot))
+            self._publishing.add(task)
+            task.add_done_callback(self._publishing.discard)
+
+    async def stop(self):
+        """Cancel publishes still in flight"""
+        publishing = list(self._publishing)
+        for task in publishing:
+            task.cancel()
+        await asyncio.gather(*publishing, return_exceptions=True)
+
+    async def full_frame(self, snapshot: WGStatusSnapshot) -> bytes:
+        """Complete current state, built at most once per snapshot"""
+        async with self._lock:
+            if self._full_frame is None:
+                if self._rows is None:
+                    self._server, rows = await self._build(snapshot)
+                    self._rows = {row["id"]: row for row in rows}
+                rows = list(self._rows.values())
+                self._full_frame = sse_frame("full", {
+                    "server": self._server,
+                    "stats": {**summarize(self._server, rows), "clients": rows},
+                })
+            return self._full_frame
+
+    async def publish(self, snapshot: WGStatusSnapshot):
+        """Diff a new snapshot against the last state and fan out the changes"""
+        async with self._lock:
+            try:
+                server, rows = await self._build(snapshot)
+            except Exception as e:
+                logger.error(f"Failed to build live stats: {e}")
+                return
+
+            previous = self._rows
+            current = {row["id"]: row for row in rows}
+            self._server, self._rows = server, current
+            self._full_frame = None
+            if previous is None:
+                return
+
+            changed = [row for client_id, row in current.items() if previous.get(client_id) != row]
+            removed = [client_id for client_id in previous if client_id not in current]
+            frame = sse_frame("delta", {
+                "server": server,
+                "summary": summarize(server, rows),
+                "changed": changed,
+                "removed": removed,
+            })
+
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # Slow consumer: drop its backlog and resend the full state
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
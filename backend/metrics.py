@@ -0,0 +1,247 @@
+"""Prometheus text exposition
+
+Everything exported here is already in memory: peer counters come from the
+latest status snapshot of each interface, latencies from the LatencyStats
+kept by the command runner, SSH transports, password hasher, Mongo command
+listener and route middleware. Rendering a scrape is a single pass over
+those, without touching Mongo or running `wg show`.
+"""
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import monitoring
+
+from latency import LatencyStats
+from tracing import content_type, record as record_span
+from wg_status import ACTIVE_HANDSHAKE_AGE, WGStatusSnapshot
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Exposition:
+    """Builds one scrape body; each metric family is written in one go"""
+
+    def __init__(self):
+        self._lines: List[str] = []
+
+    def _header(self, name: str, kind: str, help: str):
+        self._lines.append(f"# HELP {name} {help}")
+        self._lines.append(f"# TYPE {name} {kind}")
+
+    def samples(self, name: str, kind: str, help: str, series: Iterable[Tuple[Labels, float]]):
+        """A counter or gauge family"""
+        self._header(name, kind, help)
+        append = self._lines.append
+        for labels, value in series:
+            append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+    def counter(self, name: str, help: str, series: Iterable[Tuple[Labels, float]]):
+        self.samples(name, "counter", help, series)
+
+    def gauge(self, name: str, help: str, series: Iterable[Tuple[Labels, float]]):
+        self.samples(name, "gauge", help, series)
+
+    def histogram(self, name: str, help: str, series: Iterable[Tuple[Labels, LatencyStats]]):
+        """A histogram family from LatencyStats (bucket counts made cumulative)"""
+        self._header(name, "histogram", help)
+        append = self._lines.append
+        for labels, stats in series:
+            cumulative = 0
+            for bound, bucket_count in zip(stats.buckets, stats.bucket_counts):
+                cumulative += bucket_count
+                append(f"{name}_bucket{format_labels(labels + (('le', format_value(bound)),))} {cumulative}")
+            append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {stats.count}")
+            append(f"{name}_sum{format_labels(labels)} {format_value(stats.total)}")
+            append(f"{name}_count{format_labels(labels)} {stats.count}")
+
+    def render(self) -> bytes:
+        return ("\n".join(self._lines) + "\n").encode()
+
+
+def write_peer_metrics(out: Exposition, snapshots: Dict[str, WGStatusSnapshot], clients: Dict[str, int]):
+    """Interface and per-peer series for the latest snapshot of every interface"""
+    interfaces = list(snapshots.items())
+    out.gauge("wireguard_interface_up", "Whether the interface answered the last status sample", (
+        ((("interface", name),), int(snapshot.running)) for name, snapshot in interfaces
+    ))
+    out.gauge("wireguard_status_age_seconds", "Age of the status snapshot the peer series are taken from", (
+        ((("interface", name),), round(snapshot.age, 3)) for name, snapshot in interfaces if snapshot.sampled
+    ))
+    out.gauge("wireguard_clients", "Clients configured in the database", (
+        ((("interface", name),), clients.get(name, 0)) for name, _ in interfaces
+    ))
+    out.gauge("wireguard_peers", "Peers configured on the interface", (
+        ((("interface", name),), len(snapshot.peers)) for name, snapshot in interfaces
+    ))
+
+    active = []
+    rx, tx, handshake_age = [], [], []
+    for name, snapshot in interfaces:
+        taken_at = snapshot.taken_at
+        count = 0
+        for peer in snapshot.peers:
+            labels = (("interface", name), ("public_key", peer.public_key), ("allowed_ips", peer.allowed_ips))
+            rx.append((labels, peer.rx_bytes))
+            tx.append((labels, peer.tx_bytes))
+            if peer.latest_handshake:
+                age = max(0, taken_at - peer.latest_handshake)
+                handshake_age.append((labels, round(age, 3)))
+                if age < ACTIVE_HANDSHAKE_AGE:
+                    count += 1
+        active.append(((("interface", name),), count))
+
+    out.gauge("wireguard_peers_active", f"Peers with a handshake in the last {ACTIVE_HANDSHAKE_AGE} seconds", active)
+    out.counter("wireguard_peer_receive_bytes_total", "Bytes received from the peer", rx)
+    out.counter("wireguard_peer_transmit_bytes_total", "Bytes sent to the peer", tx)
+    out.gauge("wireguard_peer_last_handshake_age_seconds", "Seconds since the peer's last handshake", handshake_age)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Command latencies per (command, collection), fed by pymongo's monitoring
+
+    Motor runs pymongo on worker threads, so the bookkeeping is locked.
+    """
+
+    def __init__(self):
+        self.latency: Dict[Tuple[str, str], LatencyStats] = {}
+        self.failures: Dict[Tuple[str, str], int] = {}
+        self._collections: Dict[Tuple[object, int], str] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get("collection", "")
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event) -> Tuple[str, str]:
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        key = (event.command_name, collection)
+        stats = self.latency.get(key)
+        if stats is None:
+            stats = self.latency[key] = LatencyStats()
+        seconds = event.duration_micros / 1e6
+        stats.observe(seconds)
+        # Motor runs the command with the request's context, so this lands in its trace
+        record_span("mongo", seconds)
+        return key
+
+    def succeeded(self, event):
+        with self._lock:
+            self._finish(event)
+
+    def failed(self, event):
+        with self._lock:
+            key = self._finish(event)
+            self.failures[key] = self.failures.get(key, 0) + 1
+
+    def write(self, out: Exposition):
+        with self._lock:
+            latency = sorted(self.latency.items())
+            failures = sorted(self.failures.items())
+        out.histogram("mongodb_command_duration_seconds", "MongoDB command latency", (
+            ((("command", command), ("collection", collection)), stats) for (command, collection), stats in latency
+        ))
+        out.counter("mongodb_command_failures_total", "MongoDB commands that failed", (
+            ((("command", command), ("collection", collection)), count) for (command, collection), count in failures
+        ))
+
+
+class RouteMetrics:
+    """HTTP request latency and response counts by route template"""
+
+    def __init__(self):
+        self.latency: Dict[Tuple[str, str], LatencyStats] = {}
+        self.responses: Dict[Tuple[str, str, int], int] = {}
+
+    def observe(self, method: str, route: str, status_code: int, seconds: float):
+        key = (method, route)
+        stats = self.latency.get(key)
+        if stats is None:
+            stats = self.latency[key] = LatencyStats()
+        stats.observe(seconds)
+        response_key = (method, route, status_code)
+        self.responses[response_key] = self.responses.get(response_key, 0) + 1
+
+    def write(self, out: Exposition):
+        out.histogram("http_request_duration_seconds", "HTTP request latency by route", (
+            ((("method", method), ("route", route)), stats) for (method, route), stats in sorted(self.latency.items())
+        ))
+        out.counter("http_responses_total", "HTTP responses by route and status code", (
+            ((("method", method), ("route", route), ("status", str(code))), count)
+            for (method, route, code), count in sorted(self.responses.items())
+        ))
+
+
+class RouteMetricsMiddleware:
+    """ASGI middleware timing every HTTP request into a RouteMetrics
+
+    Requests are labelled with the matched route's path
+    (`/api/wg/clients/{client_id}`), not the raw URL, so the series stay
+    bounded; anything no route matched is counted as "unmatched". Streaming
+    responses are timed until the stream ends, except those of a
+    `stream_types` content type, whose duration is up to the client.
+    """
+
+    def __init__(self, app, metrics: RouteMetrics, exclude: Iterable[str] = (),
+                 stream_types: Iterable[str] = ("text/event-stream",)):
+        self.app = app
+        self.metrics = metrics
+        self.exclude = set(exclude)
+        self.stream_types = {t.encode("latin-1") for t in stream_types}
+        self._route_paths: Optional[Dict[object, str]] = None
+
+    def _route_path(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._route_paths is None:
+            paths = {}
+            for route in scope["app"].routes:
+                paths.setdefault(getattr(route, "endpoint", None), route.path)
+            self._route_paths = paths
+        return self._route_paths.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        stream = False
+
+        async def send_wrapper(message):
+            nonlocal status_code, stream
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                stream = content_type(message.get("headers", ())) in self.stream_types
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not stream:
+                self.metrics.observe(scope["method"], self._route_path(scope), status_code, time.perf_counter() - started)
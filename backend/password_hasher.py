@@ -0,0 +1,88 @@
+"""Password hashing off the event loop
+
+bcrypt is deliberately slow CPU work. PasswordHasher runs it in a small
+dedicated thread pool so the event loop keeps serving other requests, and
+caps how many operations may wait for that pool: once `max_pending` are in
+flight, further logins are rejected right away instead of piling up.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from passlib.context import CryptContext
+
+from latency import LatencyStats
+from tracing import record as record_span
+
+
+T = TypeVar("T")
+
+
+class AuthBusy(Exception):
+    """Too many password operations are already queued"""
+
+
+class PasswordHasher:
+    """bcrypt hash/verify in a bounded worker pool with admission control"""
+
+    def __init__(self, context: CryptContext, workers: int = 2, max_pending: int = 32):
+        self.context = context
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+        self.rejected = 0
+        self.queue_latency = LatencyStats()
+        self.hash_latency = LatencyStats()
+        self.verify_latency = LatencyStats()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def _run(self, latency: LatencyStats, fn: Callable[..., T], *args) -> T:
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise AuthBusy("Too many concurrent authentication requests")
+
+        def timed():
+            started = time.perf_counter()
+            result = fn(*args)
+            return result, started, time.perf_counter()
+
+        queued = time.perf_counter()
+        self._pending += 1
+        future = asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        # Count the slot as taken until the thread is done, even if the request is gone
+        future.add_done_callback(self._release)
+        result, started, finished = await asyncio.shield(future)
+        self.queue_latency.observe(started - queued)
+        latency.observe(finished - started)
+        record_span("bcrypt.queue", started - queued)
+        record_span("bcrypt", finished - started)
+        return result
+
+    def _release(self, _future):
+        self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.hash_latency, self.context.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(self.verify_latency, self.context.verify, password, hashed)
+
+    def stats(self) -> dict:
+        return {
+            "scheme": self.context.default_scheme(),
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "rejected": self.rejected,
+            "queue_latency": self.queue_latency.summary(),
+            "hash_latency": self.hash_latency.summary(),
+            "verify_latency": self.verify_latency.summary(),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
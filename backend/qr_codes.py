@@ -0,0 +1,91 @@
+"""Client config QR codes
+
+QR encoding and PNG compression are pure CPU work, so codes are rendered in
+a small worker pool instead of on the event loop and kept in an LRU cache.
+Cache keys include everything the config depends on besides the client
+itself (server public key and endpoint), so re-initializing the server or
+changing the endpoint never serves a stale code.
+"""
+import asyncio
+import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, Tuple
+
+import qrcode
+import qrcode.image.svg
+
+
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+def render_qr(data: str, fmt: str = "png") -> bytes:
+    """Render `data` as a PNG or SVG QR code"""
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    if fmt == "svg":
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+
+    buf = io.BytesIO()
+    img.save(buf)
+    return buf.getvalue()
+
+
+class QRCodeCache:
+    """LRU cache of rendered QR codes, rendered in a bounded worker pool"""
+
+    def __init__(self, max_entries: int = 256, workers: int = 2):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, bytes]" = OrderedDict()
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qr")
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, client_id: str, version: Hashable, data: str, fmt: str = "png") -> bytes:
+        """QR code for a client's config; `version` is whatever else the config depends on"""
+        key = (client_id, version, fmt)
+        image = self._entries.get(key)
+        if image is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return image
+
+        self.misses += 1
+        # Concurrent requests for the same code share one render
+        future = self._inflight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, render_qr, data, fmt)
+            self._inflight[key] = future
+            try:
+                image = await asyncio.shield(future)
+            finally:
+                self._inflight.pop(key, None)
+            self._entries[key] = image
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return image
+        return await asyncio.shield(future)
+
+    async def render(self, data: str, fmt: str = "png") -> bytes:
+        """Render in the worker pool without caching, for one-off bulk renders"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, render_qr, data, fmt)
+
+    def invalidate(self, client_id: str):
+        for key in [key for key in self._entries if key[0] == client_id]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,201 @@
+"""Reconciliation of Mongo, the kernel peer table and the config file
+
+The clients collection is the desired state. Live `wg set` calls and the
+background config writes keep the interface in line with it most of the
+time, but a failed call, a crash between the Mongo write and the `wg set`,
+or a hand-edited interface leave them apart. The Reconciler compares the
+desired peers (enabled clients) with one `wg show dump` and with the config
+model, both keyed by public key, and applies only the differences.
+"""
+import asyncio
+import ipaddress
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from latency import LatencyStats
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_allowed_ips(value: str) -> FrozenSet[str]:
+    """Comparable form of an AllowedIPs list (order, spacing and host bits ignored)"""
+    networks = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            networks.add(str(ipaddress.ip_network(part, strict=False)))
+        except ValueError:
+            networks.add(part)
+    return frozenset(networks)
+
+
+@dataclass(frozen=True)
+class PeerDiff:
+    """Changes that turn the actual peer set into the desired one"""
+    add: List[Tuple[str, str]]  # (public_key, allowed_ips) missing entirely
+    update: List[Tuple[str, str]]  # (public_key, allowed_ips) present with other allowed ips
+    remove: List[str]  # public keys that should not be there
+
+    def __len__(self) -> int:
+        return len(self.add) + len(self.update) + len(self.remove)
+
+
+def diff_peers(desired: Dict[str, str], actual: Dict[str, str]) -> PeerDiff:
+    """Keyed diff of {public_key: allowed_ips} maps, O(desired + actual)"""
+    add, update = [], []
+    for public_key, allowed_ips in desired.items():
+        current = actual.get(public_key)
+        if current is None:
+            add.append((public_key, allowed_ips))
+        elif normalize_allowed_ips(current) != normalize_allowed_ips(allowed_ips):
+            update.append((public_key, allowed_ips))
+    remove = [public_key for public_key in actual if public_key not in desired]
+    return PeerDiff(add, update, remove)
+
+
+class Reconciler:
+    """Periodic and on-demand reconciliation of one interface"""
+
+    def __init__(self, iface, interval: float = 60.0):
+        self.iface = iface
+        self.interval = interval
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.last_report: Optional[dict] = None
+        self.runs = 0
+        self.peers_changed = 0
+        self.diff_latency = LatencyStats()
+        self.apply_latency = LatencyStats()
+
+    async def _actual_file_peers(self) -> Dict[str, str]:
+        """Config file peers, with changes still waiting to be written applied"""
+        iface = self.iface
+        async with iface.config_persister.lock:
+            if iface.config_model is None:
+                iface.config_model = await iface.load_config()
+            peers = {key: fields.get("AllowedIPs", "") for key, fields in iface.config_model.peers.items()}
+        for public_key, (action, allowed_ips) in iface.config_persister.peek().items():
+            if action == "add":
+                peers[public_key] = allowed_ips
+            else:
+                peers.pop(public_key, None)
+        return peers
+
+    async def _desired_peers(self) -> Dict[str, str]:
+        iface = self.iface
+        cursor = iface.db.clients.find(
+            {**iface.clients_filter, "enabled": {"$ne": False}},
+            {"_id": 0, "public_key": 1, "ip_address": 1}
+        )
+        return {c["public_key"]: iface.peer_allowed_ips(c["ip_address"]) async for c in cursor}
+
+    async def reconcile(self, dry_run: bool = False) -> dict:
+        """Bring the interface and its config file in line with Mongo; returns a report"""
+        async with self._lock:
+            report = await self._reconcile(dry_run)
+        self.last_report = report
+        return report
+
+    async def _reconcile(self, dry_run: bool) -> dict:
+        iface = self.iface
+        report = {
+            "interface": iface.name,
+            "dry_run": dry_run,
+            "started_at": datetime.now(timezone.utc).isoformat(),
+        }
+        if not await iface.server_config.get():
+            return {**report, "skipped": "Server not initialized"}
+
+        # Actual state is read before the desired state: a peer present in the
+        # dump was set after its client was inserted, so the Mongo read that
+        # follows cannot miss it and the peer is never mistaken for a stale one
+        snapshot = await iface.status_sampler.fresh()
+        file_peers = await self._actual_file_peers()
+        desired = await self._desired_peers()
+
+        started = time.perf_counter()
+        kernel_diff = diff_peers(desired, {p.public_key: p.allowed_ips for p in snapshot.peers}) if snapshot.running else None
+        file_diff = diff_peers(desired, file_peers)
+        diff_seconds = time.perf_counter() - started
+        self.diff_latency.observe(diff_seconds)
+
+        ok = True
+        started = time.perf_counter()
+        if not dry_run:
+            if kernel_diff:
+                ok = await iface.wg_set_clauses(
+                    [["peer", key, "allowed-ips", allowed_ips] for key, allowed_ips in kernel_diff.add + kernel_diff.update]
+                    + [["peer", key, "remove"] for key in kernel_diff.remove]
+                )
+            for key, allowed_ips in file_diff.add + file_diff.update:
+                iface.config_persister.add_peer(key, allowed_ips)
+            for key in file_diff.remove:
+                iface.config_persister.remove_peer(key)
+        apply_seconds = time.perf_counter() - started
+        if kernel_diff and not dry_run:
+            self.apply_latency.observe(apply_seconds)
+            self.peers_changed += len(kernel_diff)
+            # Show the corrected state without waiting for the next sample
+            await iface.status_sampler.fresh()
+        self.runs += 1
+
+        if kernel_diff or file_diff:
+            logger.info(
+                f"Reconciled {iface.name}: kernel {summarize(kernel_diff)}, config file {summarize(file_diff)}"
+                + (" (dry run)" if dry_run else "")
+            )
+        return {
+            **report,
+            "running": snapshot.running,
+            "ok": ok,
+            "desired": len(desired),
+            "kernel": summarize(kernel_diff),
+            "config_file": summarize(file_diff),
+            "diff_ms": round(diff_seconds * 1000, 3),
+            "apply_ms": round(apply_seconds * 1000, 3),
+        }
+
+    def stats(self) -> dict:
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "peers_changed": self.peers_changed,
+            "diff_latency": self.diff_latency.summary(),
+            "apply_latency": self.apply_latency.summary(),
+            "last_report": self.last_report,
+        }
+
+    def start(self):
+        """Start the periodic loop (not with an interval of 0)"""
+        if self.interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Reconciling {self.iface.name} failed: {e}")
+
+
+def summarize(diff: Optional[PeerDiff]) -> Optional[dict]:
+    """Counts of a diff for reports; None when there was nothing to compare with"""
+    if diff is None:
+        return None
+    return {"added": len(diff.add), "updated": len(diff.update), "removed": len(diff.remove)}
@@ -1,30 +1,56 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, Body, HTTPException, Depends, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
+from typing import Awaitable, Callable, Dict, List, Literal, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
-import subprocess
 import re
 import jwt
 from passlib.context import CryptContext
-import qrcode
-import io
 import base64
+import asyncio
+import ipaddress
+import hmac
+
+from bulk_clients import BulkCreate
+from client_pages import (
+    DEFAULT_LIMIT as CLIENT_PAGE_LIMIT, LIST_PROJECTION, MAX_LIMIT as CLIENT_PAGE_MAX, client_filter, next_cursor, page_query
+)
+from command_runner import CommandRunner
+from config_export import ZipExport, entry_basename
+from db_indexes import bootstrap_indexes
+from interfaces import InterfaceRegistry, InterfaceSpec, NodeSpec, WGInterface
+from ip_pool import IPPoolExhausted
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, Exposition, MongoCommandMetrics, RouteMetrics, RouteMetricsMiddleware,
+    write_peer_metrics,
+)
+from password_hasher import AuthBusy, PasswordHasher
+from qr_codes import FORMATS as QR_FORMATS, QRCodeCache
+from server_config import WGServerConfig
+from live_stats import RESYNC
+from tracing import SlowRequestLog, StackSampler, TracingMiddleware, authenticated as trace_authenticated, span as trace_span
+from traffic import TIERS, default_range
+from versioning import VersionedIndex, accepts_gzip, encode_json, etag_matches
+from wg_config import WGConfig
+from wg_keys import KeyPool
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection (command timings are exported on /api/metrics)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+mongo_metrics = MongoCommandMetrics()
+client = AsyncIOMotorClient(mongo_url, event_listeners=[mongo_metrics])
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
@@ -35,19 +61,81 @@ api_router = APIRouter(prefix="/api")
 
 # Security
 security = HTTPBearer()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost factor, threads doing password hashing and how many may queue for them
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+AUTH_WORKERS = int(os.environ.get("AUTH_WORKERS", "2"))
+AUTH_MAX_PENDING = int(os.environ.get("AUTH_MAX_PENDING", "32"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+password_hasher = PasswordHasher(pwd_context, workers=AUTH_WORKERS, max_pending=AUTH_MAX_PENDING)
 SECRET_KEY = os.environ.get("JWT_SECRET", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 43200  # 30 days
+# Static bearer token for Prometheus scrapes of /api/metrics (a user token works too)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
 
-# WireGuard Configuration
-WG_CONFIG_DIR = Path("/etc/wireguard")
-WG_INTERFACE = "wg0"
+# Request tracing (Server-Timing headers, log of slow requests) and the
+# opt-in event loop profiler, milliseconds between samples (0 disables)
+REQUEST_TRACING = os.environ.get("REQUEST_TRACING", "true").lower() == "true"
+# Who gets the Server-Timing header: "auth" (logged-in requests), "all" or "off"
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "auth").lower()
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "500"))
+SLOW_REQUEST_LOG_SIZE = int(os.environ.get("SLOW_REQUEST_LOG_SIZE", "50"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "0"))
+
+# WireGuard Configuration (the default interface; more can be registered at runtime)
+WG_INTERFACE = os.environ.get("WG_INTERFACE", "wg0")
 SERVER_PUBLIC_IP = "43.251.160.244"
 SERVER_DOMAIN = "vpn-dus.leonboldt.de"
 SERVER_PORT = 51820
-SERVER_NETWORK = "10.8.0.0/24"
-SERVER_IP = "10.8.0.1"
+SERVER_NETWORK = os.environ.get("SERVER_NETWORK", "10.8.0.0/24")
+SERVER_IP = os.environ.get("SERVER_IP") or str(next(ipaddress.ip_network(SERVER_NETWORK, strict=False).hosts()))
+
+# Config file directory and tool paths on the managed nodes
+WG_CONFIG_DIR = Path(os.environ.get("WG_CONFIG_DIR", "/etc/wireguard"))
+WG_COMMANDS = {
+    "wg": os.environ.get("WG_BIN", "/usr/bin/wg"),
+    "wg-quick": os.environ.get("WG_QUICK_BIN", "/usr/bin/wg-quick"),
+    "sudo": os.environ.get("SUDO_BIN", "/usr/bin/sudo"),
+}
+
+# Command execution limits
+COMMAND_TIMEOUT = float(os.environ.get("COMMAND_TIMEOUT", "10"))
+COMMAND_CONCURRENCY = int(os.environ.get("COMMAND_CONCURRENCY", "8"))
+
+# Number of pre-generated client keypairs (0 disables the pool)
+WG_KEY_POOL_SIZE = int(os.environ.get("WG_KEY_POOL_SIZE", "32"))
+
+# Peers per `wg set` invocation and delay before config changes are written
+WG_SET_BATCH = 256
+WG_CONFIG_FLUSH_DELAY = float(os.environ.get("WG_CONFIG_FLUSH_DELAY", "1"))
+
+# Seconds between background `wg show` samples, and how long a node may take to answer
+WG_STATUS_INTERVAL = float(os.environ.get("WG_STATUS_INTERVAL", "5"))
+WG_NODE_TIMEOUT = float(os.environ.get("WG_NODE_TIMEOUT", "5"))
+
+# Seconds between reconciliations of Mongo, kernel peers and config file (0 disables)
+WG_RECONCILE_INTERVAL = float(os.environ.get("WG_RECONCILE_INTERVAL", "60"))
+
+# Default monthly traffic quota per client in bytes, rx + tx (0: unlimited)
+WG_MONTHLY_QUOTA_BYTES = int(os.environ.get("WG_MONTHLY_QUOTA_BYTES", "0"))
+
+# Rendered client QR codes kept in memory, and threads rendering them
+QR_CACHE_SIZE = int(os.environ.get("QR_CACHE_SIZE", "256"))
+QR_RENDER_WORKERS = int(os.environ.get("QR_RENDER_WORKERS", "2"))
+
+# Seconds between keepalive comments on idle live stats streams
+SSE_KEEPALIVE_INTERVAL = 15
+# Lifetime of the short-lived tokens that open a stream (they end up in URLs and logs)
+STREAM_TOKEN_EXPIRE_SECONDS = 60
+
+# Clients fetched per cursor batch during a config export
+CONFIG_EXPORT_BATCH = 500
+# Clients written (and reported) per insert_many during a bulk create
+BULK_INSERT_CHUNK = 500
+
+# Traffic history: flush interval (seconds) and raw sample retention (days)
+TRAFFIC_FLUSH_INTERVAL = float(os.environ.get("TRAFFIC_FLUSH_INTERVAL", "30"))
+TRAFFIC_RETENTION_DAYS = int(os.environ.get("TRAFFIC_RETENTION_DAYS", "7"))
 
 # SSH Configuration (for remote management)
 SSH_ENABLED = os.environ.get("SSH_ENABLED", "false").lower() == "true"
@@ -55,14 +143,77 @@ SSH_HOST = os.environ.get("SSH_HOST", "")
 SSH_PORT = int(os.environ.get("SSH_PORT", "22"))
 SSH_USER = os.environ.get("SSH_USER", "root")
 SSH_KEY_PATH = os.environ.get("SSH_KEY_PATH", "")
+# Directory the SSH keys of nodes registered via the API must be in (default: that of SSH_KEY_PATH)
+SSH_KEY_DIR = os.environ.get("SSH_KEY_DIR", os.path.dirname(SSH_KEY_PATH))
+SSH_POOL_SIZE = int(os.environ.get("SSH_POOL_SIZE", "2"))
+SSH_CONTROL_DIR = Path(os.environ.get("SSH_CONTROL_DIR", "/tmp/wg-admin-ssh"))
+SSH_HEALTH_INTERVAL = float(os.environ.get("SSH_HEALTH_INTERVAL", "30"))
+
+
+command_runner = CommandRunner(max_concurrency=COMMAND_CONCURRENCY, timeout=COMMAND_TIMEOUT)
+qr_cache = QRCodeCache(max_entries=QR_CACHE_SIZE, workers=QR_RENDER_WORKERS)
+
+key_pool = KeyPool(size=WG_KEY_POOL_SIZE)
+
+slow_requests = SlowRequestLog(threshold=SLOW_REQUEST_MS / 1000, size=SLOW_REQUEST_LOG_SIZE)
+stack_sampler = StackSampler(interval=PROFILE_INTERVAL_MS / 1000) if PROFILE_INTERVAL_MS > 0 else None
+
+# Retries when another worker takes an allocated address first
+IP_ALLOCATION_RETRIES = 16
+
+# id(index) -> ((etag, gzip), (body, gzipped)) of the last full response
+full_response_cache: Dict[int, tuple] = {}
+
+# Managed interfaces: the default one from the environment plus those
+# registered in the `interfaces` collection. SSH sessions are shared per node.
+interfaces = InterfaceRegistry(
+    db,
+    command_runner,
+    InterfaceSpec(
+        name=WG_INTERFACE,
+        network=SERVER_NETWORK,
+        address=SERVER_IP,
+        listen_port=SERVER_PORT,
+        endpoint_host=SERVER_DOMAIN,
+        node=(
+            NodeSpec(host=SSH_HOST, port=SSH_PORT, user=SSH_USER, key_path=SSH_KEY_PATH)
+            if SSH_ENABLED and SSH_HOST else None
+        ),
+    ),
+    ssh_options={"pool_size": SSH_POOL_SIZE, "control_dir": SSH_CONTROL_DIR, "health_interval": SSH_HEALTH_INTERVAL},
+    key_dir=Path(SSH_KEY_DIR) if SSH_KEY_DIR else None,
+    status_interval=WG_STATUS_INTERVAL,
+    status_timeout=WG_NODE_TIMEOUT,
+    config_flush_delay=WG_CONFIG_FLUSH_DELAY,
+    set_batch=WG_SET_BATCH,
+    traffic_flush_interval=TRAFFIC_FLUSH_INTERVAL,
+    traffic_retention_days=TRAFFIC_RETENTION_DAYS,
+    config_dir=WG_CONFIG_DIR,
+    commands=WG_COMMANDS,
+    reconcile_interval=WG_RECONCILE_INTERVAL,
+    monthly_quota=WG_MONTHLY_QUOTA_BYTES,
+)
 
 
 # Helper Functions
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+def auth_busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Too many authentication requests, please retry",
+        headers={"Retry-After": "1"}
+    )
+
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except AuthBusy:
+        raise auth_busy()
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except AuthBusy:
+        raise auth_busy()
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -74,146 +225,95 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def decode_access_token(token: str, scope: Optional[str] = None) -> str:
+    """Return the username of a valid access token of `scope` (None: a login token)"""
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
+        if username is None or payload.get("scope") != scope:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+        trace_authenticated()
         return username
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Could not validate credentials")
 
-def run_command(cmd: List[str]) -> tuple[str, str, int]:
-    """Run a shell command locally or via SSH"""
-    # Use full paths for system commands
-    cmd_map = {
-        "wg": "/usr/bin/wg",
-        "wg-quick": "/usr/bin/wg-quick",
-        "sudo": "/usr/bin/sudo"
-    }
-    
-    # Replace all occurrences in the command, not just the first one
-    cmd = [cmd_map.get(c, c) for c in cmd]
-    
-    try:
-        if SSH_ENABLED and SSH_HOST:
-            # Run command via SSH
-            ssh_cmd = [
-                "ssh",
-                "-i", SSH_KEY_PATH,
-                "-p", str(SSH_PORT),
-                "-o", "StrictHostKeyChecking=no",
-                f"{SSH_USER}@{SSH_HOST}",
-                " ".join(cmd)
-            ]
-            result = subprocess.run(ssh_cmd, capture_output=True, text=True, timeout=10)
-        else:
-            # Run command locally
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-        
-        return result.stdout, result.stderr, result.returncode
-    except subprocess.TimeoutExpired:
-        return "", "Command timed out", 1
-    except Exception as e:
-        return "", str(e), 1
-
-def generate_keypair() -> tuple[str, str]:
-    """Generate WireGuard private and public key pair"""
-    private_key, _, _ = run_command(["wg", "genkey"])
-    private_key = private_key.strip()
-    
-    echo_process = subprocess.Popen(["echo", private_key], stdout=subprocess.PIPE)
-    public_key, _ = subprocess.communicate(echo_process.stdout, ["wg", "pubkey"])
-    public_key = public_key.strip()
-    
-    return private_key, public_key
-
-def subprocess_communicate(stdin_data: bytes, cmd: List[str]) -> str:
-    """Helper to pipe data through command"""
-    # Use full paths for system commands
-    if cmd[0] == "wg":
-        cmd[0] = "/usr/bin/wg"
-    
-    if SSH_ENABLED and SSH_HOST:
-        # For SSH, we need to handle piping differently
-        ssh_cmd = [
-            "ssh",
-            "-i", SSH_KEY_PATH,
-            "-p", str(SSH_PORT),
-            "-o", "StrictHostKeyChecking=no",
-            f"{SSH_USER}@{SSH_HOST}",
-            " ".join([str(c) for c in cmd])
-        ]
-        process = subprocess.Popen(ssh_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, _ = process.communicate(input=stdin_data)
-        return stdout.decode().strip()
-    else:
-        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, _ = process.communicate(input=stdin_data)
-        return stdout.decode().strip()
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return decode_access_token(credentials.credentials)
+
+async def get_metrics_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Auth for scrapers: the static METRICS_TOKEN or a regular access token"""
+    if METRICS_TOKEN and hmac.compare_digest(credentials.credentials.encode(), METRICS_TOKEN.encode()):
+        trace_authenticated()
+        return "metrics"
+    return decode_access_token(credentials.credentials)
+
+async def get_stream_user(token: str = Query(...)):
+    """Auth for EventSource streams, which cannot send an Authorization header
+
+    Only the short-lived tokens of POST /wg/stream/token are accepted here;
+    a login token must never end up in a URL.
+    """
+    return decode_access_token(token, scope="stream")
 
 def generate_wg_keys() -> tuple[str, str]:
     """Generate WireGuard key pair"""
-    private_key = subprocess_communicate(b"", ["wg", "genkey"]).strip()
-    public_key = subprocess_communicate(private_key.encode(), ["wg", "pubkey"]).strip()
-    return private_key, public_key
+    return key_pool.get()
+
+async def get_interface(
+    interface: Optional[str] = Query(None, description="Managed interface (default: WG_INTERFACE)")
+) -> WGInterface:
+    """Resolve the `interface` query parameter"""
+    iface = interfaces.get(interface)
+    if iface is None:
+        raise HTTPException(status_code=404, detail=f"Unknown interface: {interface}")
+    return iface
+
+async def find_client(client_id: str) -> tuple[dict, WGInterface]:
+    """A client document and the interface it belongs to"""
+    client = await db.clients.find_one({"id": client_id}, {"_id": 0})
+    if not client:
+        raise HTTPException(status_code=404, detail="Client not found")
+    iface = interfaces.get(client.get("interface"))
+    if iface is None:
+        raise HTTPException(status_code=404, detail=f"Unknown interface: {client.get('interface')}")
+    return client, iface
 
-def get_wg_status() -> dict:
-    """Get WireGuard interface status"""
-    stdout, stderr, code = run_command(["sudo", "wg", "show", WG_INTERFACE])
+async def versioned_response(
+    request: Request,
+    index: VersionedIndex,
+    since: Optional[int],
+    full: Callable[[], Awaitable[object]],
+    delta: Callable[[List[str], List[str]], Awaitable[dict]],
+) -> Response:
+    """304, `?since=` delta or full JSON response for a versioned resource"""
+    etag = index.etag
+    headers = {"ETag": etag, "X-Version": str(index.version), "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
     
-    if code != 0:
-        return {"running": False, "peers": []}
-    
-    peers = []
-    current_peer = None
-    
-    for line in stdout.split('\n'):
-        if line.startswith('peer:'):
-            if current_peer:
-                peers.append(current_peer)
-            current_peer = {"public_key": line.split(': ')[1].strip()}
-        elif current_peer:
-            if 'endpoint:' in line:
-                current_peer['endpoint'] = line.split(': ')[1].strip()
-            elif 'latest handshake:' in line:
-                current_peer['latest_handshake'] = line.split(': ')[1].strip()
-            elif 'transfer:' in line:
-                transfer = line.split(': ')[1].strip()
-                parts = transfer.split(', ')
-                if len(parts) == 2:
-                    current_peer['rx_bytes'] = parts[0].split()[0]
-                    current_peer['tx_bytes'] = parts[1].split()[0]
-            elif 'allowed ips:' in line:
-                current_peer['allowed_ips'] = line.split(': ')[1].strip()
-    
-    if current_peer:
-        peers.append(current_peer)
-    
-    return {"running": True, "peers": peers}
-
-def parse_traffic(traffic_str: str) -> int:
-    """Parse traffic string like '1.5 GiB' to bytes"""
-    if not traffic_str or traffic_str == '0 B':
-        return 0
-    
-    units = {'B': 1, 'KiB': 1024, 'MiB': 1024**2, 'GiB': 1024**3, 'TiB': 1024**4}
-    
-    parts = traffic_str.split()
-    if len(parts) != 2:
-        return 0
+    compress = accepts_gzip(request.headers.get("accept-encoding"))
+    changes = index.changes(since) if since is not None else None
+    if changes is not None:
+        data = await delta(*changes)
+        with trace_span("serialize"):
+            body, gzipped = await asyncio.to_thread(encode_json, data, compress)
+    else:
+        # Repeated full fetches of an unchanged version reuse the encoded body
+        key = (etag, compress)
+        cached = full_response_cache.get(id(index))
+        if cached is not None and cached[0] == key:
+            body, gzipped = cached[1]
+        else:
+            data = await full()
+            with trace_span("serialize"):
+                body, gzipped = await asyncio.to_thread(encode_json, data, compress)
+            full_response_cache[id(index)] = (key, (body, gzipped))
     
-    try:
-        value = float(parts[0])
-        unit = parts[1]
-        return int(value * units.get(unit, 1))
-    except:
-        return 0
-
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # Models
 class User(BaseModel):
@@ -237,6 +337,7 @@ class Token(BaseModel):
 class WGClient(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    interface: Optional[str] = None
     name: str
     public_key: str
     private_key: str
@@ -244,24 +345,29 @@ class WGClient(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     enabled: bool = True
     os_info: Optional[str] = None
+    quota_bytes: Optional[int] = None  # monthly, None: WG_MONTHLY_QUOTA_BYTES, 0: unlimited
+    quota_exceeded: Optional[str] = None  # month the client was disabled for its quota
 
 class WGClientCreate(BaseModel):
     name: str
     os_info: Optional[str] = None
 
-class WGServerConfig(BaseModel):
-    private_key: str
-    public_key: str
-    address: str
-    port: int
-    initialized: bool
-    created_at: datetime
+class WGClientUpdate(BaseModel):
+    name: Optional[str] = None
+    enabled: Optional[bool] = None
+    os_info: Optional[str] = None
+    quota_bytes: Optional[int] = Field(None, ge=0)
+
+class WGClientBulkCreate(BaseModel):
+    clients: List[WGClientCreate] = Field(..., min_length=1, max_length=10000)
 
 class WGStats(BaseModel):
     active_clients: int
     total_clients: int
     server_running: bool
     clients: List[dict]
+    sampled_at: Optional[str] = None
+    version: Optional[int] = None
 
 
 # Add your routes to the router instead of directly to app
@@ -280,13 +386,16 @@ async def register(user: UserRegister):
         raise HTTPException(status_code=400, detail="Username already registered")
     
     # Create user
-    hashed_password = hash_password(user.password)
+    hashed_password = await hash_password(user.password)
     user_doc = {
         "username": user.username,
         "hashed_password": hashed_password,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.users.insert_one(user_doc)
+    try:
+        await db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Username already registered")
     
     # Create token
     access_token = create_access_token(
@@ -299,7 +408,7 @@ async def register(user: UserRegister):
 async def login(user: UserLogin):
     # Find user
     db_user = await db.users.find_one({"username": user.username})
-    if not db_user or not verify_password(user.password, db_user["hashed_password"]):
+    if not db_user or not await verify_password(user.password, db_user["hashed_password"]):
         raise HTTPException(status_code=401, detail="Incorrect username or password")
     
     # Create token
@@ -309,13 +418,18 @@ async def login(user: UserLogin):
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+@api_router.get("/auth/stats")
+async def get_auth_stats(current_user: str = Depends(get_current_user)):
+    """Get password hashing latency and admission statistics"""
+    return {"bcrypt_rounds": BCRYPT_ROUNDS, **password_hasher.stats()}
+
 
 # WireGuard Server Routes
 @api_router.post("/wg/server/init")
-async def init_server(current_user: str = Depends(get_current_user)):
+async def init_server(iface: WGInterface = Depends(get_interface), current_user: str = Depends(get_current_user)):
     """Initialize WireGuard server configuration"""
     # Check if already initialized
-    existing_config = await db.server_config.find_one({})
+    existing_config = await iface.server_config.load()
     if existing_config:
         return {"message": "Server already initialized", "config": existing_config}
     
@@ -323,74 +437,36 @@ async def init_server(current_user: str = Depends(get_current_user)):
     private_key, public_key = generate_wg_keys()
     
     # Create server config
-    config_content = f"""[Interface]
-PrivateKey = {private_key}
-Address = {SERVER_IP}/24
-ListenPort = {SERVER_PORT}
-PostUp = iptables -A FORWARD -i %i -j ACCEPT; iptables -t nat -A POSTROUTING -o eth0 -j MASQUERADE
-PostDown = iptables -D FORWARD -i %i -j ACCEPT; iptables -t nat -D POSTROUTING -o eth0 -j MASQUERADE
-
-"""
+    config_content = iface.render_interface_section(private_key)
     
     # Save to MongoDB
-    server_doc = {
-        "private_key": private_key,
-        "public_key": public_key,
-        "address": SERVER_IP,
-        "port": SERVER_PORT,
-        "initialized": True,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
-    await db.server_config.insert_one(server_doc)
+    await iface.server_config.save(WGServerConfig(
+        private_key=private_key,
+        public_key=public_key,
+        address=iface.address,
+        port=iface.spec.listen_port,
+        initialized=True,
+        created_at=datetime.now(timezone.utc)
+    ))
     
     # Write config file
     try:
-        if SSH_ENABLED and SSH_HOST:
-            # Write config via SSH
-            run_command(["sudo", "mkdir", "-p", str(WG_CONFIG_DIR)])
-            # Create temp file locally then transfer
-            with open("/tmp/wg0.conf", "w") as f:
-                f.write(config_content)
-            run_command(["scp", "-i", SSH_KEY_PATH, "/tmp/wg0.conf", f"{SSH_USER}@{SSH_HOST}:/tmp/wg0.conf"])
-            run_command(["sudo", "cp", "/tmp/wg0.conf", f"{WG_CONFIG_DIR}/{WG_INTERFACE}.conf"])
-            run_command(["sudo", "chmod", "600", f"{WG_CONFIG_DIR}/{WG_INTERFACE}.conf"])
-        else:
-            # Write config locally
-            WG_CONFIG_DIR.mkdir(parents=True, exist_ok=True)
-            config_file = WG_CONFIG_DIR / f"{WG_INTERFACE}.conf"
-            
-            with open("/tmp/wg0.conf", "w") as f:
-                f.write(config_content)
-            
-            run_command(["sudo", "cp", "/tmp/wg0.conf", str(config_file)])
-            run_command(["sudo", "chmod", "600", str(config_file)])
+        iface.config_model = WGConfig.parse(config_content)
+        await iface.write_config(iface.config_model)
         
         return {"message": "Server initialized successfully", "public_key": public_key}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to write config: {str(e)}")
 
 @api_router.get("/wg/server/status")
-async def get_server_status(current_user: str = Depends(get_current_user)):
+async def get_server_status(iface: WGInterface = Depends(get_interface), current_user: str = Depends(get_current_user)):
     """Get WireGuard server status"""
-    config = await db.server_config.find_one({}, {"_id": 0})
-    
-    if not config:
-        return {"initialized": False, "running": False}
-    
-    wg_status = get_wg_status()
-    
-    return {
-        "initialized": True,
-        "running": wg_status["running"],
-        "public_key": config["public_key"],
-        "address": config["address"],
-        "port": config["port"]
-    }
+    return await iface.status(await iface.status_sampler.current())
 
 @api_router.post("/wg/server/start")
-async def start_server(current_user: str = Depends(get_current_user)):
+async def start_server(iface: WGInterface = Depends(get_interface), current_user: str = Depends(get_current_user)):
     """Start WireGuard server"""
-    stdout, stderr, code = run_command(["sudo", "wg-quick", "up", WG_INTERFACE])
+    stdout, stderr, code = await iface.wg_quick("up")
     
     if code != 0 and "already exists" not in stderr:
         raise HTTPException(status_code=500, detail=f"Failed to start server: {stderr}")
@@ -398,9 +474,9 @@ async def start_server(current_user: str = Depends(get_current_user)):
     return {"message": "Server started successfully"}
 
 @api_router.post("/wg/server/stop")
-async def stop_server(current_user: str = Depends(get_current_user)):
+async def stop_server(iface: WGInterface = Depends(get_interface), current_user: str = Depends(get_current_user)):
     """Stop WireGuard server"""
-    stdout, stderr, code = run_command(["sudo", "wg-quick", "down", WG_INTERFACE])
+    stdout, stderr, code = await iface.wg_quick("down")
     
     if code != 0:
         raise HTTPException(status_code=500, detail=f"Failed to stop server: {stderr}")
@@ -408,13 +484,13 @@ async def stop_server(current_user: str = Depends(get_current_user)):
     return {"message": "Server stopped successfully"}
 
 @api_router.post("/wg/server/restart")
-async def restart_server(current_user: str = Depends(get_current_user)):
+async def restart_server(iface: WGInterface = Depends(get_interface), current_user: str = Depends(get_current_user)):
     """Restart WireGuard server"""
     # Stop
-    run_command(["sudo", "wg-quick", "down", WG_INTERFACE])
+    await iface.wg_quick("down")
     
     # Start
-    stdout, stderr, code = run_command(["sudo", "wg-quick", "up", WG_INTERFACE])
+    stdout, stderr, code = await iface.wg_quick("up")
     
     if code != 0:
         raise HTTPException(status_code=500, detail=f"Failed to restart server: {stderr}")
@@ -422,208 +498,638 @@ async def restart_server(current_user: str = Depends(get_current_user)):
     return {"message": "Server restarted successfully"}
 
 
+@api_router.post("/wg/server/config/rebuild")
+async def rebuild_server_config(iface: WGInterface = Depends(get_interface), current_user: str = Depends(get_current_user)):
+    """Rewrite the interface config file from the clients collection"""
+    # Re-read the server config too, in case it was changed in Mongo directly
+    iface.server_config.invalidate()
+    async with iface.config_persister.lock:
+        try:
+            iface.config_model = await iface.rebuild_config()
+        except RuntimeError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Config rebuilt successfully", "peers": len(iface.config_model)}
+
+@api_router.post("/wg/server/reconcile")
+async def reconcile_server(
+    dry_run: bool = False,
+    iface: WGInterface = Depends(get_interface),
+    current_user: str = Depends(get_current_user)
+):
+    """Apply the difference between the clients collection and the interface and config file"""
+    try:
+        return await iface.reconciler.reconcile(dry_run=dry_run)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reconciliation failed: {e}")
+
+@api_router.get("/wg/server/reconcile")
+async def get_reconcile_stats(iface: WGInterface = Depends(get_interface), current_user: str = Depends(get_current_user)):
+    """Get reconciliation timings and the last report"""
+    return iface.reconciler.stats()
+
+
+# Interface Routes
+@api_router.get("/wg/interfaces")
+async def list_interfaces(current_user: str = Depends(get_current_user)):
+    """Get all managed interfaces with their status, polling every node concurrently"""
+    snapshots = await interfaces.poll(WG_NODE_TIMEOUT)
+    result = []
+    for iface in interfaces:
+        snapshot = snapshots.get(iface.name)
+        sampler = iface.status_sampler
+        reachable = snapshot is not None and sampler.reachable
+        entry = {
+            "name": iface.name,
+            "default": iface.name == interfaces.default_name,
+            "node": iface.spec.node.host if iface.spec.node else "local",
+            "network": str(iface.network),
+            "endpoint": iface.endpoint,
+            "reachable": reachable,
+            "last_error": sampler.last_error,
+            "last_ok_at": datetime.fromtimestamp(sampler.last_ok_at, timezone.utc).isoformat() if sampler.last_ok_at else None,
+        }
+        if reachable:
+            entry.update(await iface.status(snapshot))
+            entry["peers"] = len(snapshot.peers)
+        result.append(entry)
+    return result
+
+@api_router.post("/wg/interfaces")
+async def create_interface(body: dict = Body(...), current_user: str = Depends(get_current_user)):
+    """Register a new interface (an InterfaceSpec), locally or on a remote node"""
+    try:
+        spec = InterfaceSpec.model_validate(body)
+    except ValidationError as e:
+        # Node user and host go onto the ssh command line; reject anything off
+        raise HTTPException(status_code=400, detail=e.errors(include_url=False, include_context=False))
+    try:
+        iface = await interfaces.add(spec)
+    except (ValueError, DuplicateKeyError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Interface added successfully", "name": iface.name}
+
+
 # WireGuard Client Routes
 @api_router.post("/wg/clients", response_model=WGClient)
-async def create_client(client_data: WGClientCreate, current_user: str = Depends(get_current_user)):
+async def create_client(
+    client_data: WGClientCreate,
+    iface: WGInterface = Depends(get_interface),
+    current_user: str = Depends(get_current_user)
+):
     """Create a new WireGuard client"""
     # Get server config
-    server_config = await db.server_config.find_one({})
+    server_config = await iface.server_config.get()
     if not server_config:
         raise HTTPException(status_code=400, detail="Server not initialized")
     
-    # Get next available IP
-    existing_clients = await db.clients.find({}, {"_id": 0}).to_list(1000)
-    used_ips = [c["ip_address"] for c in existing_clients]
+    # Generate client keys
+    private_key, public_key = generate_wg_keys()
     
-    # Find next available IP (starting from 10.8.0.2)
-    next_ip = None
-    for i in range(2, 255):
-        test_ip = f"10.8.0.{i}"
-        if test_ip not in used_ips:
-            next_ip = test_ip
+    # Reserve the next free IP; a duplicate means another worker took it first
+    for _ in range(IP_ALLOCATION_RETRIES):
+        try:
+            next_ip = iface.ip_pool.allocate()
+        except IPPoolExhausted:
+            raise HTTPException(status_code=400, detail="No available IP addresses")
+        
+        # Create client document
+        client_doc = {
+            "id": str(uuid.uuid4()),
+            "interface": iface.name,
+            "name": client_data.name,
+            "public_key": public_key,
+            "private_key": private_key,
+            "ip_address": next_ip,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "enabled": True,
+            "os_info": client_data.os_info
+        }
+        
+        try:
+            await db.clients.insert_one(client_doc)
+            iface.client_index.touch(client_doc["id"])
             break
+        except DuplicateKeyError:
+            continue
+    else:
+        raise HTTPException(status_code=409, detail="Could not reserve an IP address, please retry")
     
-    if not next_ip:
-        raise HTTPException(status_code=400, detail="No available IP addresses")
+    # Add peer to WireGuard
+    await iface.add_peers([(public_key, next_ip)])
     
-    # Generate client keys
-    private_key, public_key = generate_wg_keys()
+    client_doc.pop("_id", None)
+    return client_doc
+
+@api_router.post("/wg/clients/bulk")
+async def create_clients_bulk(
+    bulk_data: WGClientBulkCreate,
+    iface: WGInterface = Depends(get_interface),
+    current_user: str = Depends(get_current_user)
+):
+    """Create many WireGuard clients at once, streaming one JSON line per client
+
+    Lines go out as each chunk of clients is written; the last one (`done`)
+    tells whether the peers were applied to the interface.
+    """
+    server_config = await iface.server_config.get()
+    if not server_config:
+        raise HTTPException(status_code=400, detail="Server not initialized")
     
-    # Create client document
-    client_doc = {
-        "id": str(uuid.uuid4()),
-        "name": client_data.name,
-        "public_key": public_key,
-        "private_key": private_key,
-        "ip_address": next_ip,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "enabled": True,
-        "os_info": client_data.os_info
-    }
+    # Reserve keys and a block of IPs for the whole batch up front
+    keys = await key_pool.take_async(len(bulk_data.clients))
+    try:
+        ips = iface.ip_pool.allocate_many(len(bulk_data.clients))
+    except IPPoolExhausted:
+        raise HTTPException(status_code=400, detail="Not enough available IP addresses")
+    
+    now = datetime.now(timezone.utc).isoformat()
+    client_docs = [
+        {
+            "id": str(uuid.uuid4()),
+            "interface": iface.name,
+            "name": item.name,
+            "public_key": public_key,
+            "private_key": private_key,
+            "ip_address": ip,
+            "created_at": now,
+            "enabled": True,
+            "os_info": item.os_info
+        }
+        for item, (private_key, public_key), ip in zip(bulk_data.clients, keys, ips)
+    ]
+    
+    # Runs to the end even if the caller disconnects, so no client is left without its peer
+    bulk = BulkCreate(iface, db.clients, client_docs, chunk_size=BULK_INSERT_CHUNK).start()
+    return StreamingResponse(bulk.lines(), media_type="application/x-ndjson")
+
+@api_router.get("/wg/clients")
+async def get_clients(
+    request: Request,
+    since: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=CLIENT_PAGE_MAX),
+    cursor: Optional[str] = None,
+    sort: Optional[Literal["created_at", "name"]] = None,
+    order: Optional[Literal["asc", "desc"]] = None,
+    name: Optional[str] = Query(None, description="Name prefix (case-sensitive)"),
+    enabled: Optional[bool] = None,
+    os_info: Optional[str] = None,
+    connected: Optional[bool] = Query(None, description="Handshake within the last 3 minutes"),
+    iface: WGInterface = Depends(get_interface),
+    current_user: str = Depends(get_current_user)
+):
+    """Get WireGuard clients
+
+    With any of the paging, sorting or filter parameters this returns one
+    page of list items (no key material) and a `next_cursor` for the next
+    one. Without them it returns every client with keys, or with `since`
+    only those changed after that version.
+    """
+    if any(p is not None for p in (limit, cursor, sort, order, name, enabled, os_info, connected)):
+        return await get_client_page(
+            iface, limit or CLIENT_PAGE_LIMIT, cursor, sort or "created_at", order == "desc",
+            name, enabled, os_info, connected
+        )
     
-    await db.clients.insert_one(client_doc)
+    async def full():
+        return await db.clients.find(iface.clients_filter, {"_id": 0}).to_list(None)
     
-    # Add peer to WireGuard config
-    peer_config = f"\n[Peer]\nPublicKey = {public_key}\nAllowedIPs = {next_ip}/32\n"
+    async def delta(changed, removed):
+        clients = await db.clients.find({"id": {"$in": changed}}, {"_id": 0}).to_list(None) if changed else []
+        return {"version": iface.client_index.version, "since": since, "changed": clients, "removed": removed}
     
-    # Append to config file
+    return await versioned_response(request, iface.client_index, since, full, delta)
+
+async def get_client_page(
+    iface: WGInterface,
+    limit: int,
+    cursor: Optional[str],
+    sort: str,
+    descending: bool,
+    name: Optional[str],
+    enabled: Optional[bool],
+    os_info: Optional[str],
+    connected: Optional[bool],
+) -> dict:
+    """One keyset page of the client list"""
+    active = iface.status_sampler.snapshot.active_keys
+    query = client_filter(
+        iface.clients_filter, name_prefix=name, enabled=enabled, os_info=os_info,
+        public_keys=active if connected is not None else None, exclude_public_keys=connected is False
+    )
     try:
-        with open("/tmp/peer.conf", "w") as f:
-            f.write(peer_config)
-        
-        if SSH_ENABLED and SSH_HOST:
-            # Transfer and append via SSH
-            run_command(["scp", "-i", SSH_KEY_PATH, "/tmp/peer.conf", f"{SSH_USER}@{SSH_HOST}:/tmp/peer.conf"])
-            run_command(["sudo", "bash", "-c", f"cat /tmp/peer.conf >> {WG_CONFIG_DIR}/{WG_INTERFACE}.conf"])
-        else:
-            # Append locally
-            run_command(["sudo", "bash", "-c", f"cat /tmp/peer.conf >> /etc/wireguard/{WG_INTERFACE}.conf"])
-        
-        # Reload if running
-        wg_status = get_wg_status()
-        if wg_status["running"]:
-            run_command(["sudo", "wg", "syncconf", WG_INTERFACE, f"/etc/wireguard/{WG_INTERFACE}.conf"])
-    except Exception as e:
-        logging.error(f"Failed to add peer to config: {e}")
+        query, sort_spec = page_query(query, sort, descending, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    client_doc.pop("_id", None)
-    return client_doc
+    # One extra item tells whether there is a next page
+    items = await db.clients.find(query, {**LIST_PROJECTION, "public_key": 1}).sort(sort_spec).limit(limit + 1).to_list(None)
+    cursor = next_cursor(items, sort, limit)
+    for item in items:
+        item["connected"] = item.pop("public_key", None) in active
+    return {"items": items, "next_cursor": cursor, "limit": limit}
 
-@api_router.get("/wg/clients", response_model=List[WGClient])
-async def get_clients(current_user: str = Depends(get_current_user)):
-    """Get all WireGuard clients"""
-    clients = await db.clients.find({}, {"_id": 0}).to_list(1000)
-    return clients
+@api_router.patch("/wg/clients/{client_id}", response_model=WGClient)
+async def update_client(client_id: str, update: WGClientUpdate, current_user: str = Depends(get_current_user)):
+    """Rename, enable or disable a WireGuard client, or set its monthly quota"""
+    client, iface = await find_client(client_id)
+    
+    changes = update.model_dump(exclude_unset=True)
+    if changes.get("enabled") is False:
+        # Disabled by hand: stays disabled when the next quota month starts
+        changes["quota_exceeded"] = None
+    if changes:
+        await db.clients.update_one({"id": client_id}, {"$set": changes})
+        iface.client_index.touch(client_id)
+    
+    # Enabling or disabling only touches this one peer
+    if "enabled" in changes and changes["enabled"] != client.get("enabled", True):
+        if changes["enabled"]:
+            await iface.add_peers([(client["public_key"], client["ip_address"])])
+        else:
+            await iface.remove_peers([client["public_key"]])
+    
+    client.update(changes)
+    return client
 
 @api_router.delete("/wg/clients/{client_id}")
 async def delete_client(client_id: str, current_user: str = Depends(get_current_user)):
     """Delete a WireGuard client"""
-    client = await db.clients.find_one({"id": client_id})
-    if not client:
-        raise HTTPException(status_code=404, detail="Client not found")
+    client, iface = await find_client(client_id)
     
     # Remove from database
     await db.clients.delete_one({"id": client_id})
+    iface.client_index.remove(client_id)
+    qr_cache.invalidate(client_id)
+    await iface.accounting.forget(client["public_key"])
+    iface.ip_pool.release(client["ip_address"])
     
     # Remove from WireGuard
-    public_key = client["public_key"]
-    run_command(["sudo", "wg", "set", WG_INTERFACE, "peer", public_key, "remove"])
+    await iface.remove_peers([client["public_key"]])
     
     return {"message": "Client deleted successfully"}
 
+def render_client_config(client: dict, server_config: WGServerConfig, iface: WGInterface) -> str:
+    """wg-quick config file for a client"""
+    return f"""[Interface]
+PrivateKey = {client['private_key']}
+Address = {client['ip_address']}/{iface.prefix}
+DNS = 1.1.1.1
+
+[Peer]
+PublicKey = {server_config.public_key}
+Endpoint = {iface.endpoint}
+AllowedIPs = {iface.client_allowed_ips()}
+PersistentKeepalive = 25
+"""
+
 @api_router.get("/wg/clients/{client_id}/config")
 async def get_client_config(client_id: str, current_user: str = Depends(get_current_user)):
     """Get client configuration file content"""
-    client = await db.clients.find_one({"id": client_id}, {"_id": 0})
-    if not client:
-        raise HTTPException(status_code=404, detail="Client not found")
+    client, iface = await find_client(client_id)
     
-    server_config = await db.server_config.find_one({}, {"_id": 0})
+    server_config = await iface.server_config.get()
     if not server_config:
         raise HTTPException(status_code=400, detail="Server not initialized")
     
-    # Generate client config
-    config = f"""[Interface]
-PrivateKey = {client['private_key']}
-Address = {client['ip_address']}/24
-DNS = 1.1.1.1
-
-[Peer]
-PublicKey = {server_config['public_key']}
-Endpoint = {SERVER_DOMAIN}:{SERVER_PORT}
-AllowedIPs = 0.0.0.0/0
-PersistentKeepalive = 25
-"""
+    with trace_span("render"):
+        config = render_client_config(client, server_config, iface)
     
     return {"config": config, "filename": f"{client['name']}.conf"}
 
 @api_router.get("/wg/clients/{client_id}/qrcode")
-async def get_client_qrcode(client_id: str, current_user: str = Depends(get_current_user)):
-    """Get client configuration as QR code"""
-    client = await db.clients.find_one({"id": client_id}, {"_id": 0})
-    if not client:
-        raise HTTPException(status_code=404, detail="Client not found")
+async def get_client_qrcode(
+    client_id: str,
+    format: str = Query("json", pattern="^(json|png|svg)$"),
+    current_user: str = Depends(get_current_user)
+):
+    """Get client configuration as QR code (JSON data URL, raw PNG or SVG)"""
+    client, iface = await find_client(client_id)
     
-    server_config = await db.server_config.find_one({}, {"_id": 0})
+    server_config = await iface.server_config.get()
     if not server_config:
         raise HTTPException(status_code=400, detail="Server not initialized")
     
-    # Generate client config
-    config = f"""[Interface]
-PrivateKey = {client['private_key']}
-Address = {client['ip_address']}/24
-DNS = 1.1.1.1
-
-[Peer]
-PublicKey = {server_config['public_key']}
-Endpoint = {SERVER_DOMAIN}:{SERVER_PORT}
-AllowedIPs = 0.0.0.0/0
-PersistentKeepalive = 25"""
+    fmt = "png" if format == "json" else format
+    config = render_client_config(client, server_config, iface).rstrip("\n")
+    with trace_span("render.qr"):
+        image = await qr_cache.get(client_id, (server_config.public_key, iface.endpoint), config, fmt)
     
-    # Generate QR code
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(config)
-    qr.make(fit=True)
+    if format == "json":
+        img_base64 = base64.b64encode(image).decode()
+        return {"qrcode": f"data:image/png;base64,{img_base64}"}
     
-    img = qr.make_image(fill_color="black", back_color="white")
+    # The code contains the client's private key
+    return Response(content=image, media_type=QR_FORMATS[fmt], headers={"Cache-Control": "no-store"})
+
+@api_router.get("/wg/clients/export")
+async def export_client_configs(
+    name: Optional[str] = Query(None, description="Name prefix (case-sensitive)"),
+    enabled: Optional[bool] = None,
+    os_info: Optional[str] = None,
+    qrcode: bool = Query(False, description="Add a PNG QR code next to every config"),
+    iface: WGInterface = Depends(get_interface),
+    current_user: str = Depends(get_current_user)
+):
+    """Download the configs of all (or the filtered) clients as a ZIP archive
+
+    Configs are rendered while the clients are read from a cursor and the
+    archive is streamed as it is built, so memory use does not grow with
+    the number of clients.
+    """
+    server_config = await iface.server_config.get()
+    if not server_config:
+        raise HTTPException(status_code=400, detail="Server not initialized")
+    
+    query = client_filter(iface.clients_filter, name_prefix=name, enabled=enabled, os_info=os_info)
+    projection = {"_id": 0, "id": 1, "name": 1, "private_key": 1, "ip_address": 1}
     
-    # Convert to base64
-    buf = io.BytesIO()
-    img.save(buf, format='PNG')
-    buf.seek(0)
-    img_base64 = base64.b64encode(buf.read()).decode()
+    async def archive():
+        export = ZipExport()
+        used = set()
+        cursor = db.clients.find(query, projection).sort([("name", 1), ("id", 1)]).batch_size(CONFIG_EXPORT_BATCH)
+        image = None
+        try:
+            async for client in cursor:
+                basename = entry_basename(client["name"], client["id"], used)
+                with trace_span("render"):
+                    config = render_client_config(client, server_config, iface)
+                # The QR code renders in the pool while the config is compressed
+                image = asyncio.ensure_future(qr_cache.render(config.rstrip("\n"))) if qrcode else None
+                chunk = export.add(f"{basename}.conf", config.encode())
+                if chunk:
+                    yield chunk
+                if image is not None:
+                    # PNG data is already compressed
+                    with trace_span("render.qr"):
+                        png = await image
+                    chunk = export.add(f"{basename}.png", png, compress=False)
+                    if chunk:
+                        yield chunk
+        finally:
+            # The download may stop while a QR code renders; cancel it and retrieve its outcome
+            if image is not None:
+                image.cancel()
+                await asyncio.gather(image, return_exceptions=True)
+            await cursor.close()
+        yield export.close()
+        logger.info(f"Exported {len(used)} client configs of {iface.name}")
     
-    return {"qrcode": f"data:image/png;base64,{img_base64}"}
+    filename = f"{iface.name}-clients.zip"
+    return StreamingResponse(
+        archive(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"}
+    )
 
 
 # Statistics Route
 @api_router.get("/wg/stats", response_model=WGStats)
-async def get_stats(current_user: str = Depends(get_current_user)):
-    """Get WireGuard statistics"""
-    wg_status = get_wg_status()
-    all_clients = await db.clients.find({}, {"_id": 0}).to_list(1000)
-    
-    # Match clients with active peers
-    client_stats = []
-    for client in all_clients:
-        peer_data = None
-        for peer in wg_status.get("peers", []):
-            if peer["public_key"] == client["public_key"]:
-                peer_data = peer
-                break
-        
-        rx_bytes = 0
-        tx_bytes = 0
-        if peer_data:
-            rx_bytes = parse_traffic(peer_data.get("rx_bytes", "0 B"))
-            tx_bytes = parse_traffic(peer_data.get("tx_bytes", "0 B"))
-        
-        client_stats.append({
-            "id": client["id"],
-            "name": client["name"],
-            "ip_address": client["ip_address"],
-            "os_info": client.get("os_info"),
-            "connected": peer_data is not None,
-            "latest_handshake": peer_data.get("latest_handshake") if peer_data else None,
-            "endpoint": peer_data.get("endpoint") if peer_data else None,
-            "rx_bytes": rx_bytes,
-            "tx_bytes": tx_bytes,
-            "total_bytes": rx_bytes + tx_bytes
-        })
-    
-    active_count = sum(1 for c in client_stats if c["connected"])
+async def get_stats(
+    request: Request,
+    since: Optional[int] = None,
+    iface: WGInterface = Depends(get_interface),
+    current_user: str = Depends(get_current_user)
+):
+    """Get WireGuard statistics, or with `since` only the clients changed after that version"""
+    snapshot = await iface.refresh_stats_index()
+    stats_index = iface.stats_index
+    
+    def summary():
+        client_stats = stats_index.values()
+        return {
+            "version": stats_index.version,
+            "active_clients": sum(1 for c in client_stats if c["connected"]),
+            "total_clients": len(client_stats),
+            "server_running": snapshot.running,
+            "sampled_at": datetime.fromtimestamp(snapshot.taken_at, timezone.utc).isoformat()
+        }
     
+    async def full():
+        return {**summary(), "clients": stats_index.values()}
+    
+    async def delta(changed, removed):
+        return {
+            **summary(),
+            "since": since,
+            "changed": [stats_index.get(client_id) for client_id in changed],
+            "removed": removed
+        }
+    
+    return await versioned_response(request, stats_index, since, full, delta)
+
+
+# Traffic Routes
+@api_router.get("/wg/clients/{client_id}/traffic")
+async def get_client_traffic(
+    client_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: Optional[str] = None,
+    current_user: str = Depends(get_current_user)
+):
+    """Get a client's traffic rates over a time range (default: last 24 hours)"""
+    if resolution is not None and resolution not in TIERS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of {', '.join(TIERS)}")
+    
+    client, iface = await find_client(client_id)
+    
+    default_start, default_end = default_range()
+    end = end or default_end
+    start = start or end - (default_end - default_start)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    
+    result = await iface.traffic.query(client["public_key"], start, end, resolution)
+    return {"client_id": client_id, "start": start.isoformat(), "end": end.isoformat(), **result}
+
+@api_router.get("/wg/clients/{client_id}/usage")
+async def get_client_usage(client_id: str, current_user: str = Depends(get_current_user)):
+    """Get a client's cumulative traffic, usage this month and quota"""
+    client, iface = await find_client(client_id)
+    return {"client_id": client_id, **iface.accounting.usage(client)}
+
+@api_router.get("/wg/traffic/rates")
+async def get_traffic_rates(
+    limit: int = 20,
+    iface: WGInterface = Depends(get_interface),
+    current_user: str = Depends(get_current_user)
+):
+    """Get the clients currently using the most bandwidth"""
+    rates = iface.traffic.current_rates(limit=max(1, min(limit, 1000)))
+    keys = [r["public_key"] for r in rates]
+    clients = {
+        c["public_key"]: c
+        async for c in db.clients.find({"public_key": {"$in": keys}}, {"_id": 0, "id": 1, "name": 1, "public_key": 1})
+    }
     return {
-        "active_clients": active_count,
-        "total_clients": len(all_clients),
-        "server_running": wg_status["running"],
-        "clients": client_stats
+        "window_seconds": iface.traffic.rate_window,
+        "clients": [
+            {
+                "id": clients.get(r["public_key"], {}).get("id"),
+                "name": clients.get(r["public_key"], {}).get("name"),
+                "rx_rate": r["rx_rate"],
+                "tx_rate": r["tx_rate"]
+            }
+            for r in rates
+        ]
     }
 
 
+# Live Stats Route
+@api_router.post("/wg/stream/token")
+async def create_stream_token(current_user: str = Depends(get_current_user)):
+    """Issue a short-lived token for opening /wg/stream"""
+    token = create_access_token(
+        data={"sub": current_user, "scope": "stream"},
+        expires_delta=timedelta(seconds=STREAM_TOKEN_EXPIRE_SECONDS)
+    )
+    return {"token": token, "expires_in": STREAM_TOKEN_EXPIRE_SECONDS}
+
+@api_router.get("/wg/stream")
+async def stream_stats(
+    request: Request,
+    iface: WGInterface = Depends(get_interface),
+    current_user: str = Depends(get_stream_user)
+):
+    """Stream server status and client stats as Server-Sent Events
+
+    The first event (`full`) carries the complete state, later `delta`
+    events only the clients that changed or were removed. `token` comes
+    from POST /wg/stream/token and is only checked when the stream opens.
+    """
+    broadcaster = iface.stats_broadcaster
+    
+    async def events():
+        queue = broadcaster.subscribe()
+        try:
+            yield await broadcaster.full_frame(await iface.status_sampler.current())
+            while not await request.is_disconnected():
+                try:
+                    frame = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if frame is RESYNC:
+                    frame = await broadcaster.full_frame(iface.status_sampler.snapshot)
+                yield frame
+        finally:
+            broadcaster.unsubscribe(queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# SSH Route
+@api_router.get("/wg/ssh/stats")
+async def get_ssh_stats(current_user: str = Depends(get_current_user)):
+    """Get SSH connection pool statistics of every remote node"""
+    transports = interfaces.transports()
+    return {"enabled": bool(transports), "nodes": [transport.stats() for transport in transports]}
+
+
+# Metrics Route
+@api_router.get("/metrics")
+async def get_metrics(current_user: str = Depends(get_metrics_user)):
+    """Prometheus text exposition, rendered from in-memory state only"""
+    out = Exposition()
+    write_peer_metrics(
+        out,
+        {iface.name: iface.status_sampler.snapshot for iface in interfaces},
+        {iface.name: len(iface.client_index) for iface in interfaces}
+    )
+    out.histogram("wireguard_command_duration_seconds", "Local command latency by program", (
+        ((("program", program),), stats) for program, stats in sorted(command_runner.latency.items())
+    ))
+    transports = interfaces.transports()
+    out.histogram("wireguard_ssh_command_duration_seconds", "Remote command latency per node", (
+        ((("node", transport.host),), transport.command_latency) for transport in transports
+    ))
+    out.histogram("wireguard_ssh_connect_duration_seconds", "SSH master connection setup latency per node", (
+        ((("node", transport.host),), transport.connect_latency) for transport in transports
+    ))
+    out.histogram("wireguard_reconcile_diff_seconds", "Time to diff desired and actual peers", (
+        ((("interface", iface.name),), iface.reconciler.diff_latency) for iface in interfaces
+    ))
+    out.histogram("wireguard_reconcile_apply_seconds", "Time to apply a reconciliation to the interface", (
+        ((("interface", iface.name),), iface.reconciler.apply_latency) for iface in interfaces
+    ))
+    out.counter("wireguard_reconcile_peers_changed_total", "Kernel peers added, updated or removed by reconciliation", (
+        ((("interface", iface.name),), iface.reconciler.peers_changed) for iface in interfaces
+    ))
+    out.counter("wireguard_quota_disabled_total", "Clients disabled for exceeding their monthly traffic quota", (
+        ((("interface", iface.name),), iface.accounting.quota_disabled) for iface in interfaces
+    ))
+    out.histogram("auth_password_duration_seconds", "bcrypt latency by operation", (
+        ((("operation", "hash"),), password_hasher.hash_latency),
+        ((("operation", "verify"),), password_hasher.verify_latency),
+    ))
+    out.histogram("auth_password_queue_seconds", "Wait for a free bcrypt worker", (
+        ((), password_hasher.queue_latency),
+    ))
+    out.counter("auth_rejected_total", "Password operations rejected because the queue was full", (
+        ((), password_hasher.rejected),
+    ))
+    mongo_metrics.write(out)
+    route_metrics.write(out)
+    return Response(content=out.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+# Diagnostics Routes
+@api_router.get("/debug/requests/slow")
+async def get_slow_requests(current_user: str = Depends(get_current_user)):
+    """Recent requests slower than SLOW_REQUEST_MS with their span breakdown, slowest first"""
+    return {
+        "enabled": REQUEST_TRACING,
+        "threshold_ms": SLOW_REQUEST_MS,
+        "traced": slow_requests.traced,
+        "slow": slow_requests.slow,
+        "requests": slow_requests.entries()
+    }
+
+@api_router.delete("/debug/requests/slow")
+async def clear_slow_requests(current_user: str = Depends(get_current_user)):
+    """Empty the slow request log"""
+    slow_requests.clear()
+    return {"message": "Slow request log cleared"}
+
+@api_router.get("/debug/profile")
+async def get_profile(reset: bool = False, current_user: str = Depends(get_current_user)):
+    """Folded event loop stacks from the sampling profiler, for flamegraph.pl or speedscope"""
+    if stack_sampler is None:
+        raise HTTPException(status_code=404, detail="Profiler disabled, set PROFILE_INTERVAL_MS")
+    
+    body = stack_sampler.folded()
+    samples = stack_sampler.samples
+    if reset:
+        stack_sampler.reset()
+    return Response(content=body, media_type="text/plain", headers={"X-Samples": str(samples)})
+
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Live streams and downloads last as long as the client reads; their
+# duration says nothing about the server and stays out of metrics and logs
+STREAM_MEDIA_TYPES = ["text/event-stream", "application/zip"]
+
+# Request latency by route (scrapes of /api/metrics itself are left out)
+route_metrics = RouteMetrics()
+app.add_middleware(RouteMetricsMiddleware, metrics=route_metrics, exclude=["/api/metrics"], stream_types=STREAM_MEDIA_TYPES)
+
+# Per-request spans in a Server-Timing header and the slow request log
+if REQUEST_TRACING:
+    app.add_middleware(
+        TracingMiddleware, log=slow_requests, exclude=["/api/metrics"],
+        server_timing=SERVER_TIMING, stream_types=STREAM_MEDIA_TYPES
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -639,6 +1145,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_background_tasks():
+    await bootstrap_indexes(db)
+    await interfaces.load()
+    key_pool.start()
+    await interfaces.start()
+    if stack_sampler is not None:
+        # Started from the event loop thread, which is the one sampled
+        stack_sampler.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await interfaces.stop()
+    await key_pool.stop()
+    if stack_sampler is not None:
+        stack_sampler.stop()
+    qr_cache.shutdown()
+    password_hasher.shutdown()
     client.close()
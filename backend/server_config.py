@@ -0,0 +1,58 @@
+"""Cached access to the server_config documents
+
+Each interface's server config is written once, by /wg/server/init, but
+read by nearly every client endpoint. ServerConfigStore keeps it in memory
+after the first read and updates it on write, so those endpoints skip the
+Mongo round trip.
+"""
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class WGServerConfig(BaseModel):
+    private_key: str
+    public_key: str
+    address: str
+    port: int
+    initialized: bool
+    created_at: datetime
+
+
+class ServerConfigStore:
+    """In-process cache of one interface's server_config document"""
+
+    def __init__(self, collection, interface: str):
+        self.collection = collection
+        self.interface = interface
+        self._config: Optional[WGServerConfig] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def cached(self) -> Optional[WGServerConfig]:
+        return self._config
+
+    async def get(self) -> Optional[WGServerConfig]:
+        """The server config, or None while the server is not initialized"""
+        if self._config is not None:
+            return self._config
+        # Not initialized yet is not cached, so an init by another worker is seen
+        async with self._lock:
+            if self._config is None:
+                await self.load()
+            return self._config
+
+    async def load(self) -> Optional[WGServerConfig]:
+        doc = await self.collection.find_one({"interface": self.interface}, {"_id": 0})
+        self._config = WGServerConfig(**doc) if doc else None
+        return self._config
+
+    async def save(self, config: WGServerConfig):
+        await self.collection.insert_one({**config.model_dump(mode="json"), "interface": self.interface})
+        self._config = config
+
+    def invalidate(self):
+        """Drop the cached config; the next get() reads it from Mongo again"""
+        self._config = None
@@ -0,0 +1,266 @@
+"""Pooled SSH transport for remote WireGuard management
+
+Keeps a small pool of OpenSSH ControlMaster sessions to the managed host.
+Every remote command is multiplexed over one of these warm connections, so it
+costs a channel open instead of a full TCP and key exchange handshake.
+"""
+import asyncio
+import hashlib
+import logging
+import shlex
+import time
+from itertools import count
+from pathlib import Path
+from typing import List, Optional, Set
+
+from command_runner import CommandRunner
+from latency import LatencyStats
+
+
+logger = logging.getLogger(__name__)
+
+
+class _MasterSlot:
+    """One ControlMaster process and its control socket"""
+
+    def __init__(self, socket_path: Path):
+        self.socket_path = socket_path
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.healthy = False
+        self.connected_at = 0.0
+        self.lock = asyncio.Lock()
+
+
+class SSHTransport:
+    """Runs commands on a remote host over multiplexed SSH sessions"""
+
+    def __init__(
+        self,
+        runner: CommandRunner,
+        host: str,
+        port: int = 22,
+        user: str = "root",
+        key_path: str = "",
+        pool_size: int = 2,
+        control_dir: Path = Path("/tmp/wg-admin-ssh"),
+        health_interval: float = 30.0,
+        connect_timeout: float = 10.0,
+    ):
+        self.runner = runner
+        self.host = host
+        self.port = port
+        self.user = user
+        self.key_path = key_path
+        self.health_interval = health_interval
+        self.connect_timeout = connect_timeout
+        self.control_dir = control_dir
+
+        # Socket paths are length-limited, so name them by a short target hash
+        target = hashlib.sha1(f"{user}@{host}:{port}".encode()).hexdigest()[:10]
+        self._slots = [_MasterSlot(control_dir / f"{target}-{i}.sock") for i in range(max(1, pool_size))]
+        self._next_slot = count()
+        self._health_task: Optional[asyncio.Task] = None
+        # Reconnects started in the background, referenced until they finish
+        self._background: Set[asyncio.Task] = set()
+
+        self.command_latency = LatencyStats()
+        self.connect_latency = LatencyStats()
+        self.connects = 0
+        self.reconnects = 0
+        self.failures = 0
+
+    @property
+    def destination(self) -> str:
+        return f"{self.user}@{self.host}"
+
+    def _target(self) -> List[str]:
+        """User and host as ssh arguments; after `--` neither can be read as an option"""
+        return ["-l", self.user, "--", self.host]
+
+    def _options(self, slot: _MasterSlot) -> List[str]:
+        options = ["-o", "StrictHostKeyChecking=no", "-o", f"ControlPath={slot.socket_path}"]
+        if self.key_path:
+            options = ["-i", self.key_path] + options
+        return options
+
+    def _pick_slot(self) -> _MasterSlot:
+        """Round-robin over healthy sessions, falling back to any slot"""
+        for _ in range(len(self._slots)):
+            slot = self._slots[next(self._next_slot) % len(self._slots)]
+            if slot.healthy:
+                return slot
+        return self._slots[next(self._next_slot) % len(self._slots)]
+
+    async def run(
+        self,
+        cmd: List[str],
+        input: Optional[bytes] = None,
+        timeout: Optional[float] = None,
+    ) -> tuple[str, str, int]:
+        """Run a command on the remote host"""
+        slot = self._pick_slot()
+        if not slot.healthy and not slot.lock.locked():
+            # Without a master ssh falls back to a direct connection; warm the
+            # slot in the background so the next command is multiplexed again
+            self._connect_in_background(slot)
+
+        ssh_cmd = ["ssh", "-p", str(self.port)] + self._options(slot) + [
+            "-o", "ControlMaster=no",
+            *self._target(),
+            shlex.join(cmd),
+        ]
+        start = time.perf_counter()
+        stdout, stderr, code = await self.runner.run(ssh_cmd, input=input, timeout=timeout)
+        self.command_latency.observe(time.perf_counter() - start)
+
+        # 255 is ssh's own failure code, as opposed to the remote command's
+        if code == 255:
+            self.failures += 1
+            slot.healthy = False
+        return stdout, stderr, code
+
+    async def copy_to(self, local_path: str, remote_path: str, timeout: Optional[float] = None) -> tuple[str, str, int]:
+        """Copy a local file to the remote host over a pooled session"""
+        slot = self._pick_slot()
+        # scp has no -l for the user (it limits bandwidth)
+        host = f"[{self.host}]" if ":" in self.host else self.host
+        scp_cmd = ["scp", "-P", str(self.port)] + self._options(slot) + [
+            "-o", "ControlMaster=no",
+            "-o", f"User={self.user}",
+            "--",
+            local_path,
+            f"{host}:{remote_path}",
+        ]
+        start = time.perf_counter()
+        result = await self.runner.run(scp_cmd, timeout=timeout)
+        self.command_latency.observe(time.perf_counter() - start)
+        return result
+
+    def _connect_in_background(self, slot: _MasterSlot):
+        task = asyncio.ensure_future(self._connect(slot))
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background SSH connect to {self.destination} failed: {task.exception()}")
+
+    async def _connect(self, slot: _MasterSlot) -> bool:
+        """(Re)start the ControlMaster for a slot and wait until it is usable"""
+        async with slot.lock:
+            if slot.healthy and slot.process and slot.process.returncode is None:
+                return True
+            await self._terminate(slot)
+            reconnect = slot.connected_at > 0
+
+            self.control_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+            slot.socket_path.unlink(missing_ok=True)
+            start = time.perf_counter()
+            try:
+                slot.process = await asyncio.create_subprocess_exec(
+                    "ssh", "-p", str(self.port), *self._options(slot),
+                    "-o", "ControlMaster=yes",
+                    "-o", "ServerAliveInterval=15",
+                    "-N", *self._target(),
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+            except Exception as e:
+                logger.error(f"Failed to start SSH master for {self.destination}: {e}")
+                self.failures += 1
+                return False
+
+            deadline = time.monotonic() + self.connect_timeout
+            while time.monotonic() < deadline:
+                if slot.process.returncode is not None:
+                    break
+                if await self._check(slot):
+                    slot.healthy = True
+                    slot.connected_at = time.time()
+                    self.connect_latency.observe(time.perf_counter() - start)
+                    self.connects += 1
+                    if reconnect:
+                        self.reconnects += 1
+                    return True
+                await asyncio.sleep(0.1)
+
+            logger.warning(f"SSH master for {self.destination} did not come up")
+            self.failures += 1
+            await self._terminate(slot)
+            return False
+
+    async def _check(self, slot: _MasterSlot) -> bool:
+        """Ask the master whether it is still alive"""
+        if not slot.socket_path.exists():
+            return False
+        _, _, code = await self.runner.run(
+            ["ssh", *self._options(slot), "-O", "check", *self._target()],
+            timeout=self.connect_timeout,
+        )
+        return code == 0
+
+    async def _terminate(self, slot: _MasterSlot):
+        slot.healthy = False
+        if slot.process and slot.process.returncode is None:
+            slot.process.terminate()
+            try:
+                await asyncio.wait_for(slot.process.wait(), 5)
+            except asyncio.TimeoutError:
+                slot.process.kill()
+                await slot.process.wait()
+        slot.process = None
+
+    async def health_check(self):
+        """Check every session and reconnect the ones that died"""
+        async def check_slot(slot: _MasterSlot):
+            alive = slot.process is not None and slot.process.returncode is None and await self._check(slot)
+            slot.healthy = alive
+            if not alive:
+                await self._connect(slot)
+
+        await asyncio.gather(*(check_slot(slot) for slot in self._slots))
+
+    async def start(self):
+        """Start the health check loop, which also warms up all sessions"""
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self):
+        """Stop health checks and close all sessions"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        background = list(self._background)
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        for slot in self._slots:
+            await self._terminate(slot)
+            slot.socket_path.unlink(missing_ok=True)
+
+    async def _health_loop(self):
+        while True:
+            try:
+                await self.health_check()
+            except Exception as e:
+                logger.error(f"SSH health check failed: {e}")
+            await asyncio.sleep(self.health_interval)
+
+    def stats(self) -> dict:
+        """Pool-level connection and latency statistics"""
+        return {
+            "host": self.host,
+            "pool_size": len(self._slots),
+            "healthy": sum(1 for slot in self._slots if slot.healthy),
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "failures": self.failures,
+            "command_latency": self.command_latency.summary(),
+            "connect_latency": self.connect_latency.summary(),
+        }
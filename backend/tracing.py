@@ -0,0 +1,264 @@
+"""Per-request stage timing
+
+Every traced request carries a RequestTrace in a context variable. The
+places that wait on something (Mongo commands, child processes, bcrypt,
+rendering, JSON encoding) add their time to it as named spans, so a slow
+request can be broken down without a profiler. Motor and asyncio.to_thread
+copy the context into their worker threads, so spans recorded there land in
+the right request. Outside a traced request (background loops, tracing
+disabled) recording is a single context variable lookup.
+
+The middleware reports the spans in a `Server-Timing` header and keeps the
+slowest recent requests in a bounded log. The header goes only to
+authenticated requests by default: on the login route the `bcrypt` span
+alone would tell which usernames exist. StackSampler is an opt-in
+sampling profiler of the event loop thread.
+"""
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+
+_current: ContextVar[Optional["RequestTrace"]] = ContextVar("request_trace", default=None)
+
+
+class RequestTrace:
+    """Spans of one request as {name: [seconds, count]}"""
+
+    __slots__ = ("method", "path", "started_at", "duration", "status_code", "spans", "finished", "authenticated", "_lock")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.status_code = 500
+        self.spans: Dict[str, List[float]] = {}
+        self.finished = False
+        self.authenticated = False
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        # Tasks spawned by the request may outlive it; they stop counting here
+        if self.finished:
+            return
+        with self._lock:
+            span = self.spans.get(name)
+            if span is None:
+                self.spans[name] = [seconds, 1]
+            else:
+                span[0] += seconds
+                span[1] += 1
+
+    def server_timing(self, total: Optional[float] = None) -> str:
+        """`Server-Timing` header value, durations in milliseconds"""
+        with self._lock:
+            spans = sorted(self.spans.items())
+        entries = [f'{name};dur={seconds * 1000:.3f};desc="{count}x"' for name, (seconds, count) in spans]
+        if total is not None:
+            entries.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(entries)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = {name: {"ms": round(seconds * 1000, 3), "count": count} for name, (seconds, count) in self.spans.items()}
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status": self.status_code,
+            "duration_ms": round(self.duration * 1000, 3),
+            "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            "spans": spans,
+        }
+
+
+def record(name: str, seconds: float):
+    """Add `seconds` to span `name` of the current request, if it is traced"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+def authenticated():
+    """Mark the current request as authenticated (it may see its Server-Timing)"""
+    trace = _current.get()
+    if trace is not None:
+        trace.authenticated = True
+
+
+class span:
+    """Time a block into span `name` of the current request"""
+
+    __slots__ = ("name", "trace", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = _current.get()
+        if self.trace is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.trace is not None:
+            self.trace.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class SlowRequestLog:
+    """Ring of the most recent requests slower than `threshold` seconds"""
+
+    def __init__(self, threshold: float = 0.5, size: int = 50):
+        self.threshold = threshold
+        self._entries: deque = deque(maxlen=size)
+        self.traced = 0
+        self.slow = 0
+
+    def observe(self, trace: RequestTrace):
+        self.traced += 1
+        if trace.duration >= self.threshold:
+            self.slow += 1
+            self._entries.append(trace)
+
+    def entries(self) -> List[dict]:
+        """Logged requests, slowest first"""
+        return [trace.to_dict() for trace in sorted(self._entries, key=lambda t: t.duration, reverse=True)]
+
+    def clear(self):
+        self._entries.clear()
+
+
+def content_type(headers) -> bytes:
+    """Media type of raw ASGI response headers, without parameters"""
+    for name, value in headers:
+        if name.lower() == b"content-type":
+            return value.split(b";", 1)[0].strip().lower()
+    return b""
+
+
+class TracingMiddleware:
+    """ASGI middleware giving every HTTP request a RequestTrace
+
+    The `Server-Timing` header has to go out with the response start, so it
+    holds the spans up to then plus the time so far; streaming responses
+    keep recording into the slow request log until the stream ends.
+    `server_timing` is "auth" (only requests marked `authenticated()`),
+    "all" or "off". Responses of a `stream_types` content type (event
+    streams, downloads) last as long as the client keeps reading and are
+    left out of the log.
+    """
+
+    def __init__(self, app, log: SlowRequestLog, exclude: Iterable[str] = (), server_timing: str = "auth",
+                 stream_types: Iterable[str] = ("text/event-stream",)):
+        self.app = app
+        self.log = log
+        self.exclude = set(exclude)
+        self.server_timing = server_timing
+        self.stream_types = {t.encode("latin-1") for t in stream_types}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope["method"], scope["path"])
+        started = time.perf_counter()
+        stream = False
+
+        async def send_wrapper(message):
+            nonlocal stream
+            if message["type"] == "http.response.start":
+                trace.status_code = message["status"]
+                headers = message.get("headers", ())
+                stream = content_type(headers) in self.stream_types
+                if self.server_timing == "all" or (self.server_timing == "auth" and trace.authenticated):
+                    timing = trace.server_timing(time.perf_counter() - started).encode("latin-1")
+                    message = {**message, "headers": [*headers, (b"server-timing", timing)]}
+            await send(message)
+
+        token = _current.set(trace)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            trace.duration = time.perf_counter() - started
+            trace.finished = True
+            if not stream:
+                self.log.observe(trace)
+
+
+class StackSampler:
+    """Sampling profiler of one thread, aggregated into folded stacks
+
+    A daemon thread looks at the target thread's current frame every
+    `interval` seconds and counts the call stack, root first, in the
+    `a;b;c count` format flamegraph.pl and speedscope read. Waiting in the
+    event loop's selector is counted as `<idle>`. At most `max_stacks`
+    distinct stacks are kept; later new ones are counted as `<other>`.
+    """
+
+    def __init__(self, interval: float = 0.01, max_stacks: int = 5000, max_depth: int = 64):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._target: Optional[int] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, thread_id: Optional[int] = None):
+        """Sample `thread_id` (default: the calling thread) until stop()"""
+        if self.running:
+            return
+        self._target = threading.get_ident() if thread_id is None else thread_id
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _stack(self, frame) -> str:
+        if frame.f_code.co_name == "select" and frame.f_code.co_filename.endswith("selectors.py"):
+            return "<idle>"
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def sample(self):
+        frame = sys._current_frames().get(self._target)
+        if frame is None:
+            return
+        stack = self._stack(frame)
+        if stack not in self._stacks and len(self._stacks) >= self.max_stacks:
+            stack = "<other>"
+        self._stacks[stack] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def folded(self) -> str:
+        """Collected stacks, most frequent first"""
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def reset(self):
+        self._stacks = Counter()
+        self.samples = 0
@@ -0,0 +1,267 @@
+"""Per-peer traffic time series
+
+Every status snapshot is turned into per-peer rx/tx deltas. Recent deltas
+live in a compact fixed-size ring per peer for "who is busy right now"
+queries. Non-zero deltas are written in batches to a Mongo time-series
+collection and rolled up into 1m/1h/1d buckets, so range queries read at
+most a few hundred bucket documents no matter how far back they reach.
+"""
+import asyncio
+import logging
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from wg_status import WGStatusSnapshot
+
+
+logger = logging.getLogger(__name__)
+
+# Rollup tiers: name -> bucket size in seconds
+TIERS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+# Longest range a tier answers before the next coarser one is used
+TIER_MAX_RANGE = {"1m": 6 * 3600, "1h": 31 * 86400, "1d": None}
+
+# How long rollup buckets are kept (None keeps them forever)
+TIER_RETENTION = {"1m": 14 * 86400, "1h": 400 * 86400, "1d": None}
+
+# Raw samples kept in memory when Mongo writes keep failing
+MAX_PENDING_SAMPLES = 100000
+
+
+def counter_delta(previous: int, current: int) -> int:
+    """Increase of a WireGuard byte counter; a drop means it was reset"""
+    return current - previous if current >= previous else current
+
+
+class PeerRing:
+    """Fixed-size ring of (timestamp, rx delta, tx delta) samples for one peer"""
+
+    __slots__ = ("ts", "rx", "tx", "next", "last_rx", "last_tx")
+
+    def __init__(self, capacity: int, last_rx: int, last_tx: int):
+        self.ts = array("d", bytes(8 * capacity))
+        self.rx = array("Q", bytes(8 * capacity))
+        self.tx = array("Q", bytes(8 * capacity))
+        self.next = 0
+        self.last_rx = last_rx
+        self.last_tx = last_tx
+
+    def append(self, ts: float, rx: int, tx: int):
+        i = self.next % len(self.ts)
+        self.ts[i] = ts
+        self.rx[i] = rx
+        self.tx[i] = tx
+        self.next += 1
+
+    def rate(self, since: float, seconds: float) -> Tuple[float, float]:
+        """Average rx/tx bytes per second of the samples newer than `since`"""
+        rx = tx = 0
+        for i in range(min(self.next, len(self.ts))):
+            if self.ts[i] > since:
+                rx += self.rx[i]
+                tx += self.tx[i]
+        return rx / seconds, tx / seconds
+
+
+class TrafficRecorder:
+    """Turns status snapshots into traffic samples, rollups and rates"""
+
+    def __init__(
+        self,
+        db,
+        ring_size: int = 60,
+        flush_interval: float = 30.0,
+        rate_window: float = 60.0,
+        retention_days: int = 7,
+    ):
+        self.db = db
+        self.ring_size = ring_size
+        self.flush_interval = flush_interval
+        self.rate_window = rate_window
+        self.retention_days = retention_days
+        self._rings: Dict[str, PeerRing] = {}
+        self._samples: List[Tuple[float, str, int, int]] = []
+        self._rollups: Dict[str, Dict[Tuple[str, int], List[int]]] = {tier: {} for tier in TIERS}
+        self._task: Optional[asyncio.Task] = None
+
+    async def setup(self):
+        """Create the time-series collection and rollup indexes"""
+        try:
+            if "traffic_samples" not in await self.db.list_collection_names():
+                await self.db.create_collection(
+                    "traffic_samples",
+                    timeseries={"timeField": "ts", "metaField": "peer", "granularity": "seconds"},
+                    expireAfterSeconds=self.retention_days * 86400,
+                )
+        except Exception as e:
+            logger.error(f"Failed to create traffic_samples time-series collection: {e}")
+        try:
+            for tier in TIERS:
+                collection = self.db[f"traffic_{tier}"]
+                await collection.create_index([("peer", 1), ("bucket", 1)], unique=True)
+                if TIER_RETENTION[tier]:
+                    await collection.create_index("bucket", expireAfterSeconds=TIER_RETENTION[tier])
+        except Exception as e:
+            logger.error(f"Failed to create traffic rollup indexes: {e}")
+
+    def observe(self, snapshot: WGStatusSnapshot):
+        """Record the deltas since the previous snapshot"""
+        if not snapshot.running:
+            return
+        ts = snapshot.taken_at
+        rings = self._rings
+        for peer in snapshot.peers:
+            ring = rings.get(peer.public_key)
+            if ring is None:
+                # First sighting only establishes the baseline
+                rings[peer.public_key] = PeerRing(self.ring_size, peer.rx_bytes, peer.tx_bytes)
+                continue
+            rx = counter_delta(ring.last_rx, peer.rx_bytes)
+            tx = counter_delta(ring.last_tx, peer.tx_bytes)
+            ring.last_rx = peer.rx_bytes
+            ring.last_tx = peer.tx_bytes
+            ring.append(ts, rx, tx)
+            if rx or tx:
+                self._record(ts, peer.public_key, rx, tx)
+
+        # Forget peers that were removed from the interface
+        if len(rings) > len(snapshot.peers):
+            for public_key in set(rings) - snapshot.peers_by_key.keys():
+                del rings[public_key]
+
+    def _record(self, ts: float, public_key: str, rx: int, tx: int):
+        self._samples.append((ts, public_key, rx, tx))
+        for tier, seconds in TIERS.items():
+            key = (public_key, int(ts // seconds * seconds))
+            bucket = self._rollups[tier].get(key)
+            if bucket is None:
+                self._rollups[tier][key] = [rx, tx]
+            else:
+                bucket[0] += rx
+                bucket[1] += tx
+
+    async def flush(self):
+        """Write pending samples and rollups in batches"""
+        samples, self._samples = self._samples, []
+        rollups, self._rollups = self._rollups, {tier: {} for tier in TIERS}
+
+        if samples:
+            try:
+                await self.db.traffic_samples.insert_many(
+                    [
+                        {"ts": datetime.fromtimestamp(ts, timezone.utc), "peer": public_key, "rx": rx, "tx": tx}
+                        for ts, public_key, rx, tx in samples
+                    ],
+                    ordered=False,
+                )
+            except Exception as e:
+                logger.error(f"Failed to write traffic samples: {e}")
+                self._samples = (samples + self._samples)[-MAX_PENDING_SAMPLES:]
+
+        for tier, buckets in rollups.items():
+            if not buckets:
+                continue
+            operations = [
+                UpdateOne(
+                    {"peer": public_key, "bucket": datetime.fromtimestamp(bucket, timezone.utc)},
+                    {"$inc": {"rx": rx, "tx": tx}},
+                    upsert=True,
+                )
+                for (public_key, bucket), (rx, tx) in buckets.items()
+            ]
+            try:
+                await self.db[f"traffic_{tier}"].bulk_write(operations, ordered=False)
+            except Exception as e:
+                logger.error(f"Failed to write {tier} traffic rollups: {e}")
+                # Merge back so the next flush retries them
+                pending = self._rollups[tier]
+                for key, (rx, tx) in buckets.items():
+                    bucket = pending.setdefault(key, [0, 0])
+                    bucket[0] += rx
+                    bucket[1] += tx
+
+    def current_rates(self, limit: Optional[int] = None) -> List[dict]:
+        """Peers ordered by current total rate over the rate window"""
+        since = time.time() - self.rate_window
+        rates = []
+        for public_key, ring in self._rings.items():
+            rx_rate, tx_rate = ring.rate(since, self.rate_window)
+            if rx_rate or tx_rate:
+                rates.append({"public_key": public_key, "rx_rate": rx_rate, "tx_rate": tx_rate})
+        rates.sort(key=lambda r: r["rx_rate"] + r["tx_rate"], reverse=True)
+        return rates[:limit] if limit else rates
+
+    @staticmethod
+    def pick_tier(start: datetime, end: datetime) -> str:
+        """Finest tier that answers the range with a bounded number of points"""
+        span = (end - start).total_seconds()
+        for tier, max_range in TIER_MAX_RANGE.items():
+            if max_range is None or span <= max_range:
+                return tier
+        return "1d"
+
+    async def query(self, public_key: str, start: datetime, end: datetime, tier: Optional[str] = None) -> dict:
+        """Traffic rates of one peer between `start` and `end`"""
+        tier = tier or self.pick_tier(start, end)
+        seconds = TIERS[tier]
+        buckets: Dict[int, List[int]] = {}
+        cursor = self.db[f"traffic_{tier}"].find(
+            {"peer": public_key, "bucket": {"$gte": start, "$lt": end}},
+            {"_id": 0, "bucket": 1, "rx": 1, "tx": 1},
+        ).sort("bucket", 1)
+        async for doc in cursor:
+            bucket = doc["bucket"]
+            if bucket.tzinfo is None:
+                bucket = bucket.replace(tzinfo=timezone.utc)
+            buckets[int(bucket.timestamp())] = [doc["rx"], doc["tx"]]
+
+        # Include what has not been flushed yet
+        start_ts, end_ts = start.timestamp(), end.timestamp()
+        for (key, bucket), (rx, tx) in self._rollups[tier].items():
+            if key == public_key and start_ts <= bucket < end_ts:
+                totals = buckets.setdefault(bucket, [0, 0])
+                totals[0] += rx
+                totals[1] += tx
+
+        return {
+            "resolution": tier,
+            "points": [
+                {
+                    "ts": datetime.fromtimestamp(bucket, timezone.utc).isoformat(),
+                    "rx_bytes": rx,
+                    "tx_bytes": tx,
+                    "rx_rate": rx / seconds,
+                    "tx_rate": tx / seconds,
+                }
+                for bucket, (rx, tx) in sorted(buckets.items())
+            ],
+        }
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+def default_range(hours: int = 24) -> Tuple[datetime, datetime]:
+    end = datetime.now(timezone.utc)
+    return end - timedelta(hours=hours), end
@@ -0,0 +1,123 @@
+"""Versioned resources for conditional and delta responses
+
+A VersionedIndex records, per key, the version at which it last changed and
+keeps tombstones for removed keys. That is enough to answer "has anything
+changed since version N" (ETag / If-None-Match) and "what changed since
+version N" (`?since=`) without touching the database.
+"""
+import gzip
+import json
+import time
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+# Responses smaller than this are not worth compressing
+GZIP_MIN_SIZE = 1024
+
+
+class VersionedIndex:
+    """Per-key change versions with tombstones for removed keys"""
+
+    def __init__(self, max_tombstones: int = 10000):
+        # Versions start at the current time in milliseconds, so a `since`
+        # from before a restart is older than anything this process knows
+        # and gets a full response rather than a wrong delta
+        self.version = int(time.time() * 1000)
+        self.floor = self.version
+        self.max_tombstones = max_tombstones
+        self._entries: Dict[Hashable, Tuple[int, Any]] = {}
+        self._removed: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    @property
+    def etag(self) -> str:
+        return f'W/"{self.version}"'
+
+    def load(self, items: Iterable[Tuple[Hashable, Any]]):
+        """Set the initial entries without counting them as changes"""
+        for key, value in items:
+            self._entries[key] = (self.floor, value)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        return entry[1] if entry is not None else default
+
+    def values(self) -> List[Any]:
+        return [value for _, value in self._entries.values()]
+
+    def bump(self):
+        """Record a change that is not tied to a single key"""
+        self.version += 1
+
+    def touch(self, key: Hashable, value: Any = None):
+        """Record a change of `key`"""
+        self.version += 1
+        self._entries[key] = (self.version, value)
+        self._removed.pop(key, None)
+
+    def remove(self, key: Hashable) -> bool:
+        if self._entries.pop(key, None) is None:
+            return False
+        self.version += 1
+        self._removed[key] = self.version
+        if len(self._removed) > self.max_tombstones:
+            # Forget the oldest tombstone; older `since` values get a full response
+            oldest = next(iter(self._removed))
+            self.floor = self._removed.pop(oldest)
+        return True
+
+    def update(self, items: Dict[Hashable, Any]) -> bool:
+        """Replace all entries, bumping only those that differ; True if any did"""
+        version = self.version
+        for key, value in items.items():
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != value:
+                self.touch(key, value)
+        for key in [key for key in self._entries if key not in items]:
+            self.remove(key)
+        return self.version != version
+
+    def changes(self, since: int) -> Optional[Tuple[List[Hashable], List[Hashable]]]:
+        """(changed keys, removed keys) after `since`, or None if that is unknown"""
+        if since < self.floor or since > self.version:
+            return None
+        changed = [key for key, (version, _) in self._entries.items() if version > since]
+        removed = [key for key, version in self._removed.items() if version > since]
+        return changed, removed
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches `etag` (weak comparison)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+def encode_json(payload: Any, compress: bool) -> Tuple[bytes, bool]:
+    """Serialize `payload`; returns (body, gzipped)"""
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    if compress and len(body) >= GZIP_MIN_SIZE:
+        return gzip.compress(body, compresslevel=6), True
+    return body, False
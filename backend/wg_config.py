@@ -0,0 +1,202 @@
+"""WireGuard config file model and persistence
+
+WGConfig parses a wg-quick config file into its [Interface] section and a
+dict of peers keyed by public key, so single peers can be added, removed or
+updated in O(1) before the file is rendered and replaced atomically.
+
+Peer changes are applied to the live interface with `wg set` right away; the
+config file only has to catch up eventually. ConfigPersister collects those
+changes and writes them in the background, coalescing bursts into one write.
+"""
+import asyncio
+import logging
+import os
+import tempfile
+from typing import AsyncIterable, Awaitable, Callable, Dict, List, Optional, TextIO, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# public key -> (action, allowed_ips); action is "add" or "remove"
+PeerChanges = Dict[str, Tuple[str, Optional[str]]]
+
+
+def render_peer(public_key: str, fields: Dict[str, str]) -> str:
+    lines = ["[Peer]", f"PublicKey = {public_key}"]
+    lines.extend(f"{key} = {value}" for key, value in fields.items())
+    return "\n".join(lines) + "\n"
+
+
+class WGConfig:
+    """In-memory wg-quick config with peers indexed by public key"""
+
+    def __init__(self, interface: str = "", peers: Optional[Dict[str, Dict[str, str]]] = None):
+        # The [Interface] section is kept verbatim, comments included
+        self.interface = interface
+        self.peers: Dict[str, Dict[str, str]] = peers if peers is not None else {}
+
+    @classmethod
+    def parse(cls, text: str) -> "WGConfig":
+        interface_lines: List[str] = []
+        peers: Dict[str, Dict[str, str]] = {}
+        section = None
+        fields: Dict[str, str] = {}
+
+        def finish_peer():
+            public_key = fields.pop("PublicKey", None)
+            if public_key:
+                # A repeated key wins over an earlier block, like wg does
+                peers.pop(public_key, None)
+                peers[public_key] = dict(fields)
+
+        for raw in text.splitlines():
+            line = raw.strip()
+            if line.startswith("[") and line.endswith("]"):
+                if section == "peer":
+                    finish_peer()
+                section = line[1:-1].strip().lower()
+                fields = {}
+                if section == "interface":
+                    interface_lines.append(raw)
+                continue
+            if section == "peer":
+                key, sep, value = line.partition("=")
+                if sep and not line.startswith("#"):
+                    fields[key.strip()] = value.strip()
+            elif section == "interface" or section is None:
+                interface_lines.append(raw)
+        if section == "peer":
+            finish_peer()
+
+        interface = "\n".join(interface_lines).strip("\n")
+        return cls(interface + "\n" if interface else "", peers)
+
+    def __len__(self) -> int:
+        return len(self.peers)
+
+    def __contains__(self, public_key: str) -> bool:
+        return public_key in self.peers
+
+    def set_peer(self, public_key: str, allowed_ips: str, **fields: str):
+        """Add a peer, or replace an existing peer's settings"""
+        self.peers[public_key] = {"AllowedIPs": allowed_ips, **fields}
+
+    def update_peer(self, public_key: str, **fields: str) -> bool:
+        peer = self.peers.get(public_key)
+        if peer is None:
+            return False
+        peer.update(fields)
+        return True
+
+    def remove_peer(self, public_key: str) -> bool:
+        return self.peers.pop(public_key, None) is not None
+
+    def apply(self, changes: "PeerChanges"):
+        """Apply coalesced changes from a ConfigPersister"""
+        for public_key, (action, allowed_ips) in changes.items():
+            if action == "add":
+                self.set_peer(public_key, allowed_ips)
+            else:
+                self.remove_peer(public_key)
+
+    def write(self, out: TextIO):
+        out.write(self.interface)
+        for public_key, fields in self.peers.items():
+            out.write("\n")
+            out.write(render_peer(public_key, fields))
+
+    def render(self) -> str:
+        parts = [self.interface]
+        for public_key, fields in self.peers.items():
+            parts.append("\n" + render_peer(public_key, fields))
+        return "".join(parts)
+
+
+def temp_config_file() -> Tuple[str, TextIO]:
+    """A private (0600) temp file to render a config into"""
+    fd, path = tempfile.mkstemp(prefix="wg-", suffix=".conf")
+    return path, os.fdopen(fd, "w")
+
+
+async def stream_config(
+    interface: str,
+    peers: AsyncIterable[Tuple[str, str]],
+    out: TextIO,
+) -> WGConfig:
+    """Write a config from an async stream of (public_key, allowed_ips)
+
+    Each peer is written as soon as it arrives, so the whole file is produced
+    in one pass over e.g. a database cursor. Returns the matching WGConfig.
+    """
+    config = WGConfig(interface)
+    out.write(interface)
+    async for public_key, allowed_ips in peers:
+        config.set_peer(public_key, allowed_ips)
+        out.write("\n")
+        out.write(render_peer(public_key, config.peers[public_key]))
+    return config
+
+
+class ConfigPersister:
+    """Coalesces peer changes and flushes them to the config file in the background"""
+
+    def __init__(self, flush: Callable[[PeerChanges], Awaitable[None]], delay: float = 1.0):
+        self._flush = flush
+        self.delay = delay
+        self._pending: PeerChanges = {}
+        self._task: Optional[asyncio.Task] = None
+        # Held while the file is written, also by full rebuilds
+        self.lock = asyncio.Lock()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def peek(self) -> PeerChanges:
+        """Changes not written yet (a copy)"""
+        return dict(self._pending)
+
+    def add_peer(self, public_key: str, allowed_ips: str):
+        self._pending[public_key] = ("add", allowed_ips)
+        self._schedule()
+
+    def remove_peer(self, public_key: str):
+        self._pending[public_key] = ("remove", None)
+        self._schedule()
+
+    def _schedule(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        # Changes arriving while a flush runs are picked up by the next round
+        while True:
+            await asyncio.sleep(self.delay)
+            await self.flush()
+            if not self._pending:
+                return
+
+    async def flush(self):
+        """Write all pending changes now"""
+        async with self.lock:
+            if not self._pending:
+                return
+            changes, self._pending = self._pending, {}
+            try:
+                await self._flush(changes)
+            except Exception as e:
+                logger.error(f"Failed to persist WireGuard config: {e}")
+                # Keep the changes for the next attempt unless superseded
+                for public_key, change in changes.items():
+                    self._pending.setdefault(public_key, change)
+
+    async def stop(self):
+        """Flush whatever is left and stop"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        await self.flush()
@@ -0,0 +1,113 @@
+"""In-process WireGuard key generation
+
+Produces the same base64 Curve25519 keys as `wg genkey` / `wg pubkey` without
+forking (or, with SSH_ENABLED, without two remote round trips per keypair).
+"""
+import asyncio
+import base64
+import logging
+import os
+from collections import deque
+from typing import List, Optional
+
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+
+
+logger = logging.getLogger(__name__)
+
+
+def _clamp(key: bytearray) -> bytes:
+    """Clamp a scalar the same way `wg genkey` does"""
+    key[0] &= 248
+    key[31] = (key[31] & 127) | 64
+    return bytes(key)
+
+
+def generate_private_key() -> str:
+    """Equivalent of `wg genkey`"""
+    return base64.b64encode(_clamp(bytearray(os.urandom(32)))).decode()
+
+
+def public_key_from_private(private_key: str) -> str:
+    """Equivalent of `echo <private_key> | wg pubkey`"""
+    raw = base64.b64decode(private_key.strip(), validate=True)
+    if len(raw) != 32:
+        raise ValueError("WireGuard keys are 32 bytes")
+    public = X25519PrivateKey.from_private_bytes(raw).public_key().public_bytes_raw()
+    return base64.b64encode(public).decode()
+
+
+def generate_keypair() -> tuple[str, str]:
+    """Generate a (private_key, public_key) pair"""
+    private_key = generate_private_key()
+    return private_key, public_key_from_private(private_key)
+
+
+def generate_keypairs(count: int) -> List[tuple[str, str]]:
+    return [generate_keypair() for _ in range(count)]
+
+
+class KeyPool:
+    """Pre-generated keypairs, refilled in a worker thread
+
+    `get()` never waits on a refill: when the pool is empty it generates a
+    keypair inline, which is cheap, and wakes the refill task.
+    """
+
+    def __init__(self, size: int = 32, batch: int = 16):
+        self.size = size
+        self.batch = batch
+        self._keys: deque = deque()
+        self._low = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def get(self) -> tuple[str, str]:
+        """Take one keypair"""
+        return self.take(1)[0]
+
+    def take(self, count: int) -> List[tuple[str, str]]:
+        """Take `count` keypairs, generating whatever the pool cannot supply"""
+        keys: List[tuple[str, str]] = []
+        while self._keys and len(keys) < count:
+            keys.append(self._keys.popleft())
+        if len(keys) < count:
+            keys.extend(generate_keypairs(count - len(keys)))
+        if self._task is not None and len(self._keys) < self.size // 2:
+            self._low.set()
+        return keys
+
+    async def take_async(self, count: int) -> List[tuple[str, str]]:
+        """Like take(), but generates the shortfall in a worker thread"""
+        keys = self.take(min(count, len(self._keys)))
+        if len(keys) < count:
+            keys.extend(await asyncio.to_thread(generate_keypairs, count - len(keys)))
+        return keys
+
+    def start(self):
+        """Start the background refill task"""
+        if self.size > 0 and (self._task is None or self._task.done()):
+            self._low.set()
+            self._task = asyncio.create_task(self._refill())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refill(self):
+        while True:
+            await self._low.wait()
+            self._low.clear()
+            try:
+                while len(self._keys) < self.size:
+                    count = min(self.batch, self.size - len(self._keys))
+                    self._keys.extend(await asyncio.to_thread(generate_keypairs, count))
+            except Exception as e:
+                logger.error(f"Key pool refill failed: {e}")
@@ -0,0 +1,250 @@
+"""WireGuard interface status sampling
+
+A single background task snapshots the interface state on a fixed interval and
+publishes it as an immutable snapshot. Request handlers read the latest
+snapshot instead of forking `wg show` themselves. State is read from the
+machine-readable `wg show <iface> dump` format.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Awaitable, Callable, Dict, FrozenSet, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# A peer counts as active while its last handshake is younger than this
+# (WireGuard rekeys every two minutes while traffic flows)
+ACTIVE_HANDSHAKE_AGE = 180
+
+
+class WGPeer(NamedTuple):
+    """One peer row from `wg show <iface> dump`"""
+    public_key: str
+    endpoint: Optional[str]
+    allowed_ips: str
+    latest_handshake: int  # epoch seconds, 0 if never
+    rx_bytes: int
+    tx_bytes: int
+    persistent_keepalive: int  # seconds, 0 if off
+
+
+def parse_wg_dump(output: str) -> List[WGPeer]:
+    """Parse `wg show <iface> dump` output into peer records
+
+    The first line describes the interface itself and is skipped; every
+    following line is one tab-separated peer:
+    public-key, preshared-key, endpoint, allowed-ips, latest-handshake,
+    transfer-rx, transfer-tx, persistent-keepalive
+    """
+    peers = []
+    append = peers.append
+    lines = output.splitlines()
+    for line in lines[1:]:
+        fields = line.split("\t")
+        if len(fields) < 8:
+            continue
+        endpoint = fields[2]
+        keepalive = fields[7]
+        try:
+            append(WGPeer(
+                fields[0],
+                None if endpoint == "(none)" else endpoint,
+                "" if fields[3] == "(none)" else fields[3],
+                int(fields[4]),
+                int(fields[5]),
+                int(fields[6]),
+                0 if keepalive == "off" else int(keepalive),
+            ))
+        except ValueError:
+            logger.warning(f"Skipping malformed wg dump line: {line[:80]!r}")
+    return peers
+
+
+@dataclass(frozen=True)
+class WGStatusSnapshot:
+    """Point-in-time view of a WireGuard interface"""
+    running: bool
+    peers: Tuple[WGPeer, ...]
+    taken_at: float  # epoch seconds, 0 if never sampled
+
+    @property
+    def sampled(self) -> bool:
+        return self.taken_at > 0
+
+    @cached_property
+    def peers_by_key(self) -> Dict[str, WGPeer]:
+        """Peers indexed by public key, built once per snapshot"""
+        return {peer.public_key: peer for peer in self.peers}
+
+    @cached_property
+    def active_keys(self) -> FrozenSet[str]:
+        """Public keys of peers with a recent handshake, built once per snapshot"""
+        cutoff = self.taken_at - ACTIVE_HANDSHAKE_AGE
+        return frozenset(peer.public_key for peer in self.peers if peer.latest_handshake > cutoff)
+
+    @property
+    def age(self) -> float:
+        """Seconds since the snapshot was taken"""
+        return time.time() - self.taken_at
+
+    @classmethod
+    def from_status(cls, status: dict, taken_at: Optional[float] = None) -> "WGStatusSnapshot":
+        return cls(
+            running=bool(status.get("running")),
+            peers=tuple(status.get("peers", ())),
+            taken_at=time.time() if taken_at is None else taken_at,
+        )
+
+
+EMPTY_SNAPSHOT = WGStatusSnapshot(running=False, peers=(), taken_at=0.0)
+
+
+# Client fields needed to assemble stats; everything else stays in Mongo
+STATS_CLIENT_PROJECTION = {"_id": 0, "id": 1, "name": 1, "ip_address": 1, "os_info": 1, "public_key": 1}
+
+
+def client_stats(client: dict, peer: Optional[WGPeer], account=None, connected: bool = False) -> dict:
+    """Stats row for one client
+
+    `connected` means a recent handshake (the snapshot's `active_keys`), the
+    same as in the client list; a configured peer alone does not count.
+
+    With an accounting `account` the byte counts are cumulative totals,
+    which keep growing across interface restarts, instead of the counters
+    of the current peer entry.
+    """
+    if account is not None:
+        rx_bytes, tx_bytes = account.rx_total, account.tx_total
+    else:
+        rx_bytes = peer.rx_bytes if peer else 0
+        tx_bytes = peer.tx_bytes if peer else 0
+    return {
+        "id": client["id"],
+        "name": client["name"],
+        "ip_address": client["ip_address"],
+        "os_info": client.get("os_info"),
+        "connected": connected,
+        "latest_handshake": (peer.latest_handshake or None) if peer else None,
+        "endpoint": peer.endpoint if peer else None,
+        "rx_bytes": rx_bytes,
+        "tx_bytes": tx_bytes,
+        "total_bytes": rx_bytes + tx_bytes,
+        "month_bytes": account.month_bytes if account is not None else None,
+    }
+
+
+def join_client_stats(clients: Iterable[dict], snapshot: WGStatusSnapshot, accounts: Optional[Mapping] = None) -> List[dict]:
+    """Match clients with their peers (and accounts) via the snapshot's public key index"""
+    peers = snapshot.peers_by_key
+    active = snapshot.active_keys
+    accounts = accounts or {}
+    rows = []
+    for client in clients:
+        key = client["public_key"]
+        rows.append(client_stats(client, peers.get(key), accounts.get(key), key in active))
+    return rows
+
+
+class StatusSampler:
+    """Periodically samples interface state and publishes the latest snapshot
+
+    `fetch` is a coroutine function returning a status dict with `running`
+    and `peers` keys. Concurrent refreshes share one in-flight sample, so a
+    burst of callers still results in a single `wg show`. Subscribers are
+    called with every new snapshot. A fetch that raises (the node did not
+    answer) is kept as `last_error` until the next successful one.
+    """
+
+    def __init__(self, fetch: Callable[[], Awaitable[dict]], interval: float = 5.0):
+        self._fetch = fetch
+        self.interval = interval
+        self._snapshot = EMPTY_SNAPSHOT
+        self._inflight: Optional[asyncio.Future] = None
+        self._task: Optional[asyncio.Task] = None
+        self._subscribers: List[Callable[[WGStatusSnapshot], None]] = []
+        self.last_ok_at = 0.0
+        self.last_error: Optional[str] = None
+
+    def subscribe(self, callback: Callable[[WGStatusSnapshot], None]):
+        """Call `callback(snapshot)` after every sample"""
+        self._subscribers.append(callback)
+
+    @property
+    def snapshot(self) -> WGStatusSnapshot:
+        return self._snapshot
+
+    @property
+    def reachable(self) -> bool:
+        """Whether the latest sample got an answer"""
+        return self.last_ok_at > 0 and self.last_error is None
+
+    async def current(self) -> WGStatusSnapshot:
+        """Latest snapshot, sampling once if nothing has been published yet"""
+        if not self._snapshot.sampled:
+            return await self.refresh()
+        return self._snapshot
+
+    async def refresh(self) -> WGStatusSnapshot:
+        """Take a new snapshot now (joins a sample already in progress)"""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.ensure_future(self._sample())
+        return await asyncio.shield(self._inflight)
+
+    async def fresh(self) -> WGStatusSnapshot:
+        """Take a snapshot that started after this call (waits out one in progress)"""
+        if self._inflight is not None and not self._inflight.done():
+            await asyncio.shield(self._inflight)
+        return await self.refresh()
+
+    async def poll(self, timeout: float) -> Optional[WGStatusSnapshot]:
+        """refresh() bounded by `timeout`, None if it takes longer
+
+        The sample itself keeps running and replaces the error if it
+        succeeds after all.
+        """
+        try:
+            return await asyncio.wait_for(self.refresh(), timeout)
+        except asyncio.TimeoutError:
+            self.last_error = f"No answer within {timeout}s"
+            return None
+
+    async def _sample(self) -> WGStatusSnapshot:
+        try:
+            status = await self._fetch()
+        except Exception as e:
+            logger.error(f"WireGuard status sample failed: {e}")
+            self.last_error = str(e) or type(e).__name__
+            status = {"running": False, "peers": []}
+        else:
+            self.last_ok_at = time.time()
+            self.last_error = None
+        self._snapshot = WGStatusSnapshot.from_status(status)
+        for callback in self._subscribers:
+            try:
+                callback(self._snapshot)
+            except Exception as e:
+                logger.error(f"Status subscriber failed: {e}")
+        return self._snapshot
+
+    def start(self):
+        """Start the background sampling loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background sampling loop"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
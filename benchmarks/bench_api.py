@@ -0,0 +1,336 @@
+"""End-to-end API benchmark against a stand-in `wg` and a local Mongo
+
+For every peer count the backend is started fresh (benchmarks/serve.py) with
+benchmarks/fake_wg.py as its `wg`/`wg-quick`, the server is initialized and
+filled with that many clients, and each scenario is driven at a fixed
+concurrency. Throughput and p50/p99 latency are printed and written as JSON;
+with --compare the run is checked against an earlier results file.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/bench_api.py --memory                      # no mongod needed
+    python benchmarks/bench_api.py --mongo-url mongodb://localhost:27017
+    python benchmarks/bench_api.py --memory --output new.json --compare baseline.json
+
+The in-memory stand-in (mongomock) checks unique indexes and answers queries
+by scanning every document, on the event loop. Its numbers are fine for
+comparing runs at 100 and 1k peers; at 10k the stand-in itself dominates, so
+use a local mongod there.
+
+Scenarios: stats (GET /api/wg/stats), clients (GET /api/wg/clients),
+create (POST /api/wg/clients), config (GET /api/wg/clients/{id}/config),
+qrcode (GET /api/wg/clients/{id}/qrcode?format=png).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+
+SIZES = (100, 1000, 10000)
+SCENARIOS = ("stats", "clients", "create", "config", "qrcode")
+
+# Client creations per bulk request while seeding
+SEED_BATCH = 5000
+
+# Largest peer count the in-memory stand-in gives meaningful numbers for
+MEMORY_MAX_PEERS = 1000
+
+
+def percentile(ordered, q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+class Backend:
+    """A backend process with its own database, config dir and fake `wg` state"""
+
+    def __init__(self, peers: int, mongo_url: str, memory: bool, wg_delay: float):
+        self.peers = peers
+        self.port = free_port()
+        self.base = f"http://127.0.0.1:{self.port}/api"
+        self.workdir = tempfile.TemporaryDirectory(prefix="wg-bench-")
+        fake_wg = str(BENCH_DIR / "fake_wg.py")
+        self.env = {
+            **os.environ,
+            "MONGO_URL": mongo_url,
+            "DB_NAME": f"wg_bench_{peers}_{os.getpid()}",
+            "JWT_SECRET": "benchmark",
+            "BCRYPT_ROUNDS": "4",
+            "SERVER_NETWORK": "10.8.0.0/16",
+            "SSH_ENABLED": "false",
+            "WG_BIN": fake_wg,
+            "WG_QUICK_BIN": fake_wg,
+            "SUDO_BIN": "/usr/bin/env",
+            "WG_CONFIG_DIR": str(Path(self.workdir.name) / "etc"),
+            "WG_STATUS_INTERVAL": "1",
+            "FAKE_WG_STATE_DIR": str(Path(self.workdir.name) / "state"),
+            "FAKE_WG_DELAY": str(wg_delay),
+        }
+        self.command = [sys.executable, str(BENCH_DIR / "serve.py"), "--port", str(self.port)]
+        if memory:
+            self.command.append("--memory")
+        self.memory = memory
+        self.process = None
+
+    async def __aenter__(self):
+        self.log_path = Path(self.workdir.name) / "backend.log"
+        self.log = open(self.log_path, "w")
+        self.process = subprocess.Popen(self.command, env=self.env, stdout=self.log, stderr=subprocess.STDOUT)
+        async with httpx.AsyncClient() as client:
+            for _ in range(300):
+                try:
+                    await client.get(self.base)
+                    return self
+                except httpx.TransportError:
+                    if self.process.poll() is not None:
+                        break
+                    await asyncio.sleep(0.1)
+        self.process.kill()
+        raise RuntimeError(f"backend did not start:\n{self.log_path.read_text()[-2000:]}")
+
+    async def __aexit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+        if not self.memory:
+            await drop_database(self.env["MONGO_URL"], self.env["DB_NAME"])
+        self.workdir.cleanup()
+
+
+async def drop_database(mongo_url: str, name: str):
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=2000)
+        await client.drop_database(name)
+        client.close()
+    except Exception as e:
+        print(f"Could not drop benchmark database {name}: {e}", file=sys.stderr)
+
+
+async def seed(client: httpx.AsyncClient, peers: int) -> list:
+    """Register, initialize and start the server, then create `peers` clients"""
+    r = await client.post("/auth/register", json={"username": "bench", "password": "bench"})
+    r.raise_for_status()
+    client.headers["Authorization"] = f"Bearer {r.json()['access_token']}"
+    (await client.post("/wg/server/init")).raise_for_status()
+    (await client.post("/wg/server/start")).raise_for_status()
+
+    ids = []
+    for offset in range(0, peers, SEED_BATCH):
+        count = min(SEED_BATCH, peers - offset)
+        body = {"clients": [{"name": f"bench-{offset + i}"} for i in range(count)]}
+        async with client.stream("POST", "/wg/clients/bulk", json=body, timeout=600) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                result = json.loads(line)
+                if result["status"] == "created":
+                    ids.append(result["client"]["id"])
+    return ids
+
+
+def requests_for(scenario: str, ids: list):
+    """Endless (method, path) generator for a scenario"""
+    rng = random.Random(42)
+    counter = 0
+    while True:
+        counter += 1
+        if scenario == "stats":
+            yield "GET", "/wg/stats", None
+        elif scenario == "clients":
+            yield "GET", "/wg/clients", None
+        elif scenario == "create":
+            yield "POST", "/wg/clients", {"name": f"bench-new-{counter}"}
+        elif scenario == "config":
+            yield "GET", f"/wg/clients/{rng.choice(ids)}/config", None
+        elif scenario == "qrcode":
+            yield "GET", f"/wg/clients/{rng.choice(ids)}/qrcode?format=png", None
+
+
+async def drive(client: httpx.AsyncClient, scenario: str, ids: list, requests: int, concurrency: int) -> dict:
+    """Send `requests` requests with `concurrency` in flight; returns the summary"""
+    latencies = []
+    errors = 0
+    source = requests_for(scenario, ids)
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            method, path, body = next(source)
+            start = time.perf_counter()
+            try:
+                r = await client.request(method, path, json=body)
+                ok = r.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+async def run_size(args, peers: int) -> list:
+    results = []
+    async with Backend(peers, args.mongo_url or "memory://", args.memory, args.wg_delay) as backend:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=backend.base, timeout=120, limits=limits) as client:
+            seed_start = time.perf_counter()
+            ids = await seed(client, peers)
+            print(f"[{peers} peers] seeded {len(ids)} clients in {time.perf_counter() - seed_start:.1f}s", file=sys.stderr)
+            # Let the sampler pick up the peers pushed while seeding
+            await asyncio.sleep(1.5)
+
+            for scenario in args.scenarios:
+                await drive(client, scenario, ids, args.warmup, args.concurrency)
+                summary = await drive(client, scenario, ids, args.requests, args.concurrency)
+                results.append({"scenario": scenario, "peers": peers, **summary})
+                print(format_row(results[-1]), file=sys.stderr)
+    return results
+
+
+def format_row(result: dict) -> str:
+    return (
+        f"{result['scenario']:>8} {result['peers']:>7} {result['throughput_rps']:>10.1f} "
+        f"{result['p50_ms']:>10.2f} {result['p99_ms']:>10.2f} {result['errors']:>7}"
+    )
+
+
+HEADER = f"{'scenario':>8} {'peers':>7} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errors':>7}"
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """Regressions of more than `threshold` (fraction) in throughput or p99"""
+    previous = {(r["scenario"], r["peers"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get((result["scenario"], result["peers"]))
+        if old is None:
+            continue
+        name = f"{result['scenario']}@{result['peers']}"
+        if old["throughput_rps"] and result["throughput_rps"] < old["throughput_rps"] * (1 - threshold):
+            regressions.append(f"{name}: throughput {old['throughput_rps']} -> {result['throughput_rps']} req/s")
+        if old["p99_ms"] and result["p99_ms"] > old["p99_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p99 {old['p99_ms']} -> {result['p99_ms']} ms")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end API benchmark with a stand-in wg")
+    parser.add_argument("--peers", default=",".join(map(str, SIZES)), help="comma-separated peer counts")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated scenarios")
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--wg-delay", type=float, default=0.0, help="seconds every fake wg call takes")
+    mongo = parser.add_mutually_exclusive_group(required=True)
+    mongo.add_argument("--mongo-url", help="local mongod to run against (a throwaway database is used)")
+    mongo.add_argument("--memory", action="store_true", help="use an in-memory Mongo stand-in")
+    parser.add_argument("--output", help="write JSON results here")
+    parser.add_argument("--compare", help="earlier JSON results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression (fraction)")
+    args = parser.parse_args(argv)
+    args.peers = [int(p) for p in args.peers.split(",")]
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    # Unwind on SIGTERM as on Ctrl-C, so the backend process is stopped too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(143))
+    if args.memory and max(args.peers) > MEMORY_MAX_PEERS:
+        print(
+            f"Warning: above {MEMORY_MAX_PEERS} peers the in-memory Mongo stand-in dominates the timings "
+            "and seeding takes minutes; use --mongo-url for those sizes",
+            file=sys.stderr,
+        )
+    print(HEADER, file=sys.stderr)
+    results = []
+    for peers in args.peers:
+        results.extend(asyncio.run(run_size(args, peers)))
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "mongo": "memory" if args.memory else "mongod",
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "wg_delay": args.wg_delay,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        if baseline.get("meta", {}).get("mongo") != report["meta"]["mongo"]:
+            print("Warning: comparing runs against different Mongo backends", file=sys.stderr)
+        regressions = compare(baseline, report, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""Per-peer cost of assembling /api/wg/stats from a status snapshot
+
+Builds synthetic clients and a matching `wg show dump` snapshot, then times
+join_client_stats() including the per-snapshot public key index. The cost
+per peer should stay flat from 100 to 20,000 peers.
+
+    python benchmarks/bench_stats_join.py
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from wg_status import WGPeer, WGStatusSnapshot, join_client_stats  # noqa: E402
+
+
+SIZES = (100, 1000, 5000, 10000, 20000)
+
+
+def synthetic(count: int):
+    clients = [
+        {"id": f"id-{i}", "name": f"client-{i}", "ip_address": f"10.{i >> 16}.{(i >> 8) & 255}.{i & 255}",
+         "os_info": None, "public_key": f"key-{i}"}
+        for i in range(count)
+    ]
+    # Every other client has a live peer, in a different order than the clients
+    peers = [
+        WGPeer(f"key-{i}", f"198.51.100.1:{i % 65535}", "", 1700000000 + i, i * 1000, i * 10, 0)
+        for i in range(count - 1, -1, -2)
+    ]
+    return clients, peers
+
+
+def bench(count: int, rounds: int) -> float:
+    clients, peers = synthetic(count)
+    best = float("inf")
+    for _ in range(rounds):
+        # A fresh snapshot each round, so building the index is measured too
+        snapshot = WGStatusSnapshot(running=True, peers=tuple(peers), taken_at=time.time())
+        start = time.perf_counter()
+        join_client_stats(clients, snapshot)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'peers':>8} {'total ms':>10} {'ns/peer':>10}")
+    for count in SIZES:
+        seconds = bench(count, rounds=max(3, 200000 // count))
+        print(f"{count:>8} {seconds * 1000:>10.3f} {seconds / count * 1e9:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
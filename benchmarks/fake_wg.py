@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Scriptable stand-in for `wg` and `wg-quick`
+
+Keeps each interface's peers in a state directory instead of the kernel, so
+the backend can be driven end to end without root or a WireGuard module.
+Point the backend at it with WG_BIN / WG_QUICK_BIN (and SUDO_BIN=/usr/bin/env).
+
+    wg show <iface> dump          peers added by `wg set`, plus synthetic ones
+    wg set <iface> peer K ...     adds (allowed-ips) or drops (remove) peers
+    wg-quick up|down <iface>      toggles whether `show` finds the interface;
+                                  transfer counters start from zero on `up`
+
+Environment:
+    FAKE_WG_STATE_DIR   where the per-interface state lives (required)
+    FAKE_WG_PEERS       extra synthetic peers reported by `show` (default 0)
+    FAKE_WG_DELAY       seconds every invocation sleeps, to model a slow node
+"""
+import base64
+import fcntl
+import hashlib
+import os
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+STATE_DIR = Path(os.environ.get("FAKE_WG_STATE_DIR", "."))
+SYNTHETIC_PEERS = int(os.environ.get("FAKE_WG_PEERS", "0"))
+DELAY = float(os.environ.get("FAKE_WG_DELAY", "0"))
+
+
+def synthetic_key(i: int) -> str:
+    return base64.b64encode(hashlib.sha256(f"synthetic-{i}".encode()).digest()).decode()
+
+
+def peer_line(public_key: str, allowed_ips: str, now: int, up_at: int) -> str:
+    """Dump line with counters that grow while the interface is up and a mix of stale and fresh handshakes"""
+    seed = int.from_bytes(hashlib.blake2b(public_key.encode(), digest_size=4).digest(), "big")
+    if seed % 3 == 0:
+        return f"{public_key}\t(none)\t(none)\t{allowed_ips}\t0\t0\t0\toff"
+    handshake = now - seed % 600
+    elapsed = max(now - up_at, 0) + 1
+    rx = elapsed * (seed % 97 + 1) * 1000
+    tx = elapsed * (seed % 89 + 1) * 1000
+    endpoint = f"198.51.100.{seed % 254 + 1}:{seed % 50000 + 10000}"
+    return f"{public_key}\t(none)\t{endpoint}\t{allowed_ips}\t{handshake}\t{rx}\t{tx}\t25"
+
+
+@contextmanager
+def locked_state(iface: str):
+    """Peers of one interface as {public_key: allowed_ips}, written back on exit"""
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    path = STATE_DIR / f"{iface}.peers"
+    with open(path, "a+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        peers = dict(line.rstrip("\n").split("\t", 1) for line in f if "\t" in line)
+        yield peers
+        f.seek(0)
+        f.truncate()
+        f.writelines(f"{key}\t{ips}\n" for key, ips in peers.items())
+
+
+def read_peers(iface: str) -> dict:
+    path = STATE_DIR / f"{iface}.peers"
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        fcntl.flock(f, fcntl.LOCK_SH)
+        return dict(line.rstrip("\n").split("\t", 1) for line in f if "\t" in line)
+
+
+def is_up(iface: str) -> bool:
+    return (STATE_DIR / f"{iface}.up").exists()
+
+
+def show(args) -> int:
+    if len(args) < 2 or args[1] != "dump":
+        sys.stderr.write("fake wg only supports `show <iface> dump`\n")
+        return 1
+    iface = args[0]
+    if not is_up(iface):
+        sys.stderr.write("Unable to access interface: No such device\n")
+        return 1
+    now = int(time.time())
+    up_at = int((STATE_DIR / f"{iface}.up").stat().st_mtime)
+    lines = [f"{synthetic_key(-1)}\t{synthetic_key(-2)}\t51820\toff"]
+    lines.extend(peer_line(key, ips, now, up_at) for key, ips in read_peers(iface).items())
+    lines.extend(
+        peer_line(synthetic_key(i), f"10.255.{i >> 8 & 255}.{i & 255}/32", now, up_at) for i in range(SYNTHETIC_PEERS)
+    )
+    sys.stdout.write("\n".join(lines) + "\n")
+    return 0
+
+
+def set_peers(args) -> int:
+    iface, args = args[0], args[1:]
+    with locked_state(iface) as peers:
+        key = None
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == "peer":
+                key = args[i + 1]
+                peers.setdefault(key, "")
+                i += 2
+            elif arg == "remove" and key is not None:
+                peers.pop(key, None)
+                i += 1
+            elif arg == "allowed-ips" and key is not None:
+                peers[key] = args[i + 1]
+                i += 2
+            else:
+                # listen-port, private-key, endpoint, ...: accepted and ignored
+                i += 2
+    return 0
+
+
+def quick(action: str, iface: str) -> int:
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    marker = STATE_DIR / f"{iface}.up"
+    if action == "up":
+        if marker.exists():
+            sys.stderr.write(f"wg-quick: `{iface}' already exists\n")
+            return 1
+        marker.touch()
+    elif action == "down":
+        if not marker.exists():
+            sys.stderr.write(f"wg-quick: `{iface}' is not a WireGuard interface\n")
+            return 1
+        marker.unlink()
+    return 0
+
+
+def main(argv) -> int:
+    if DELAY:
+        time.sleep(DELAY)
+    if not argv:
+        return 1
+    command, args = argv[0], argv[1:]
+    if command == "show":
+        return show(args)
+    if command == "set":
+        return set_peers(args)
+    if command in ("up", "down") and args:
+        # Invoked as wg-quick
+        return quick(command, args[0])
+    sys.stderr.write(f"fake wg: unsupported command {command}\n")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,40 @@
+"""Run the backend for benchmarking
+
+Same app as `uvicorn server:app`, started from the backend directory. With
+`--memory` Mongo is replaced by mongomock-motor, so no mongod is needed
+(in-memory numbers are only comparable with other in-memory runs).
+
+    python benchmarks/serve.py --port 8100 [--memory]
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--memory", action="store_true", help="use an in-memory Mongo stand-in")
+    args = parser.parse_args()
+
+    if args.memory:
+        import motor.motor_asyncio
+        from mongomock_motor import AsyncMongoMockClient
+
+        motor.motor_asyncio.AsyncIOMotorClient = lambda *a, **kw: AsyncMongoMockClient()
+
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, str(BACKEND_DIR))
+    import uvicorn
+    import server
+
+    uvicorn.run(server.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -34,6 +34,15 @@ const formatBytes = (bytes) => {
   return Math.round((bytes / Math.pow(k, i)) * 100) / 100 + ' ' + sizes[i];
 };
 
+// latest_handshake is reported as epoch seconds
+const formatHandshake = (epoch) => {
+  const seconds = Math.max(0, Math.floor(Date.now() / 1000 - epoch));
+  if (seconds < 60) return `vor ${seconds} Sek.`;
+  if (seconds < 3600) return `vor ${Math.floor(seconds / 60)} Min.`;
+  if (seconds < 86400) return `vor ${Math.floor(seconds / 3600)} Std.`;
+  return new Date(epoch * 1000).toLocaleString('de-DE');
+};
+
 const Dashboard = ({ onLogout }) => {
   const [serverStatus, setServerStatus] = useState(null);
   const [stats, setStats] = useState(null);
@@ -65,8 +74,70 @@ const Dashboard = ({ onLogout }) => {
 
   useEffect(() => {
     fetchData();
-    const interval = setInterval(fetchData, 5000); // Refresh every 5 seconds
-    return () => clearInterval(interval);
+
+    // Live updates: the full state first, then only the clients that changed
+    let source = null;
+    let interval = null;
+    let closed = false;
+    let retries = 0;
+
+    const startPolling = () => {
+      if (!interval) interval = setInterval(fetchData, 5000);
+    };
+
+    const connect = async () => {
+      // EventSource cannot send headers; the stream takes a short-lived token in the URL
+      let token;
+      try {
+        const res = await axios.post(`${API}/wg/stream/token`);
+        token = res.data.token;
+      } catch (error) {
+        startPolling();
+        return;
+      }
+      if (closed) return;
+      source = new EventSource(`${API}/wg/stream?token=${encodeURIComponent(token)}`);
+
+      source.addEventListener('full', (event) => {
+        const data = JSON.parse(event.data);
+        retries = 0;
+        setServerStatus(data.server);
+        setStats(data.stats);
+        setLoading(false);
+      });
+
+      source.addEventListener('delta', (event) => {
+        const data = JSON.parse(event.data);
+        setServerStatus(data.server);
+        setStats((prev) => {
+          const clients = new Map((prev?.clients || []).map((c) => [c.id, c]));
+          data.removed.forEach((id) => clients.delete(id));
+          data.changed.forEach((c) => clients.set(c.id, c));
+          return { ...prev, ...data.summary, clients: Array.from(clients.values()) };
+        });
+      });
+
+      source.onerror = () => {
+        // The browser reconnects on its own, but with the old, by now expired
+        // token; open a new stream with a new one, fall back to polling if that fails too
+        if (source.readyState === EventSource.CLOSED && !closed) {
+          if (retries < 3) {
+            retries += 1;
+            connect();
+          } else {
+            startPolling();
+          }
+        }
+      };
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      if (source) source.close();
+      if (interval) clearInterval(interval);
+    };
   }, []);
 
   const handleInitServer = async () => {
@@ -393,7 +464,7 @@ const Dashboard = ({ onLogout }) => {
                               <span data-testid={`client-os-${client.id}`}>OS: {client.os_info}</span>
                             )}
                             {client.connected && client.latest_handshake && (
-                              <span data-testid={`client-handshake-${client.id}`}>Letzter Handshake: {client.latest_handshake}</span>
+                              <span data-testid={`client-handshake-${client.id}`}>Letzter Handshake: {formatHandshake(client.latest_handshake)}</span>
                             )}
                           </div>
                           {client.connected && (
@@ -12,10 +12,17 @@ const QRCodeModal = ({ client, onClose }) => {
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
+    let objectUrl = null;
+
     const fetchQRCode = async () => {
       try {
-        const response = await axios.get(`${API}/wg/clients/${client.id}/qrcode`);
-        setQrCode(response.data.qrcode);
+        // Raw PNG instead of a base64 data URL wrapped in JSON
+        const response = await axios.get(`${API}/wg/clients/${client.id}/qrcode`, {
+          params: { format: 'png' },
+          responseType: 'blob',
+        });
+        objectUrl = URL.createObjectURL(response.data);
+        setQrCode(objectUrl);
       } catch (error) {
         toast.error('Fehler beim Laden des QR-Codes');
       } finally {
@@ -24,6 +31,9 @@ const QRCodeModal = ({ client, onClose }) => {
     };
 
     fetchQRCode();
+    return () => {
+      if (objectUrl) URL.revokeObjectURL(objectUrl);
+    };
   }, [client.id]);
 
   return (
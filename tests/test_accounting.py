@@ -0,0 +1,112 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from accounting import Account, TrafficAccounting, month_of, quota_changes
+from versioning import VersionedIndex
+from wg_status import WGPeer, WGStatusSnapshot
+
+
+OCT = datetime(2026, 10, 15, tzinfo=timezone.utc).timestamp()
+NOV = datetime(2026, 11, 1, 0, 0, 1, tzinfo=timezone.utc).timestamp()
+
+
+class RecordingCollection:
+    def __init__(self):
+        self.batches = []
+
+    async def bulk_write(self, operations, ordered=True):
+        self.batches.append(operations)
+
+
+def snapshot(peers, taken_at=OCT):
+    return WGStatusSnapshot(True, tuple(WGPeer(key, None, "", 0, rx, tx, 0) for key, rx, tx in peers), taken_at)
+
+
+def accounting():
+    db = SimpleNamespace(traffic_accounting=RecordingCollection())
+    iface = SimpleNamespace(name="wg0", db=db, client_index=VersionedIndex())
+    engine = TrafficAccounting(iface)
+    # The tests drive flush() themselves
+    engine._schedule = lambda: None
+    return engine
+
+
+def totals(engine, key):
+    account = engine.accounts[key]
+    return account.rx_total, account.tx_total
+
+
+def test_totals_survive_counter_resets():
+    engine = accounting()
+    engine.observe(snapshot([("a", 100, 10), ("b", 50, 5)]))
+    assert totals(engine, "a") == (100, 10)
+
+    engine.observe(snapshot([("a", 150, 20), ("b", 60, 5)]))
+    assert totals(engine, "a") == (150, 20)
+
+    # Lower than before: the counter was reset and counts in full
+    engine.observe(snapshot([("a", 30, 3), ("b", 70, 5)]))
+    assert totals(engine, "a") == (180, 23)
+
+    # Peer missing for a sample, then re-added with fresh counters above the old ones
+    engine.observe(snapshot([("b", 80, 5)]))
+    engine.observe(snapshot([("a", 400, 40), ("b", 90, 5)]))
+    assert totals(engine, "a") == (580, 63)
+
+    # wg-quick down: counters that passed the old values still count in full
+    engine.counters_reset()
+    engine.observe(snapshot([("a", 1000, 100), ("b", 95, 5)]))
+    assert totals(engine, "a") == (1580, 163)
+    assert totals(engine, "b") == (185, 10)
+
+
+def test_failed_samples_change_nothing():
+    engine = accounting()
+    engine.observe(snapshot([("a", 100, 10)]))
+    engine.observe(WGStatusSnapshot(False, (), OCT))
+    engine.observe(snapshot([("a", 120, 10)]))
+    assert totals(engine, "a") == (120, 10)
+
+
+def test_month_rollover_restarts_month_usage():
+    engine = accounting()
+    engine.observe(snapshot([("a", 100, 10)]))
+    engine.observe(snapshot([("a", 150, 10)], taken_at=NOV))
+    account = engine.accounts["a"]
+    assert (account.month, account.month_bytes, account.rx_total) == ("2026-11", 50, 150)
+    assert month_of(NOV) == "2026-11"
+
+
+def test_changed_accounts_are_written_in_one_batch():
+    engine = accounting()
+    engine.observe(snapshot([(f"peer{i}", i + 1, 0) for i in range(5000)]))
+    engine.observe(snapshot([(f"peer{i}", i + 1 + (i % 2), 0) for i in range(5000)]))
+    asyncio.run(engine.flush())
+    batches = engine.db.traffic_accounting.batches
+    assert len(batches) == 1 and len(batches[0]) == 5000
+
+    # Only accounts that changed since are written next time
+    engine.observe(snapshot([(f"peer{i}", i + 2 + (i % 2), 0) for i in range(5000)]))
+    engine.observe(snapshot([(f"peer{i}", i + 3 + (i % 2) if i < 10 else i + 2 + (i % 2), 0) for i in range(5000)]))
+    asyncio.run(engine.flush())
+    assert len(batches) == 2
+    asyncio.run(engine.flush())
+    assert len(batches) == 2
+
+
+def test_quota_changes():
+    accounts = {"a": Account("2026-10", month_rx=900, month_tx=200), "b": Account("2026-09", month_rx=5000)}
+    clients = [
+        {"id": "over", "public_key": "a", "enabled": True},
+        {"id": "own-quota", "public_key": "a", "enabled": True, "quota_bytes": 2000},
+        {"id": "unlimited", "public_key": "a", "enabled": True, "quota_bytes": 0},
+        {"id": "exempt", "public_key": "a", "enabled": True, "quota_exceeded": "2026-10"},
+        {"id": "last-month", "public_key": "b", "enabled": False, "quota_exceeded": "2026-09"},
+        {"id": "still-over", "public_key": "a", "enabled": False, "quota_exceeded": "2026-10"},
+        {"id": "raised", "public_key": "a", "enabled": False, "quota_exceeded": "2026-10", "quota_bytes": 5000},
+        {"id": "manual", "public_key": "a", "enabled": False},
+    ]
+    disable, enable = quota_changes(clients, accounts, "2026-10", default_quota=1000)
+    assert [c["id"] for c in disable] == ["over"]
+    assert [c["id"] for c in enable] == ["last-month", "raised"]
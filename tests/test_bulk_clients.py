@@ -0,0 +1,113 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from pymongo.errors import BulkWriteError
+
+from bulk_clients import BulkCreate
+
+
+class FakeCollection:
+    """insert_many that rejects documents whose IP is already taken"""
+
+    def __init__(self, taken=(), broken=()):
+        self.taken = set(taken)
+        self.broken = set(broken)
+        self.chunks = []
+
+    async def insert_many(self, docs, ordered=True):
+        await asyncio.sleep(0.01)
+        self.chunks.append([doc["name"] for doc in docs])
+        errors = []
+        for index, doc in enumerate(docs):
+            if doc["ip_address"] in self.taken:
+                errors.append({"index": index, "code": 11000, "errmsg": "E11000 duplicate key error"})
+            elif doc["name"] in self.broken:
+                errors.append({"index": index, "code": 121, "errmsg": "Document failed validation"})
+            else:
+                doc["_id"] = object()
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+class FakeInterface:
+    name = "wg0"
+
+    def __init__(self):
+        self.released = []
+        self.touched = []
+        self.peers = []
+        self.ip_pool = SimpleNamespace(release=self.released.append)
+        self.client_index = SimpleNamespace(touch=self.touched.append)
+
+    async def add_peers(self, peers):
+        await asyncio.sleep(0.01)
+        self.peers.extend(peers)
+        return True
+
+
+def client_docs(count):
+    return [
+        {"id": f"id-{i}", "name": f"c{i}", "public_key": f"pk{i}", "ip_address": f"10.8.0.{i + 2}"}
+        for i in range(count)
+    ]
+
+
+def test_failed_inserts_are_reported_and_the_rest_applied():
+    iface = FakeInterface()
+    collection = FakeCollection(taken={"10.8.0.3"}, broken={"c4"})
+
+    async def run():
+        bulk = BulkCreate(iface, collection, client_docs(5), chunk_size=2).start()
+        return [json.loads(line) async for line in bulk.lines()]
+
+    lines = asyncio.run(run())
+    assert collection.chunks == [["c0", "c1"], ["c2", "c3"], ["c4"]]
+    assert [line["status"] for line in lines] == ["created", "failed", "created", "created", "failed", "done"]
+    assert lines[1] == {"status": "failed", "name": "c1", "error": "E11000 duplicate key error"}
+    assert "_id" not in lines[0]["client"]
+    assert lines[-1] == {"status": "done", "created": 3, "failed": 2, "config_applied": True}
+
+    assert iface.peers == [("pk0", "10.8.0.2"), ("pk2", "10.8.0.4"), ("pk3", "10.8.0.5")]
+    assert iface.touched == ["id-0", "id-2", "id-3"]
+    # A duplicate IP belongs to whoever inserted it; other failures free theirs
+    assert iface.released == ["10.8.0.6"]
+
+
+def test_peers_are_applied_when_the_caller_disconnects():
+    iface = FakeInterface()
+
+    async def run():
+        bulk = BulkCreate(iface, FakeCollection(), client_docs(6), chunk_size=2).start()
+        lines = bulk.lines()
+        first = json.loads(await lines.__anext__())
+        # The streaming response is closed after the first line
+        await lines.aclose()
+        assert iface.peers == []
+        await bulk.task
+        return first
+
+    first = asyncio.run(run())
+    assert first["status"] == "created"
+    assert len(iface.peers) == 6
+
+
+def test_unexpected_insert_error_fails_the_remaining_clients():
+    iface = FakeInterface()
+
+    class Unavailable(FakeCollection):
+        async def insert_many(self, docs, ordered=True):
+            if self.chunks:
+                raise ConnectionError("connection refused")
+            await super().insert_many(docs, ordered)
+
+    async def run():
+        bulk = BulkCreate(iface, Unavailable(), client_docs(5), chunk_size=2).start()
+        return [json.loads(line) async for line in bulk.lines()]
+
+    lines = asyncio.run(run())
+    assert [line["status"] for line in lines] == ["created", "created", "failed", "failed", "failed", "done"]
+    assert lines[-1] == {"status": "done", "created": 2, "failed": 3, "config_applied": True, "error": "connection refused"}
+    assert len(iface.peers) == 2
+    # The chunk that failed may have been written; only the unsent one is freed
+    assert iface.released == ["10.8.0.6"]
@@ -0,0 +1,74 @@
+import pytest
+from pymongo import ASCENDING, DESCENDING
+
+from client_pages import client_filter, decode_cursor, encode_cursor, next_cursor, page_query
+from wg_status import ACTIVE_HANDSHAKE_AGE, WGPeer, WGStatusSnapshot, join_client_stats
+
+
+def test_cursor_round_trip_and_sort_check():
+    cursor = encode_cursor("name", "web-01", "id-1")
+    assert decode_cursor(cursor, "name") == ("web-01", "id-1")
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, "created_at")
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor", "name")
+
+
+def test_first_page_has_no_keyset_condition():
+    query, sort = page_query({"interface": "wg0"}, "created_at", False, None)
+    assert query == {"interface": "wg0"}
+    assert sort == [("created_at", ASCENDING), ("id", ASCENDING)]
+
+
+def test_next_page_starts_after_the_cursor():
+    cursor = encode_cursor("name", "m", "id-5")
+    query, sort = page_query({"interface": "wg0"}, "name", True, cursor)
+    assert sort == [("name", DESCENDING), ("id", DESCENDING)]
+    assert query == {"$and": [
+        {"interface": "wg0"},
+        {"$or": [{"name": {"$lt": "m"}}, {"name": "m", "id": {"$lt": "id-5"}}]},
+    ]}
+    with pytest.raises(ValueError):
+        page_query({}, "ip_address", False, None)
+
+
+def test_next_cursor_drops_the_lookahead_item():
+    items = [{"id": f"id-{i}", "name": f"n{i}"} for i in range(4)]
+    cursor = next_cursor(items, "name", 3)
+    assert [i["id"] for i in items] == ["id-0", "id-1", "id-2"]
+    assert decode_cursor(cursor, "name") == ("n2", "id-2")
+    assert next_cursor(items, "name", 3) is None
+
+
+def test_filters():
+    query = client_filter({"interface": "wg0"}, name_prefix="a.b", enabled=True, os_info="ios",
+                          public_keys={"k1"}, exclude_public_keys=True)
+    assert query == {
+        "interface": "wg0",
+        "name": {"$regex": "^a\\.b"},
+        "enabled": {"$ne": False},
+        "os_info": "ios",
+        "public_key": {"$nin": ["k1"]},
+    }
+    assert client_filter({}, enabled=False) == {"enabled": False}
+
+
+def test_connected_means_recent_handshake_in_list_and_stats():
+    now = 1_700_000_000.0
+    snapshot = WGStatusSnapshot(running=True, taken_at=now, peers=(
+        WGPeer("fresh", "1.2.3.4:51820", "10.8.0.2/32", int(now) - 10, 1, 2, 0),
+        WGPeer("stale", "1.2.3.5:51820", "10.8.0.3/32", int(now) - ACTIVE_HANDSHAKE_AGE - 60, 3, 4, 0),
+        WGPeer("never", None, "10.8.0.4/32", 0, 0, 0, 0),
+    ))
+    clients = [
+        {"id": key, "name": key, "ip_address": "", "public_key": key}
+        for key in ("fresh", "stale", "never", "missing")
+    ]
+    rows = {row["id"]: row for row in join_client_stats(clients, snapshot)}
+    assert {key for key, row in rows.items() if row["connected"]} == {"fresh"}
+    # A configured peer without a recent handshake still reports its counters
+    assert rows["stale"]["rx_bytes"] == 3 and rows["stale"]["endpoint"] == "1.2.3.5:51820"
+
+    # The client list's connected filter selects the same clients
+    query = client_filter({}, public_keys=snapshot.active_keys)
+    assert query == {"public_key": {"$in": ["fresh"]}}
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from command_runner import CommandRunner
+
+
+def test_output_and_exit_code():
+    async def run():
+        runner = CommandRunner()
+        assert await runner.run(["sh", "-c", "echo out; echo err >&2; exit 3"]) == ("out\n", "err\n", 3)
+        assert await runner.run(["cat"], input=b"piped") == ("piped", "", 0)
+        stdout, stderr, code = await runner.run(["/nonexistent/binary"])
+        assert (stdout, code) == ("", 1) and stderr
+        assert runner.latency["sh"].count == 1
+
+    asyncio.run(run())
+
+
+def test_timeout_kills_the_child(tmp_path):
+    pidfile = tmp_path / "pid"
+
+    async def run():
+        runner = CommandRunner(timeout=0.2)
+        started = time.perf_counter()
+        result = await runner.run(["sh", "-c", f"echo $$ > {pidfile}; exec sleep 10"])
+        assert result == ("", "Command timed out", 1)
+        assert time.perf_counter() - started < 2
+
+    asyncio.run(run())
+    # Killed and reaped, not left running or as a zombie
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pidfile.read_text()), 0)
+
+
+def test_cancellation_kills_the_child(tmp_path):
+    pidfile = tmp_path / "pid"
+
+    async def run():
+        runner = CommandRunner()
+        task = asyncio.ensure_future(runner.run(["sh", "-c", f"echo $$ > {pidfile}; exec sleep 10"]))
+        while not pidfile.exists() or not pidfile.read_text():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pidfile.read_text()), 0)
+
+
+def test_concurrency_is_bounded():
+    async def run():
+        runner = CommandRunner(max_concurrency=2)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(runner.run(["sleep", "0.2"]) for _ in range(4)))
+        assert all(code == 0 for _, _, code in results)
+        # Two slots: the last two wait for the first two
+        return time.perf_counter() - started
+
+    assert asyncio.run(run()) >= 0.4
+
+
+def test_program_names():
+    assert CommandRunner.program(["/usr/bin/sudo", "/usr/bin/wg", "show"]) == "wg"
+    assert CommandRunner.program(["ssh", "-p", "22"]) == "ssh"
+    assert CommandRunner.program([]) == ""
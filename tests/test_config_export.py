@@ -0,0 +1,39 @@
+import io
+import zipfile
+
+from config_export import CHUNK_SIZE, ZipExport, entry_basename
+
+
+def test_streamed_archive_is_valid_and_buffer_stays_bounded():
+    export = ZipExport()
+    out = io.BytesIO()
+    largest = 0
+    for i in range(2000):
+        chunk = export.add(f"client-{i}.conf", f"[Interface]\nPrivateKey = {i:044d}\n".encode())
+        largest = max(largest, len(chunk))
+        out.write(chunk)
+    out.write(export.close())
+
+    # Chunks are flushed once they pass CHUNK_SIZE, never accumulated
+    assert largest < 2 * CHUNK_SIZE
+    archive = zipfile.ZipFile(out)
+    assert archive.testzip() is None
+    assert len(archive.namelist()) == 2000
+    assert archive.read("client-7.conf").endswith(b"0007\n")
+    assert archive.getinfo("client-7.conf").external_attr >> 16 == 0o100600
+
+
+def test_stored_entries():
+    export = ZipExport()
+    data = export.add("a.png", b"\x89PNG" + bytes(100), compress=False) + export.close()
+    info = zipfile.ZipFile(io.BytesIO(data)).getinfo("a.png")
+    assert info.compress_type == zipfile.ZIP_STORED
+
+
+def test_entry_names_are_safe_and_unique():
+    used = set()
+    assert entry_basename("phone", "0123456789abcdef", used) == "phone"
+    assert entry_basename("phone", "fedcba9876543210", used) == "phone-fedcba98"
+    assert entry_basename("../etc/passwd", "1111111111", used) == "etc_passwd"
+    assert entry_basename("..", "2222222222", used) == "client"
+    assert entry_basename("..", "3333333333", used) == "client-33333333"
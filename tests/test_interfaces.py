@@ -0,0 +1,117 @@
+import asyncio
+import ipaddress
+import time
+
+import pytest
+from pydantic import ValidationError
+
+from interfaces import InterfaceRegistry, InterfaceSpec, NodeSpec
+from wg_status import StatusSampler
+
+
+def test_spec_normalizes_network_and_checks_name():
+    spec = InterfaceSpec(name="wg1", network="10.9.0.7/24", endpoint_host="gw.example")
+    assert spec.network == "10.9.0.0/24"
+    assert spec.node_key is None
+    with pytest.raises(ValidationError):
+        InterfaceSpec(name="not a name", network="10.9.0.0/24", endpoint_host="gw.example")
+    with pytest.raises(ValidationError):
+        InterfaceSpec(name="wg1", network="nonsense", endpoint_host="gw.example")
+
+
+class FakeInterface:
+    def __init__(self, name, fetch):
+        self.name = name
+        self.status_sampler = StatusSampler(fetch)
+
+
+def fetch_after(delay):
+    async def fetch():
+        await asyncio.sleep(delay)
+        return {"running": True, "peers": []}
+    return fetch
+
+
+async def unreachable():
+    raise RuntimeError("gw2.example unreachable: Connection refused")
+
+
+def test_poll_samples_every_node_concurrently_and_records_errors():
+    default = InterfaceSpec(name="wg0", network="10.8.0.0/24", endpoint_host="gw.example")
+    registry = InterfaceRegistry(None, None, default)
+    fetches = {
+        "a": fetch_after(0.1), "b": fetch_after(0.1), "c": fetch_after(0.1),
+        "hanging": fetch_after(5), "failing": unreachable,
+    }
+    for name, fetch in fetches.items():
+        registry._interfaces[name] = FakeInterface(name, fetch)
+
+    async def run():
+        # A cached snapshot does not count, poll() samples again
+        ok = registry._interfaces["a"].status_sampler
+        await ok.refresh()
+        first = ok.last_ok_at
+
+        started = time.perf_counter()
+        results = await registry.poll(timeout=0.3)
+        assert time.perf_counter() - started < 1
+        assert ok.last_ok_at > first
+        return results
+
+    results = asyncio.run(run())
+    samplers = {name: iface.status_sampler for name, iface in registry._interfaces.items()}
+    assert all(results[name].running for name in "abc")
+    assert all(samplers[name].reachable and samplers[name].last_error is None for name in "abc")
+    assert results["hanging"] is None
+    assert not samplers["hanging"].reachable and samplers["hanging"].last_error == "No answer within 0.3s"
+    # The failing node answered quickly but with an error
+    assert not results["failing"].running
+    assert not samplers["failing"].reachable and "unreachable" in samplers["failing"].last_error
+    assert samplers["failing"].last_ok_at == 0
+
+
+def test_node_user_and_host_cannot_become_ssh_options():
+    for node in (
+        {"host": "gw", "user": "-oProxyCommand=touch /tmp/pwned"},
+        {"host": "-oProxyCommand=touch /tmp/pwned"},
+        {"host": "gw example"},
+        {"host": "gw", "user": "a@b"},
+    ):
+        with pytest.raises(ValidationError):
+            NodeSpec(**node)
+    assert NodeSpec(host="fd00::1").host == "fd00::1"
+    assert NodeSpec(host="gw2.example.org", user="wg-admin").user == "wg-admin"
+
+
+def test_registered_nodes_only_use_keys_from_the_key_dir(tmp_path):
+    default = InterfaceSpec(name="wg0", network="10.8.0.0/24", endpoint_host="gw.example")
+
+    def spec(key_path):
+        return InterfaceSpec(name="wg1", network="10.9.0.0/24", endpoint_host="x",
+                             node=NodeSpec(host="gw2.example", key_path=key_path))
+
+    registry = InterfaceRegistry(None, None, default, key_dir=tmp_path)
+    registry._check_key_path(spec(str(tmp_path / "gw2")))
+    registry._check_key_path(spec(""))
+    for key_path in ("/etc/shadow", str(tmp_path / ".." / "other")):
+        with pytest.raises(ValueError):
+            registry._check_key_path(spec(key_path))
+    with pytest.raises(ValueError):
+        InterfaceRegistry(None, None, default)._check_key_path(spec(str(tmp_path / "gw2")))
+
+
+def test_networks_may_only_overlap_across_nodes():
+    default = InterfaceSpec(name="wg0", network="10.8.0.0/24", endpoint_host="gw.example")
+    registry = InterfaceRegistry(None, None, default)
+
+    class Existing:
+        name = "wg0"
+        spec = default
+        network = ipaddress.ip_network(default.network)
+
+    registry._interfaces["wg0"] = Existing()
+    with pytest.raises(ValueError):
+        registry._check_overlap(InterfaceSpec(name="wg1", network="10.8.0.0/16", endpoint_host="x"))
+    registry._check_overlap(InterfaceSpec(
+        name="wg1", network="10.8.0.0/24", endpoint_host="x", node=NodeSpec(host="gw2.example")
+    ))
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from ip_pool import IPPool, IPPoolExhausted
+
+
+def test_allocates_lowest_free_address_and_reuses_released():
+    pool = IPPool("10.8.0.0/24", reserved=["10.8.0.1"])
+    assert [pool.allocate() for _ in range(3)] == ["10.8.0.2", "10.8.0.3", "10.8.0.4"]
+    pool.release("10.8.0.3")
+    assert pool.allocate() == "10.8.0.3"
+    assert pool.allocate() == "10.8.0.5"
+
+
+def test_existing_addresses_leave_gaps_free():
+    pool = IPPool("10.8.0.0/24", reserved=["10.8.0.1"])
+    pool.mark_used("10.8.0.5")
+    pool.mark_used("10.8.0.3")
+    assert [pool.allocate() for _ in range(3)] == ["10.8.0.2", "10.8.0.4", "10.8.0.6"]
+
+
+def test_exhaustion_skips_broadcast():
+    pool = IPPool("10.8.0.0/30", reserved=["10.8.0.1"])
+    assert pool.allocate() == "10.8.0.2"
+    with pytest.raises(IPPoolExhausted):
+        pool.allocate()
+
+
+def test_allocate_many_is_all_or_nothing():
+    pool = IPPool("10.8.0.0/29", reserved=["10.8.0.1"])
+    with pytest.raises(IPPoolExhausted):
+        pool.allocate_many(10)
+    assert pool.used == 1
+    assert pool.allocate_many(5) == ["10.8.0.2", "10.8.0.3", "10.8.0.4", "10.8.0.5", "10.8.0.6"]
+
+
+def test_large_ipv4_and_ipv6_networks():
+    pool = IPPool("10.8.0.0/16", reserved=["10.8.0.1"])
+    addresses = pool.allocate_many(60000)
+    assert addresses[-1] == "10.8.234.97"
+    assert len(set(addresses)) == 60000
+
+    pool6 = IPPool("fd00:8::/64", reserved=["fd00:8::1"])
+    assert pool6.allocate() == "fd00:8::2"
+    assert pool6.host_prefix == 128
+
+
+def test_ignores_addresses_outside_network():
+    pool = IPPool("10.8.0.0/24")
+    pool.mark_used("192.168.1.10")
+    pool.mark_used("not-an-ip")
+    assert pool.used == 0
+
+
+def test_far_gap_is_one_range():
+    pool = IPPool("fd00:8::/64", reserved=["fd00:8::1"])
+    started = time.perf_counter()
+    pool.mark_used("fd00:8::100:0:0")  # base + 2**40
+    assert time.perf_counter() - started < 0.1
+    pool.mark_used("fd00:8::3")
+    assert pool.allocate_many(3) == ["fd00:8::2", "fd00:8::4", "fd00:8::5"]
+    pool.release("fd00:8::4")
+    assert pool.allocate() == "fd00:8::4"
+    assert pool.used == 6
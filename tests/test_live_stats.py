@@ -0,0 +1,127 @@
+import asyncio
+import json
+
+from live_stats import RESYNC, StatsBroadcaster
+from wg_status import EMPTY_SNAPSHOT
+
+
+def parse_frame(frame: bytes):
+    event, data = frame.decode().rstrip("\n").split("\n")
+    return event[len("event: "):], json.loads(data[len("data: "):])
+
+
+class FakeBuilder:
+    """Returns the queued (server, rows) states in turn"""
+
+    def __init__(self, *states):
+        self.states = list(states)
+        self.calls = 0
+
+    async def __call__(self, snapshot):
+        self.calls += 1
+        return self.states.pop(0)
+
+
+def row(client_id, connected=False, rx=0):
+    return {"id": client_id, "connected": connected, "rx_bytes": rx}
+
+
+def test_full_frame_is_built_once_per_snapshot():
+    async def run():
+        build = FakeBuilder(({"running": True, "sampled_at": "t1"}, [row("a", True), row("b")]))
+        broadcaster = StatsBroadcaster(build)
+        broadcaster.subscribe()
+        first = await broadcaster.full_frame(EMPTY_SNAPSHOT)
+        assert await broadcaster.full_frame(EMPTY_SNAPSHOT) is first
+        assert build.calls == 1
+
+        event, data = parse_frame(first)
+        assert event == "full"
+        assert data["server"] == {"running": True, "sampled_at": "t1"}
+        assert data["stats"]["active_clients"] == 1 and data["stats"]["total_clients"] == 2
+        assert [c["id"] for c in data["stats"]["clients"]] == ["a", "b"]
+
+    asyncio.run(run())
+
+
+def test_delta_carries_only_changed_and_removed_clients():
+    async def run():
+        build = FakeBuilder(
+            ({"running": True}, [row("a"), row("b"), row("c")]),
+            ({"running": True}, [row("a"), row("b", True, 10), row("d")]),
+        )
+        broadcaster = StatsBroadcaster(build)
+        queue = broadcaster.subscribe()
+        await broadcaster.full_frame(EMPTY_SNAPSHOT)
+        await broadcaster.publish(EMPTY_SNAPSHOT)
+
+        event, data = parse_frame(queue.get_nowait())
+        assert event == "delta"
+        assert [c["id"] for c in data["changed"]] == ["b", "d"]
+        assert data["removed"] == ["c"]
+        assert data["summary"]["active_clients"] == 1 and data["summary"]["total_clients"] == 3
+        # The next full frame reflects the new state
+        _, full = parse_frame(await broadcaster.full_frame(EMPTY_SNAPSHOT))
+        assert [c["id"] for c in full["stats"]["clients"]] == ["a", "b", "d"]
+
+    asyncio.run(run())
+
+
+def test_slow_subscriber_gets_resync_instead_of_a_backlog():
+    async def run():
+        states = [({"running": True}, [row("a", rx=i)]) for i in range(5)]
+        broadcaster = StatsBroadcaster(FakeBuilder(*states), queue_size=2)
+        slow = broadcaster.subscribe()
+        await broadcaster.full_frame(EMPTY_SNAPSHOT)
+        for _ in range(3):
+            await broadcaster.publish(EMPTY_SNAPSHOT)
+        assert slow.get_nowait() is RESYNC
+        assert slow.empty()
+
+        # Deltas go on after the resync
+        await broadcaster.publish(EMPTY_SNAPSHOT)
+        event, data = parse_frame(slow.get_nowait())
+        assert event == "delta" and data["changed"] == [row("a", rx=4)]
+
+    asyncio.run(run())
+
+
+def test_nothing_is_built_without_subscribers():
+    async def run():
+        build = FakeBuilder(({"running": True}, [row("a")]), ({"running": True}, [row("a")]))
+        broadcaster = StatsBroadcaster(build)
+        broadcaster.on_snapshot(EMPTY_SNAPSHOT)
+        await asyncio.sleep(0)
+        assert build.calls == 0
+
+        queue = broadcaster.subscribe()
+        await broadcaster.full_frame(EMPTY_SNAPSHOT)
+        broadcaster.unsubscribe(queue)
+        assert broadcaster.subscribers == 0
+        # The last one left: the next connect builds from scratch
+        broadcaster.subscribe()
+        await broadcaster.full_frame(EMPTY_SNAPSHOT)
+        assert build.calls == 2
+
+    asyncio.run(run())
+
+
+def test_publishes_are_tracked_and_cancelled_on_stop():
+    async def run():
+        started = asyncio.Event()
+
+        async def hanging_build(snapshot):
+            started.set()
+            await asyncio.sleep(3600)
+
+        broadcaster = StatsBroadcaster(hanging_build)
+        broadcaster.subscribe()
+        broadcaster.on_snapshot(EMPTY_SNAPSHOT)
+        await started.wait()
+        assert len(broadcaster._publishing) == 1
+        task = next(iter(broadcaster._publishing))
+        await broadcaster.stop()
+        assert task.cancelled()
+        assert not broadcaster._publishing
+
+    asyncio.run(run())
@@ -0,0 +1,86 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from latency import LatencyStats
+from metrics import Exposition, MongoCommandMetrics, RouteMetrics, RouteMetricsMiddleware, format_labels, write_peer_metrics
+from wg_status import WGPeer, WGStatusSnapshot
+
+
+def lines(out: Exposition):
+    return out.render().decode().splitlines()
+
+
+def test_histogram_buckets_are_cumulative():
+    stats = LatencyStats(buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.1, 0.5, 3):
+        stats.observe(seconds)
+    out = Exposition()
+    out.histogram("x_seconds", "x", [((("route", "/a"),), stats)])
+    body = lines(out)
+    assert 'x_seconds_bucket{route="/a",le="0.1"} 2' in body
+    assert 'x_seconds_bucket{route="/a",le="1"} 3' in body
+    assert 'x_seconds_bucket{route="/a",le="+Inf"} 4' in body
+    assert 'x_seconds_count{route="/a"} 4' in body
+
+
+def test_label_values_are_escaped():
+    assert format_labels((("name", 'a"b\\c\nd'),)) == '{name="a\\"b\\\\c\\nd"}'
+
+
+def test_peer_metrics_from_snapshot():
+    now = time.time()
+    snapshot = WGStatusSnapshot(
+        running=True,
+        peers=(
+            WGPeer("PK1", "1.2.3.4:5", "10.8.0.2/32", int(now) - 10, 100, 200, 0),
+            WGPeer("PK2", None, "10.8.0.3/32", 0, 0, 0, 0),
+            WGPeer("PK3", None, "10.8.0.4/32", int(now) - 3600, 5, 6, 0),
+        ),
+        taken_at=now,
+    )
+    out = Exposition()
+    write_peer_metrics(out, {"wg0": snapshot}, {"wg0": 4})
+    body = lines(out)
+    assert 'wireguard_peers{interface="wg0"} 3' in body
+    assert 'wireguard_peers_active{interface="wg0"} 1' in body
+    assert 'wireguard_clients{interface="wg0"} 4' in body
+    assert 'wireguard_peer_receive_bytes_total{interface="wg0",public_key="PK1",allowed_ips="10.8.0.2/32"} 100' in body
+    # Peers that never completed a handshake have no age
+    assert not any(line.startswith("wireguard_peer_last_handshake_age_seconds") and "PK2" in line for line in body)
+
+
+def test_mongo_listener_times_commands_per_collection():
+    listener = MongoCommandMetrics()
+    started = SimpleNamespace(command_name="find", command={"find": "clients"}, connection_id=("h", 1), request_id=7)
+    listener.started(started)
+    listener.succeeded(SimpleNamespace(command_name="find", connection_id=("h", 1), request_id=7, duration_micros=1500))
+    listener.started(SimpleNamespace(
+        command_name="getMore", command={"getMore": 1, "collection": "clients"}, connection_id=("h", 1), request_id=8
+    ))
+    listener.failed(SimpleNamespace(command_name="getMore", connection_id=("h", 1), request_id=8, duration_micros=10))
+
+    assert listener.latency[("find", "clients")].count == 1
+    assert listener.failures == {("getMore", "clients"): 1}
+    out = Exposition()
+    listener.write(out)
+    assert 'mongodb_command_duration_seconds_sum{command="find",collection="clients"} 0.0015' in lines(out)
+
+
+def test_route_middleware_leaves_out_event_streams():
+    metrics = RouteMetrics()
+
+    def respond(content_type):
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", content_type)]})
+            await send({"type": "http.response.body", "body": b""})
+        return app
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "GET", "path": "/api/wg/stream"}
+    asyncio.run(RouteMetricsMiddleware(respond(b"text/event-stream"), metrics)(scope, None, send))
+    assert metrics.responses == {}
+    asyncio.run(RouteMetricsMiddleware(respond(b"application/json"), metrics)(scope, None, send))
+    assert metrics.responses == {("GET", "unmatched", 200): 1}
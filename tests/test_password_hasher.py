@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+from passlib.context import CryptContext
+
+from password_hasher import AuthBusy, PasswordHasher
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(CryptContext(schemes=["bcrypt"], bcrypt__rounds=4), workers=1, max_pending=1)
+    yield hasher
+    hasher.shutdown()
+
+
+def test_hash_and_verify_off_loop(hasher):
+    async def run():
+        hashed = await hasher.hash("secret")
+        assert await hasher.verify("secret", hashed)
+        assert not await hasher.verify("wrong", hashed)
+
+    asyncio.run(run())
+    stats = hasher.stats()
+    assert stats["hash_latency"]["count"] == 1
+    assert stats["verify_latency"]["count"] == 2
+    assert stats["pending"] == 0
+
+
+def test_rejects_beyond_max_pending(hasher):
+    async def run():
+        return await asyncio.gather(hasher.hash("a"), hasher.hash("b"), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert isinstance(results[1], AuthBusy)
+    assert hasher.rejected == 1
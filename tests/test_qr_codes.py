@@ -0,0 +1,27 @@
+import asyncio
+
+from qr_codes import QRCodeCache, render_qr
+
+
+def test_renders_png_and_svg():
+    assert render_qr("hello", "png").startswith(b"\x89PNG")
+    assert b"<svg" in render_qr("hello", "svg")
+
+
+def test_cache_is_keyed_on_server_version_and_bounded():
+    async def run():
+        cache = QRCodeCache(max_entries=2, workers=1)
+        try:
+            first = await cache.get("a", "key1", "config a")
+            assert await cache.get("a", "key1", "config a") is first
+            assert cache.hits == 1
+            await cache.get("a", "key2", "config a, new server key")
+            assert cache.misses == 2
+            await cache.get("b", "key2", "config b")
+            assert len(cache) == 2
+            cache.invalidate("a")
+            assert len(cache) == 1
+        finally:
+            cache.shutdown()
+
+    asyncio.run(run())
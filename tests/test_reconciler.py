@@ -0,0 +1,138 @@
+import asyncio
+from types import SimpleNamespace
+
+from reconciler import Reconciler, diff_peers, normalize_allowed_ips
+from wg_status import WGPeer, WGStatusSnapshot
+
+
+def test_diff_is_keyed_by_public_key():
+    desired = {"a": "10.8.0.2/32", "b": "10.8.0.3/32", "c": "10.8.0.4/32"}
+    actual = {"b": "10.8.0.3/32", "c": "10.8.0.9/32", "stale": "10.8.0.5/32"}
+    diff = diff_peers(desired, actual)
+    assert diff.add == [("a", "10.8.0.2/32")]
+    assert diff.update == [("c", "10.8.0.4/32")]
+    assert diff.remove == ["stale"]
+    assert len(diff) == 3
+
+
+def test_no_changes_when_in_sync():
+    peers = {"a": "10.8.0.2/32", "b": "fd00:8::2/128"}
+    diff = diff_peers(peers, dict(peers))
+    assert len(diff) == 0
+    assert not diff
+
+
+def test_allowed_ips_compare_as_sets_of_networks():
+    assert normalize_allowed_ips("10.8.0.2/32, 10.9.0.0/24") == normalize_allowed_ips("10.9.0.1/24,10.8.0.2/32")
+    assert normalize_allowed_ips("fd00:8:0::2/128") == normalize_allowed_ips("fd00:8::2/128")
+    assert not diff_peers({"a": "10.8.0.2/32,10.9.0.0/24"}, {"a": "10.9.0.0/24, 10.8.0.2/32"})
+
+
+class FakeCursor:
+    def __init__(self, docs, events):
+        self.docs = docs
+        self.events = events
+
+    def __aiter__(self):
+        self.events.append("mongo")
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakePersister:
+    def __init__(self, pending):
+        self.lock = asyncio.Lock()
+        self.pending = pending
+        self.calls = []
+
+    def peek(self):
+        return dict(self.pending)
+
+    def add_peer(self, public_key, allowed_ips):
+        self.calls.append(("add", public_key, allowed_ips))
+
+    def remove_peer(self, public_key):
+        self.calls.append(("remove", public_key))
+
+
+class FakeInterface:
+    """Mongo wants a, b and c; the kernel and the config file differ in other ways"""
+
+    name = "wg0"
+    clients_filter = {"interface": "wg0"}
+
+    def __init__(self):
+        self.events = []
+        self.finds = []
+        self.clauses = []
+        self.server_config = SimpleNamespace(get=self._server_config)
+        self.status_sampler = SimpleNamespace(fresh=self._fresh)
+        self.db = SimpleNamespace(clients=SimpleNamespace(find=self._find))
+        # The file still has `old`; `c` is added but not written yet
+        self.config_model = SimpleNamespace(peers={
+            "a": {"AllowedIPs": "10.8.0.2/32"},
+            "b": {"AllowedIPs": "10.8.0.3/32"},
+            "old": {"AllowedIPs": "10.8.0.7/32"},
+        })
+        self.config_persister = FakePersister({"c": ("add", "10.8.0.4/32")})
+
+    async def _server_config(self):
+        return {"public_key": "server"}
+
+    async def _fresh(self):
+        self.events.append("dump")
+        return WGStatusSnapshot(running=True, taken_at=1.0, peers=(
+            WGPeer("b", None, "10.8.0.9/32", 0, 0, 0, 0),
+            WGPeer("c", None, "10.8.0.4/32", 0, 0, 0, 0),
+            WGPeer("stale", None, "10.8.0.5/32", 0, 0, 0, 0),
+        ))
+
+    def _find(self, query, projection):
+        self.finds.append(query)
+        docs = [{"public_key": key, "ip_address": ip} for key, ip in (("a", "10.8.0.2"), ("b", "10.8.0.3"), ("c", "10.8.0.4"))]
+        return FakeCursor(docs, self.events)
+
+    def peer_allowed_ips(self, ip):
+        return f"{ip}/32"
+
+    async def wg_set_clauses(self, clauses):
+        self.clauses.extend(clauses)
+        return True
+
+
+def test_reconcile_applies_kernel_and_file_diffs_separately():
+    iface = FakeInterface()
+    report = asyncio.run(Reconciler(iface).reconcile())
+
+    # The dump is read before Mongo, so a peer set meanwhile is never taken for stale
+    assert iface.events[:2] == ["dump", "mongo"]
+    assert iface.finds == [{"interface": "wg0", "enabled": {"$ne": False}}]
+    assert iface.clauses == [
+        ["peer", "a", "allowed-ips", "10.8.0.2/32"],
+        ["peer", "b", "allowed-ips", "10.8.0.3/32"],
+        ["peer", "stale", "remove"],
+    ]
+    # The pending add of c counts as written; only `old` is left to remove
+    assert iface.config_persister.calls == [("remove", "old")]
+    # A fresh snapshot shows the corrected state
+    assert iface.events[2:] == ["dump"]
+    assert report["ok"] and report["running"] and not report["dry_run"]
+    assert report["desired"] == 3
+    assert report["kernel"] == {"added": 1, "updated": 1, "removed": 1}
+    assert report["config_file"] == {"added": 0, "updated": 0, "removed": 1}
+
+
+def test_dry_run_reports_without_applying():
+    iface = FakeInterface()
+    reconciler = Reconciler(iface)
+    report = asyncio.run(reconciler.reconcile(dry_run=True))
+
+    assert iface.clauses == [] and iface.config_persister.calls == []
+    assert iface.events == ["dump", "mongo"]
+    assert report["dry_run"]
+    assert report["kernel"] == {"added": 1, "updated": 1, "removed": 1}
+    assert report["config_file"] == {"added": 0, "updated": 0, "removed": 1}
+    assert reconciler.peers_changed == 0 and reconciler.last_report is report
@@ -0,0 +1,84 @@
+import asyncio
+from datetime import datetime, timezone
+
+from server_config import ServerConfigStore, WGServerConfig
+
+
+class CountingCollection:
+    """server_config collection that counts its reads"""
+
+    def __init__(self):
+        self.docs = []
+        self.reads = 0
+
+    async def find_one(self, query, projection=None):
+        self.reads += 1
+        return next((dict(doc) for doc in self.docs if doc["interface"] == query["interface"]), None)
+
+    async def insert_one(self, doc):
+        self.docs.append(dict(doc))
+
+
+def config(public_key="server-pub"):
+    return WGServerConfig(
+        private_key="server-priv", public_key=public_key, address="10.8.0.1/24", port=51820,
+        initialized=True, created_at=datetime(2026, 10, 1, tzinfo=timezone.utc),
+    )
+
+
+def test_missing_config_is_not_cached():
+    async def run():
+        collection = CountingCollection()
+        store = ServerConfigStore(collection, "wg0")
+        assert await store.get() is None
+        assert await store.get() is None
+        assert collection.reads == 2
+
+        # Another worker initializes the server
+        await ServerConfigStore(collection, "wg0").save(config())
+        assert (await store.get()).public_key == "server-pub"
+        assert collection.reads == 3
+
+    asyncio.run(run())
+
+
+def test_cache_is_hit_after_the_first_read_and_updated_on_save():
+    async def run():
+        collection = CountingCollection()
+        await ServerConfigStore(collection, "wg0").save(config())
+        store = ServerConfigStore(collection, "wg0")
+        first = await store.get()
+        assert first == config()
+        for _ in range(3):
+            assert await store.get() is first
+        assert collection.reads == 1
+
+        replaced = config("new-pub")
+        await store.save(replaced)
+        assert await store.get() is replaced
+        assert collection.reads == 1
+        assert collection.docs[-1]["interface"] == "wg0"
+
+        # Configs are per interface
+        assert await ServerConfigStore(collection, "wg1").get() is None
+
+    asyncio.run(run())
+
+
+def test_invalidate_forces_a_read():
+    async def run():
+        collection = CountingCollection()
+        store = ServerConfigStore(collection, "wg0")
+        await store.save(config())
+        assert await store.get() == config()
+        assert collection.reads == 0
+
+        # The document changed behind the cache's back
+        collection.docs = [{**collection.docs[0], "public_key": "rotated"}]
+        assert (await store.get()).public_key == "server-pub"
+        store.invalidate()
+        assert store.cached is None
+        assert (await store.get()).public_key == "rotated"
+        assert collection.reads == 1
+
+    asyncio.run(run())
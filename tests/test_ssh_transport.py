@@ -0,0 +1,72 @@
+import asyncio
+
+from ssh_transport import SSHTransport
+
+
+class RecordingRunner:
+    def __init__(self):
+        self.commands = []
+
+    async def run(self, cmd, input=None, timeout=None):
+        self.commands.append(cmd)
+        return "", "", 0
+
+
+def transport(tmp_path, pool_size=2):
+    return SSHTransport(
+        RecordingRunner(), "gw.example.org", port=2222, user="admin", key_path="/keys/id",
+        pool_size=pool_size, control_dir=tmp_path,
+    )
+
+
+def test_command_is_quoted_and_multiplexed(tmp_path):
+    ssh = transport(tmp_path)
+    for slot in ssh._slots:
+        slot.healthy = True
+    asyncio.run(ssh.run(["wg", "set", "wg0", "peer", "a b'c", "allowed-ips", "10.8.0.2/32"]))
+
+    cmd = ssh.runner.commands[0]
+    assert cmd[:5] == ["ssh", "-p", "2222", "-i", "/keys/id"]
+    assert "ControlMaster=no" in cmd
+    # User and host can never be read as ssh options
+    assert cmd[-5:-1] == ["-l", "admin", "--", "gw.example.org"]
+    # One argument for the remote shell, with the odd key quoted
+    assert cmd[-1] == "wg set wg0 peer 'a b'\"'\"'c' allowed-ips 10.8.0.2/32"
+
+
+def test_copy_ends_options_before_the_paths(tmp_path):
+    ssh = SSHTransport(RecordingRunner(), "fd00::1", user="admin", control_dir=tmp_path)
+    asyncio.run(ssh.copy_to("/tmp/wg0.conf", "/etc/wireguard/wg0.conf"))
+    cmd = ssh.runner.commands[0]
+    assert cmd[0] == "scp" and "User=admin" in cmd
+    assert cmd[-3:] == ["--", "/tmp/wg0.conf", "[fd00::1]:/etc/wireguard/wg0.conf"]
+
+
+def test_slots_rotate_over_healthy_sessions(tmp_path):
+    ssh = transport(tmp_path, pool_size=3)
+    ssh._slots[1].healthy = True
+    ssh._slots[2].healthy = True
+    picked = [ssh._pick_slot() for _ in range(4)]
+    assert picked == [ssh._slots[1], ssh._slots[2], ssh._slots[1], ssh._slots[2]]
+
+
+def test_background_reconnect_is_tracked_and_cancelled_on_stop(tmp_path):
+    ssh = transport(tmp_path, pool_size=1)
+    started = asyncio.Event()
+
+    async def hanging_connect(slot):
+        started.set()
+        await asyncio.sleep(3600)
+
+    ssh._connect = hanging_connect
+
+    async def run():
+        await ssh.run(["wg", "show"])
+        await started.wait()
+        assert len(ssh._background) == 1
+        task = next(iter(ssh._background))
+        await ssh.stop()
+        assert task.cancelled()
+        assert not ssh._background
+
+    asyncio.run(run())
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from metrics import MongoCommandMetrics
+from tracing import RequestTrace, SlowRequestLog, StackSampler, TracingMiddleware, authenticated, record, span
+
+
+def test_spans_outside_a_request_are_ignored():
+    record("mongo", 1.0)
+    with span("render") as s:
+        pass
+    assert s.trace is None
+
+
+def test_middleware_collects_spans_from_threads_and_sets_header():
+    log = SlowRequestLog(threshold=0.0, size=2)
+    listener = MongoCommandMetrics()
+    sent = []
+
+    async def app(scope, receive, send):
+        authenticated()
+        with span("render"):
+            time.sleep(0.002)
+        # Spans recorded on worker threads that run with the request's context
+        await asyncio.to_thread(record, "cmd.wg", 0.004)
+        listener.started(SimpleNamespace(command_name="find", command={"find": "clients"}, connection_id=1, request_id=1))
+        listener.succeeded(SimpleNamespace(command_name="find", connection_id=1, request_id=1, duration_micros=3000))
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = TracingMiddleware(app, log)
+    for path in ("/a", "/b", "/c"):
+        asyncio.run(middleware({"type": "http", "method": "GET", "path": path}, None, send))
+
+    header = dict(sent[0]["headers"])[b"server-timing"].decode()
+    assert header.startswith('cmd.wg;dur=4.000;desc="1x", mongo;dur=3.000;desc="1x", render;dur=')
+    assert "total;dur=" in header
+
+    # Bounded ring of the most recent slow requests, slowest first
+    entries = log.entries()
+    assert log.traced == 3 and len(entries) == 2
+    assert {e["path"] for e in entries} == {"/b", "/c"}
+    assert entries[0]["duration_ms"] >= entries[1]["duration_ms"]
+    assert entries[0]["spans"]["mongo"] == {"ms": 3.0, "count": 1}
+
+
+def respond(content_type: bytes, bcrypt: bool = False, login: bool = False):
+    async def app(scope, receive, send):
+        if bcrypt:
+            record("bcrypt", 0.2)
+        if login:
+            authenticated()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", content_type)]})
+        await send({"type": "http.response.body", "body": b""})
+    return app
+
+
+def run_middleware(middleware, path: str = "/api/auth/login") -> list:
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware({"type": "http", "method": "POST", "path": path}, None, send))
+    return [name for name, _ in sent[0]["headers"]]
+
+
+def test_server_timing_only_for_authenticated_requests_by_default():
+    log = SlowRequestLog(threshold=0.0)
+    # The bcrypt span of a login would tell which usernames exist
+    assert run_middleware(TracingMiddleware(respond(b"application/json", bcrypt=True), log)) == [b"content-type"]
+    assert b"server-timing" in run_middleware(TracingMiddleware(respond(b"application/json", login=True), log))
+    assert b"server-timing" in run_middleware(TracingMiddleware(respond(b"application/json"), log, server_timing="all"))
+    off = TracingMiddleware(respond(b"application/json", login=True), log, server_timing="off")
+    assert run_middleware(off) == [b"content-type"]
+    # Traced either way
+    assert log.traced == 4
+
+
+def test_stream_responses_stay_out_of_the_slow_log():
+    log = SlowRequestLog(threshold=0.0)
+    run_middleware(TracingMiddleware(respond(b"text/event-stream; charset=utf-8"), log), "/api/wg/stream")
+    export = TracingMiddleware(respond(b"application/zip"), log, stream_types=["application/zip"])
+    run_middleware(export, "/api/wg/clients/export")
+    assert log.traced == 0
+    run_middleware(TracingMiddleware(respond(b"application/zip"), log), "/api/wg/clients/export")
+    assert log.traced == 1
+
+
+def test_finished_traces_stop_recording():
+    trace = RequestTrace("GET", "/")
+    trace.add("mongo", 0.5)
+    trace.add("mongo", 0.25)
+    trace.finished = True
+    trace.add("mongo", 10)
+    assert trace.spans == {"mongo": [0.75, 2]}
+
+
+def test_fast_requests_are_not_logged():
+    log = SlowRequestLog(threshold=1.0)
+    trace = RequestTrace("GET", "/")
+    trace.duration = 0.1
+    log.observe(trace)
+    assert log.traced == 1 and log.entries() == []
+
+
+def test_stack_sampler_folds_stacks_of_target_thread():
+    done = threading.Event()
+
+    def busy_worker():
+        while not done.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_worker)
+    worker.start()
+    sampler = StackSampler(interval=0.001, max_stacks=3)
+    sampler.start(worker.ident)
+    time.sleep(0.1)
+    sampler.stop()
+    done.set()
+    worker.join()
+
+    assert sampler.samples > 0
+    lines = sampler.folded().splitlines()
+    assert any("busy_worker" in line for line in lines)
+    assert len(lines) <= 4  # max_stacks plus <other>
+    sampler.reset()
+    assert sampler.folded() == ""
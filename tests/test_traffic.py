@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from traffic import PeerRing, TrafficRecorder, counter_delta
+from wg_status import WGPeer, WGStatusSnapshot
+
+
+T0 = datetime(2026, 10, 18, 12, 0, tzinfo=timezone.utc).timestamp()
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, *args):
+        return self
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeRollups:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        return FakeCursor([d for d in self.docs if d["peer"] == query["peer"]])
+
+
+def snapshot(rx, tx, taken_at):
+    return WGStatusSnapshot(True, (WGPeer("a", None, "", 0, rx, tx, 0),), taken_at)
+
+
+def test_counter_delta_handles_resets():
+    assert counter_delta(100, 150) == 50
+    assert counter_delta(100, 100) == 0
+    # Lower than before: the counter restarted and everything since counts
+    assert counter_delta(100, 30) == 30
+
+
+def test_ring_keeps_only_the_newest_samples():
+    ring = PeerRing(3, 0, 0)
+    for i in range(5):
+        ring.append(T0 + i, 10 * (i + 1), 1)
+    # Samples 0 and 1 were overwritten
+    assert sorted(ring.rx) == [30, 40, 50]
+    assert ring.rate(T0 - 100, 10) == (12.0, 0.3)
+    assert ring.rate(T0 + 3, 10) == (5.0, 0.1)
+
+
+def test_observe_baseline_deltas_and_reset():
+    recorder = TrafficRecorder(db=None)
+    recorder.observe(snapshot(1000, 500, T0))
+    assert recorder._samples == []  # first sighting is only the baseline
+    recorder.observe(snapshot(1600, 700, T0 + 5))
+    recorder.observe(snapshot(1600, 700, T0 + 10))  # no traffic, no sample
+    recorder.observe(snapshot(100, 50, T0 + 15))  # interface restarted
+    assert [(rx, tx) for _, _, rx, tx in recorder._samples] == [(600, 200), (100, 50)]
+    assert recorder._rollups["1h"] == {("a", int(T0)): [700, 250]}
+
+
+def test_query_merges_unflushed_rollups():
+    bucket = datetime.fromtimestamp(T0, timezone.utc)
+    db = {"traffic_1m": FakeRollups([
+        # Stored naive, as Mongo returns it
+        {"peer": "a", "bucket": bucket.replace(tzinfo=None), "rx": 600, "tx": 60},
+    ])}
+    recorder = TrafficRecorder(db)
+    recorder._record(T0 + 30, "a", 6, 0)
+    recorder._record(T0 + 60, "a", 120, 12)
+    recorder._record(T0 + 60, "b", 999, 999)
+
+    result = asyncio.run(recorder.query("a", bucket, bucket + timedelta(hours=1)))
+    assert result["resolution"] == "1m"
+    assert [(p["rx_bytes"], p["tx_bytes"]) for p in result["points"]] == [(606, 60), (120, 12)]
+    assert result["points"][0]["rx_rate"] == 606 / 60
+
+
+def test_tier_selection():
+    end = datetime(2026, 10, 18, tzinfo=timezone.utc)
+    assert TrafficRecorder.pick_tier(end - timedelta(hours=6), end) == "1m"
+    assert TrafficRecorder.pick_tier(end - timedelta(hours=7), end) == "1h"
+    assert TrafficRecorder.pick_tier(end - timedelta(days=31), end) == "1h"
+    assert TrafficRecorder.pick_tier(end - timedelta(days=365), end) == "1d"
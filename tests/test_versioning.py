@@ -0,0 +1,58 @@
+import gzip
+import json
+
+from versioning import VersionedIndex, accepts_gzip, encode_json, etag_matches
+
+
+def test_changes_since_a_version():
+    index = VersionedIndex()
+    index.load([("a", None), ("b", None)])
+    start = index.version
+    index.touch("a")
+    index.remove("b")
+    index.touch("c")
+    assert index.changes(start) == (["a", "c"], ["b"])
+    assert index.changes(index.version) == ([], [])
+
+
+def test_unknown_versions_need_a_full_response():
+    index = VersionedIndex()
+    assert index.changes(index.version - 1) is None
+    assert index.changes(index.version + 1) is None
+
+
+def test_update_only_bumps_entries_that_differ():
+    index = VersionedIndex()
+    index.update({"a": {"rx": 1}, "b": {"rx": 2}})
+    version = index.version
+    assert not index.update({"a": {"rx": 1}, "b": {"rx": 2}})
+    assert index.update({"a": {"rx": 5}})
+    assert index.changes(version) == (["a"], ["b"])
+
+
+def test_dropped_tombstones_raise_the_floor():
+    index = VersionedIndex(max_tombstones=1)
+    index.load([("a", None), ("b", None)])
+    start = index.version
+    index.remove("a")
+    index.remove("b")
+    assert index.changes(start) is None
+    assert index.changes(index.version - 1) == ([], ["b"])
+
+
+def test_etag_matching():
+    assert etag_matches('W/"5"', 'W/"5"')
+    assert etag_matches('"4", "5"', 'W/"5"')
+    assert etag_matches("*", 'W/"5"')
+    assert not etag_matches('W/"4"', 'W/"5"')
+    assert not etag_matches(None, 'W/"5"')
+
+
+def test_gzip_negotiation():
+    assert accepts_gzip("gzip, deflate, br")
+    assert not accepts_gzip("gzip;q=0")
+    assert not accepts_gzip(None)
+    payload = {"clients": ["x" * 100] * 20}
+    body, gzipped = encode_json(payload, True)
+    assert gzipped and json.loads(gzip.decompress(body)) == payload
+    assert encode_json({"a": 1}, True) == (b'{"a":1}', False)
@@ -0,0 +1,63 @@
+import asyncio
+import io
+
+from wg_config import WGConfig, stream_config
+
+
+SAMPLE = """# managed by wireguard-admin
+[Interface]
+PrivateKey = c2VydmVy
+Address = 10.8.0.1/24
+PostUp = iptables -A FORWARD -i %i -j ACCEPT
+
+[Peer]
+PublicKey = a2V5MQ==
+AllowedIPs = 10.8.0.2/32
+
+[Peer]
+# laptop
+PublicKey = a2V5Mg==
+AllowedIPs = 10.8.0.3/32
+PersistentKeepalive = 25
+"""
+
+
+def test_parse_keeps_interface_and_indexes_peers():
+    config = WGConfig.parse(SAMPLE)
+    assert config.interface.startswith("# managed by wireguard-admin\n[Interface]\n")
+    assert "PostUp = iptables -A FORWARD -i %i -j ACCEPT" in config.interface
+    assert list(config.peers) == ["a2V5MQ==", "a2V5Mg=="]
+    assert config.peers["a2V5Mg=="] == {"AllowedIPs": "10.8.0.3/32", "PersistentKeepalive": "25"}
+
+
+def test_edits_round_trip_through_render():
+    config = WGConfig.parse(SAMPLE)
+    assert config.remove_peer("a2V5MQ==")
+    assert not config.remove_peer("a2V5MQ==")
+    config.set_peer("a2V5Mw==", "10.8.0.4/32")
+    assert config.update_peer("a2V5Mg==", AllowedIPs="10.8.0.9/32")
+
+    reparsed = WGConfig.parse(config.render())
+    assert reparsed.interface == config.interface
+    assert reparsed.peers == {
+        "a2V5Mg==": {"AllowedIPs": "10.8.0.9/32", "PersistentKeepalive": "25"},
+        "a2V5Mw==": {"AllowedIPs": "10.8.0.4/32"},
+    }
+
+
+def test_apply_persister_changes():
+    config = WGConfig.parse(SAMPLE)
+    config.apply({"a2V5MQ==": ("remove", None), "a2V5NA==": ("add", "10.8.0.5/32")})
+    assert "a2V5MQ==" not in config
+    assert config.peers["a2V5NA=="] == {"AllowedIPs": "10.8.0.5/32"}
+
+
+def test_stream_config_matches_render():
+    async def peers():
+        for i in range(3):
+            yield f"key{i}", f"10.8.0.{i + 2}/32"
+
+    out = io.StringIO()
+    config = asyncio.run(stream_config("[Interface]\nPrivateKey = c2VydmVy\n", peers(), out))
+    assert len(config) == 3
+    assert out.getvalue() == config.render()
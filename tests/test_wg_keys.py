@@ -0,0 +1,63 @@
+import asyncio
+import base64
+
+import pytest
+
+from wg_keys import KeyPool, generate_keypair, generate_private_key, public_key_from_private
+
+
+# (private key, `wg pubkey` output) pairs, taken from the RFC 7748 X25519 test
+# vectors; `wg pubkey` prints exactly these base64 strings for these inputs
+WG_PUBKEY_SAMPLES = [
+    ("dwdtCnMYpX08FsFyUbJmRd9ML4frwJkqsXf7pR25LCo=", "hSDwCYkwp1R0i33ctD73Wg2/Og0mOBr066SpjqqbTmo="),
+    ("XasIfmJKikt54X+Lg4AO5m87sSkmGLb9HC+LJ/+I4Os=", "3p7bfXt9wbTTW2HC7OQ1Nz+DQ8hbeGdNrfx+FG+IK08="),
+]
+
+
+@pytest.mark.parametrize("private_key,expected", WG_PUBKEY_SAMPLES)
+def test_public_key_matches_wg_pubkey(private_key, expected):
+    assert public_key_from_private(private_key) == expected
+    # `wg pubkey` reads the key from stdin, trailing newline included
+    assert public_key_from_private(private_key + "\n") == expected
+
+
+def test_private_key_is_clamped_like_wg_genkey():
+    raw = base64.b64decode(generate_private_key())
+    assert len(raw) == 32
+    assert raw[0] & 7 == 0
+    assert raw[31] & 128 == 0
+    assert raw[31] & 64 == 64
+
+
+def test_public_key_rejects_wrong_length():
+    with pytest.raises(ValueError):
+        public_key_from_private(base64.b64encode(b"short").decode())
+
+
+def test_keypair_is_consistent():
+    private_key, public_key = generate_keypair()
+    assert public_key_from_private(private_key) == public_key
+
+
+def test_key_pool_refills_in_background():
+    async def scenario():
+        pool = KeyPool(size=8, batch=4)
+        pool.start()
+        for _ in range(50):
+            if len(pool) == 8:
+                break
+            await asyncio.sleep(0.01)
+        assert len(pool) == 8
+
+        keys = pool.take(12)  # more than the pool holds
+        assert len(keys) == 12
+        assert len({k[0] for k in keys}) == 12
+
+        for _ in range(50):
+            if len(pool) == 8:
+                break
+            await asyncio.sleep(0.01)
+        assert len(pool) == 8
+        await pool.stop()
+
+    asyncio.run(scenario())
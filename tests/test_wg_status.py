@@ -0,0 +1,113 @@
+import asyncio
+
+from wg_status import StatusSampler, WGPeer, parse_wg_dump
+
+
+INTERFACE_LINE = "cHJpdmF0ZQ==\tcHVibGlj\t51820\toff"
+
+
+def test_interface_line_is_skipped():
+    assert parse_wg_dump(INTERFACE_LINE + "\n") == []
+    assert parse_wg_dump("") == []
+
+
+def test_peer_fields():
+    dump = "\n".join([
+        INTERFACE_LINE,
+        "A=\t(none)\t198.51.100.7:51820\t10.8.0.2/32\t1700000000\t1234\t5678\t25",
+        "B=\tcHNr\t(none)\t(none)\t0\t0\t0\toff",
+        "C=\t(none)\t[2001:db8::1]:51820\tfd00:8::2/128,10.8.0.3/32,fd00:9::/64\t1700000100\t1\t2\toff",
+    ])
+    assert parse_wg_dump(dump) == [
+        WGPeer("A=", "198.51.100.7:51820", "10.8.0.2/32", 1700000000, 1234, 5678, 25),
+        # Never handshaked, no endpoint, keepalive off
+        WGPeer("B=", None, "", 0, 0, 0, 0),
+        WGPeer("C=", "[2001:db8::1]:51820", "fd00:8::2/128,10.8.0.3/32,fd00:9::/64", 1700000100, 1, 2, 0),
+    ]
+
+
+def test_short_and_malformed_lines_are_skipped():
+    dump = "\n".join([
+        INTERFACE_LINE,
+        "A=\t(none)\t(none)\t10.8.0.2/32",
+        "",
+        "B=\t(none)\t(none)\t10.8.0.3/32\tsoon\t0\t0\toff",
+        "C=\t(none)\t(none)\t10.8.0.4/32\t0\t10\t20\toff",
+    ])
+    assert [peer.public_key for peer in parse_wg_dump(dump)] == ["C="]
+
+
+class GatedFetch:
+    """Fetch that returns the generation it started in, once released"""
+
+    def __init__(self):
+        self.generation = 0
+        self.calls = 0
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def __call__(self):
+        self.calls += 1
+        started_in = self.generation
+        await self.gate.wait()
+        if started_in < 0:
+            raise RuntimeError("node unreachable")
+        return {"running": True, "peers": [WGPeer(f"gen{started_in}", None, "", 0, 0, 0, 0)]}
+
+
+def test_current_samples_once_then_serves_cache():
+    async def run():
+        fetch = GatedFetch()
+        sampler = StatusSampler(fetch)
+        seen = []
+        sampler.subscribe(seen.append)
+        first = await sampler.current()
+        assert first.sampled and first.running
+        assert await sampler.current() is first
+        assert fetch.calls == 1 and seen == [first]
+
+    asyncio.run(run())
+
+
+def test_refresh_joins_and_fresh_waits_out_a_sample_in_flight():
+    async def run():
+        fetch = GatedFetch()
+        sampler = StatusSampler(fetch)
+        fetch.gate.clear()
+        early = asyncio.ensure_future(sampler.refresh())
+        while fetch.calls == 0:
+            await asyncio.sleep(0)
+
+        # The state changes (e.g. wg-quick up) while that sample is running
+        fetch.generation = 1
+        joined = asyncio.ensure_future(sampler.refresh())
+        fresh = asyncio.ensure_future(sampler.fresh())
+        await asyncio.sleep(0)
+        fetch.gate.set()
+
+        assert (await early).peers[0].public_key == "gen0"
+        assert (await joined).peers[0].public_key == "gen0"
+        assert (await fresh).peers[0].public_key == "gen1"
+        assert fetch.calls == 2
+        assert sampler.snapshot.peers[0].public_key == "gen1"
+
+    asyncio.run(run())
+
+
+def test_failed_sample_publishes_stopped_snapshot_and_subscriber_errors_are_contained():
+    async def run():
+        fetch = GatedFetch()
+        fetch.generation = -1
+        sampler = StatusSampler(fetch)
+
+        def broken(snapshot):
+            raise ValueError("subscriber bug")
+
+        seen = []
+        sampler.subscribe(broken)
+        sampler.subscribe(seen.append)
+        snapshot = await sampler.refresh()
+        assert not snapshot.running and snapshot.peers == ()
+        assert seen == [snapshot]
+
+    asyncio.run(run())